@@ -0,0 +1,66 @@
+"""adds lookup indexes for binaries and repos
+
+Revision ID: 7b2f0c9e4d61
+Revises: 3f6a9d2c8e14
+Create Date: 2026-10-18 16:02:47.210934
+
+The indexes are built with CREATE INDEX CONCURRENTLY on PostgreSQL, so the
+tables are not locked for writes and this can run on a live database. That
+can't happen inside a transaction, so every index is created in its own
+autocommit block. If a build fails (or is interrupted) PostgreSQL leaves an
+INVALID index behind, which needs to be dropped before running this again.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7b2f0c9e4d61'
+down_revision = '3f6a9d2c8e14'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+binaries_columns = [
+    'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch', 'name', 'flavor'
+]
+repos_columns = [
+    'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'flavor'
+]
+
+
+def upgrade():
+    # the binaries index is unique, fail early (and with the offending rows)
+    # rather than leaving an invalid index behind. The index doesn't consider
+    # rows with a NULL in any of its columns equal (GROUP BY does), so those
+    # are left out of the check
+    columns = ', '.join(binaries_columns)
+    not_null = ' AND '.join('%s IS NOT NULL' % name for name in binaries_columns)
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT %s, count(*) FROM binaries WHERE %s GROUP BY %s HAVING count(*) > 1' % (
+            columns, not_null, columns)
+    )).fetchall()
+    if duplicates:
+        raise RuntimeError(
+            'binaries need to be unique before they can be indexed, duplicates: %s' % (
+                ', '.join(str(tuple(row)) for row in duplicates))
+        )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_binaries_lookup', 'binaries', binaries_columns,
+            unique=True, postgresql_concurrently=True
+        )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_repos_lookup', 'repos', repos_columns,
+            unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_repos_lookup', table_name='repos', postgresql_concurrently=True)
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_binaries_lookup', table_name='binaries', postgresql_concurrently=True)
@@ -0,0 +1,137 @@
+"""makes the identity of repos unique
+
+Revision ID: b8d4e2f7a613
+Revises: f1c7a3b58e20
+Create Date: 2026-10-18 21:48:03.116482
+
+There can only be one repo for a project, ref, sha1, distro, distro version
+and flavor, so that concurrent uploads can insert it with ``ON CONFLICT DO
+NOTHING``. Duplicates that were already created are merged first into the
+oldest of them: their binaries are moved to it, and it is marked to be
+updated. The directories of the repos that are removed (when they are not the
+directory of a repo that is kept) are not removed from disk, they are logged
+as warnings so that they can be removed by hand.
+
+On PostgreSQL the unique index is built with CREATE INDEX CONCURRENTLY next
+to the current one, which is then replaced, so the table is not locked for
+writes. If duplicates are created while it builds (by a version that doesn't
+upsert repos) the build fails and leaves an INVALID index called
+``ix_repos_lookup_unique`` behind, which needs to be dropped before running
+this again.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4e2f7a613'
+down_revision = 'f1c7a3b58e20'
+branch_labels = None
+depends_on = None
+
+import json
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+generic_versions = ['generic', 'universal', 'any']
+
+repos_columns = [
+    'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'flavor'
+]
+
+
+def merge_duplicates(connection):
+    """
+    Move the binaries of duplicated repos to the oldest one, remove the rest
+    and summarize the ones that were kept again. Returns the directories of
+    the removed repos that no other repo uses.
+    """
+    columns = ', '.join(repos_columns)
+    groups = connection.execute(
+        'SELECT array_agg(id ORDER BY id) FROM repos GROUP BY %s HAVING count(*) > 1' % columns
+        if connection.dialect.name == 'postgresql' else
+        "SELECT group_concat(id) FROM repos GROUP BY %s HAVING count(*) > 1" % columns
+    ).fetchall()
+    kept = []
+    removed_paths = set()
+    for ids, in groups:
+        if isinstance(ids, str):
+            ids = sorted(int(i) for i in ids.split(','))
+        keep, duplicates = ids[0], list(ids[1:])
+        params = dict(keep=keep, duplicates=tuple(duplicates))
+        removed_paths.update(path for path, in connection.execute(
+            sa.text('SELECT path FROM repos WHERE id IN :duplicates AND path IS NOT NULL').bindparams(
+                sa.bindparam('duplicates', expanding=True)), duplicates=params['duplicates']))
+        connection.execute(
+            sa.text('UPDATE binaries SET repo_id = :keep WHERE repo_id IN :duplicates').bindparams(
+                sa.bindparam('duplicates', expanding=True)), **params)
+        connection.execute(
+            sa.text('DELETE FROM repos WHERE id IN :duplicates').bindparams(
+                sa.bindparam('duplicates', expanding=True)), duplicates=params['duplicates'])
+        kept.append(keep)
+
+    for repo_id in kept:
+        rows = connection.execute(
+            sa.text(
+                'SELECT arch, distro_version, count(*) FROM binaries '
+                'WHERE repo_id = :repo_id GROUP BY arch, distro_version'
+            ), repo_id=repo_id
+        ).fetchall()
+        connection.execute(
+            sa.text(
+                'UPDATE repos SET archs = :archs, has_generic = :has_generic, '
+                'binary_count = :binary_count, needs_update = :needs_update WHERE id = :repo_id'
+            ),
+            repo_id=repo_id,
+            archs=json.dumps(sorted(set(arch for arch, _, _ in rows))),
+            has_generic=any(version in generic_versions for _, version, _ in rows),
+            binary_count=sum(count for _, _, count in rows),
+            needs_update=True,
+        )
+
+    if not removed_paths:
+        return []
+    # duplicates usually have the same directory as the repo that was kept
+    used = set(path for path, in connection.execute(
+        sa.text('SELECT path FROM repos WHERE path IN :paths').bindparams(
+            sa.bindparam('paths', expanding=True)), paths=tuple(removed_paths)))
+    return sorted(removed_paths - used)
+
+
+def upgrade():
+    for path in merge_duplicates(op.get_bind()):
+        logger.warning(
+            'the repo in %s was a duplicate and was removed, its directory needs '
+            'to be removed by hand', path
+        )
+
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_repos_lookup', table_name='repos')
+        op.create_index('ix_repos_lookup', 'repos', repos_columns, unique=True)
+        return
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_repos_lookup_unique', 'repos', repos_columns,
+            unique=True, postgresql_concurrently=True
+        )
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_repos_lookup', table_name='repos', postgresql_concurrently=True)
+    op.execute('ALTER INDEX ix_repos_lookup_unique RENAME TO ix_repos_lookup')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_repos_lookup', table_name='repos')
+        op.create_index('ix_repos_lookup', 'repos', repos_columns, unique=False)
+        return
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_repos_lookup_nonunique', 'repos', repos_columns,
+            unique=False, postgresql_concurrently=True
+        )
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_repos_lookup', table_name='repos', postgresql_concurrently=True)
+    op.execute('ALTER INDEX ix_repos_lookup_nonunique RENAME TO ix_repos_lookup')
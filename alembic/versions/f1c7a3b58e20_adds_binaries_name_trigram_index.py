@@ -0,0 +1,60 @@
+"""adds a trigram index on the names of binaries
+
+Revision ID: f1c7a3b58e20
+Revises: d2e6b4a9f713
+Create Date: 2026-10-18 21:12:40.581227
+
+Substring searches (``name-has``) compile to ``LIKE '%value%'``, which can't
+use the B-tree index on the name. In PostgreSQL a GIN index with the
+``pg_trgm`` operator class can serve them. The extension comes with
+``postgresql-contrib``; where it isn't available (or on other databases, like
+SQLite) nothing is done and substring searches keep scanning the table.
+
+The index is built with CREATE INDEX CONCURRENTLY, so it needs its own
+autocommit block. If the build fails PostgreSQL leaves an INVALID index
+behind, which needs to be dropped before running this again.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f1c7a3b58e20'
+down_revision = 'd2e6b4a9f713'
+branch_labels = None
+depends_on = None
+
+import logging
+from alembic import op
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+name_trigram_index = 'ix_binaries_name_trgm'
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+    available = connection.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    ).first()
+    if available is None:
+        logger.warning(
+            'the pg_trgm extension is not available (install postgresql-contrib), '
+            'substring searches on binary names will not be indexed'
+        )
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.create_index(
+            name_trigram_index, 'binaries', ['name'],
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # the extension stays, other things might be using it
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % name_trigram_index)
@@ -85,6 +85,23 @@ app.conf.update(
             'task': 'chacra.asynch.recurring.purge_repos',
             'schedule': timedelta(days=1),
         },
+        'purge-uploads': {
+            'task': 'chacra.asynch.recurring.purge_uploads',
+            'schedule': timedelta(hours=1),
+        },
+        'index-chunks': {
+            'task': 'chacra.asynch.recurring.index_chunks',
+            'schedule': timedelta(minutes=5),
+        },
+        'purge-objects': {
+            'task': 'chacra.asynch.recurring.purge_objects',
+            'schedule': timedelta(days=1),
+        },
+        'purge-tombstones': {
+            'task': 'chacra.asynch.recurring.purge_tombstones',
+            'schedule': timedelta(seconds=pecan.conf.get('deletion_cycle', 30)),
+            'options': {'queue': 'deletions'}
+        },
     },
     control_queue_exclusive=True,
     event_queue_exclusive=True,
@@ -7,7 +7,7 @@ import requests
 import shutil
 from sqlalchemy import desc
 from celery import shared_task
-from chacra import models
+from chacra import models, storage, chunking
 from chacra.asynch import base, debian, rpm, post_queued, post_deleted
 import logging
 try:
@@ -171,6 +171,162 @@ def purge_repos(_now=None):
     logger.info('completed repo purging')
 
 
+@shared_task
+def purge_uploads(_now=None):
+    """
+    Remove resumable uploads that have not received any data in
+    ``upload_expiration`` hours (defaults to 48), they are most likely
+    abandoned and are just taking space.
+    """
+    now = _now or datetime.datetime.now(UTC)
+    lifespan = now - datetime.timedelta(hours=pecan.conf.get('upload_expiration', 48))
+    root = storage.upload_staging_root()
+    if not os.path.isdir(root):
+        return
+    logger.info('polling staged uploads for purging....')
+    for upload_id in os.listdir(root):
+        upload = storage.StagedUpload.load(root, upload_id)
+        if upload is None:
+            continue
+        # every write appends to the ranges file, so it tracks the last activity
+        last_activity = datetime.datetime.fromtimestamp(
+            os.path.getmtime(upload.ranges_path), UTC)
+        if last_activity < lifespan:
+            logger.info('removing abandoned upload %s (%s)', upload.id, upload.metadata.get('name'))
+            upload.remove()
+    logger.info('completed upload purging')
+
+
+@shared_task
+def purge_objects():
+    """
+    Remove objects from the deduplicated store that no binary links to
+    anymore. Deleting binaries takes care of this already, but overwritten
+    binaries (and interrupted deletions) can leave unreferenced objects behind.
+    """
+    root = storage.object_store_root()
+    if not os.path.isdir(root):
+        return
+    logger.info('polling object store for unreferenced objects....')
+    removed = 0
+    for prefix in os.listdir(root):
+        prefix_path = os.path.join(root, prefix)
+        for name in os.listdir(prefix_path):
+            if storage.release_object(os.path.join(prefix_path, name)):
+                removed += 1
+    logger.info('completed object purging, removed %s objects', removed)
+
+
+@shared_task(base=base.SQLATask)
+def index_chunks(limit=20):
+    """
+    Split large binaries into content-defined chunks (see
+    ``chacra.chunking``) and record them, so that delta uploads of similar
+    binaries can reuse them. Only binaries of at least ``chunk_index_min_size``
+    bytes (64MB by default) are indexed, and only once per file.
+    """
+    min_size = pecan.conf.get('chunk_index_min_size', 64 * 1024 * 1024)
+    Binary = models.Binary
+    binaries = Binary.query.filter(
+        Binary.path.isnot(None),
+        Binary.file_identity.isnot(None),
+        Binary.size >= min_size,
+        (Binary.chunks_identity.is_(None)) | (Binary.chunks_identity != Binary.file_identity)
+    ).limit(limit).all()
+    for binary in binaries:
+        if storage.file_identity(binary.path) != binary.file_identity:
+            # changed after it was hashed, it will be indexed once that is
+            # up to date again
+            continue
+        logger.info('indexing chunks for %s', binary.path)
+        models.Chunk.query.filter_by(binary_id=binary.id).delete(synchronize_session=False)
+        with open(binary.path, 'rb') as f:
+            rows = [
+                dict(binary_id=binary.id, offset=offset, size=size, digest=digest)
+                for offset, size, digest in chunking.chunks(f)
+            ]
+        if rows:
+            models.Session.execute(models.Chunk.__table__.insert(), rows)
+        # a bulk update, so that the binary is not considered modified (that
+        # would update its timestamp and rebuild its repos)
+        Binary.query.filter_by(id=binary.id).update(
+            {'chunks_identity': binary.file_identity}, synchronize_session=False
+        )
+        models.commit()
+
+
+@shared_task(base=base.SQLATask)
+def purge_tombstones(batch_size=None):
+    """
+    Remove the files (and directory trees) that deleted binaries and repos
+    left behind, ``deletion_batch_size`` (100 by default) at a time. Every
+    batch is committed on its own, so what is left to do shows up right away
+    in ``/deletions/``. Concurrent tasks skip the tombstones that another one
+    is already working on. A path that can't be removed keeps its tombstone
+    (counting the attempt) to be tried again on the next run, without holding
+    back the rest.
+    """
+    batch_size = batch_size or pecan.conf.get('deletion_batch_size', 100)
+    Tombstone = models.Tombstone
+    removed = 0
+    last_id = 0
+    while True:
+        tombstones = Tombstone.query.filter(Tombstone.id > last_id).order_by(
+            Tombstone.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not tombstones:
+            break
+        last_id = tombstones[-1].id
+        # a binary uploaded again to the same path owns the file now
+        paths = [t.path for t in tombstones if not t.is_tree]
+        live = set(
+            path for path, in models.Session.query(models.Binary.path).filter(
+                models.Binary.path.in_(paths))
+        ) if paths else set()
+        for tombstone in tombstones:
+            try:
+                remove_tombstoned(tombstone, live)
+            except OSError:
+                tombstone.attempts = (tombstone.attempts or 0) + 1
+                logger.exception(
+                    'could not remove %s (attempt %s)', tombstone.path, tombstone.attempts)
+                continue
+            tombstone.delete()
+            removed += 1
+        models.commit()
+    if removed:
+        logger.info('completed purging tombstones, removed %s paths', removed)
+    return removed
+
+
+def _ignore_missing(function, path, exc_info):
+    if not isinstance(exc_info[1], OSError) or exc_info[1].errno != errno.ENOENT:
+        raise exc_info[1]
+
+
+def remove_tombstoned(tombstone, live=()):
+    """
+    Remove what ``tombstone`` points to, ``OSError`` is raised when it is
+    there but can't be removed. Paths that no longer exist are fine.
+    """
+    path = tombstone.path
+    if tombstone.is_tree:
+        shutil.rmtree(path, onerror=_ignore_missing)
+        return
+    if path in live:
+        pass
+    elif tombstone.file_identity and storage.file_identity(path) not in (None, tombstone.file_identity):
+        logger.warning('%s changed after it was deleted, not removing it', path)
+    else:
+        try:
+            os.remove(path)
+        except OSError as err:
+            # no such file, ignore
+            if err.errno != errno.ENOENT:
+                raise
+    if tombstone.checksum:
+        storage.release_object(storage.object_path(tombstone.checksum))
+
+
 def delete_repositories(repo_objects, lifespan, keep_minimum):
     logger.info('processing deletion for repos %s days and older', lifespan)
     if keep_minimum:
@@ -182,7 +338,7 @@ def delete_repositories(repo_objects, lifespan, keep_minimum):
         logger.info('repo %s is being processed for removal', r)
         for b in r.binaries:
             try:
-                os.remove(b.path)
+                storage.release(b.path, b.checksum)
             except OSError as err:
                 # no such file, ignore
                 if err.errno == errno.ENOENT:
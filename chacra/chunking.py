@@ -0,0 +1,50 @@
+"""
+Content-defined chunking of binaries, so that builds which share most of
+their contents (like debug packages of consecutive builds of the same ref)
+can be uploaded by sending only the pieces that changed.
+
+Chunk boundaries depend on the data and not on offsets: a chunk ends right
+after the first occurrence of an anchor (three bytes in ``ANCHOR``) that is at
+least ``MIN_SIZE`` bytes into it, or at ``MAX_SIZE`` if there is none. This
+means that inserting or removing bytes only changes the chunks around the
+edit, the rest of the file produces the same chunks again.
+
+Clients must use the exact same algorithm to compute the chunks they send
+for delta uploads, which is why every value here is part of the protocol.
+A chunk is identified by the SHA-256 of its contents.
+"""
+import hashlib
+import re
+
+MIN_SIZE = 512 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+# for random data, there is an anchor every 256KB on average
+ANCHOR = re.compile(b'[\x00-\x03][\xfc-\xff][\x00-\x03]')
+
+
+def chunks(file_obj):
+    """
+    Read ``file_obj`` once, yielding the offset, size and SHA-256 of every
+    chunk in it
+    """
+    offset = 0
+    buf = b''
+    eof = False
+    while True:
+        if not eof and len(buf) < MAX_SIZE:
+            data = file_obj.read(MAX_SIZE)
+            if data:
+                buf += data
+                continue
+            eof = True
+        if not buf:
+            return
+        match = ANCHOR.search(buf, MIN_SIZE, MAX_SIZE)
+        if match is not None:
+            size = match.end()
+        else:
+            size = min(MAX_SIZE, len(buf))
+        yield offset, size, hashlib.sha256(buf[:size]).hexdigest()
+        offset += size
+        buf = buf[size:]
@@ -0,0 +1,47 @@
+from __future__ import print_function
+import os
+
+from pecan.commands.base import BaseCommand
+
+from chacra import models, storage
+
+
+def out(string):
+    print("==> %s" % string)
+
+
+class DeduplicateCommand(BaseCommand):
+    """
+    Move binaries saved before the object store existed into it, so that
+    identical binaries share their data on disk.
+    """
+
+    def run(self, args):
+        super(DeduplicateCommand, self).run(args)
+        out("LOADING ENVIRONMENT")
+        self.load_app()
+        models.start()
+        linked = 0
+        query = models.Binary.query.filter(
+            models.Binary.path.isnot(None),
+            models.Binary.checksum.isnot(None)
+        )
+        for binary in query.yield_per(1000):
+            if not os.path.isfile(binary.path):
+                continue
+            identity = binary.file_identity
+            if storage.file_identity(binary.path) != identity:
+                # the file changed (or was never checked) since it was hashed,
+                # so its checksum can only be trusted if it still matches
+                digests = storage.checksums(binary.path)
+                if digests['checksum'] != binary.checksum:
+                    out("skipping %s, it does not match its checksum" % binary.path)
+                    continue
+                identity = digests['file_identity']
+            try:
+                if storage.deduplicate_in_place(binary.path, binary.checksum, identity, binary.size):
+                    linked += 1
+            except OSError as err:
+                out("could not deduplicate %s: %s" % (binary.path, err))
+        models.rollback()
+        out("DONE, %s BINARIES ARE NOW SHARING DATA WITH OTHERS" % linked)
@@ -3,26 +3,30 @@ import logging
 import pecan
 from pecan import expose, abort, request, response, conf
 from pecan.secure import secure
-from webob.static import FileIter
-from chacra.models import Binary, Project
-from chacra.controllers import error
+from chacra.models import Binary, tombstones
+from chacra.controllers import error, util
+from chacra.controllers.binaries import downloads
+from chacra.controllers.binaries.locations import BinaryFiles
 from chacra.auth import basic_auth
-from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 
-class BinaryController(object):
+class BinaryController(BinaryFiles):
 
     def __init__(self, binary_name):
         self.binary_name = binary_name
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.distro_version = request.context['distro_version']
         self.distro = request.context['distro']
         self.arch = request.context['arch']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
         self.flavor = request.context.get('flavor', 'default')
+        if 'binary' in request.context:
+            # already resolved along with the project, for the whole path
+            self.binary = request.context['binary']
+            return
         self.binary = Binary.query.filter_by(
             name=binary_name,
             ref=self.ref,
@@ -66,9 +70,27 @@ class BinaryController(object):
         # TODO: maybe disable this for testing?
         # XXX Maybe we don't need to set Content-Disposition here?
         response.headers['Content-Disposition'] = 'attachment; filename=%s' % str(self.binary.name)
+        # the checksum identifies the contents, so it is a strong validator
+        etag = self.binary.checksum
+        if etag:
+            response.etag = etag
+        timestamps = [t for t in (self.binary.created, self.binary.modified) if t]
+        if timestamps:
+            response.last_modified = max(timestamps)
+        if self.sha1 == 'head':
+            # head keeps changing, caches need to check if they are current
+            response.cache_control = 'no-cache'
+        else:
+            # binaries of a specific sha1 rarely change, but a forced upload
+            # can still replace them, so caches revalidate them after a while
+            response.cache_control = 'public, max-age=%d, must-revalidate' % (
+                conf.get('binary_max_age', 3600))
+        if util.not_modified(request, etag, response.last_modified):
+            response.status = 304
+            return response
         if conf.delegate_downloads is False:
-            f = open(self.binary.path, 'rb')
-            response.app_iter = FileIter(f)
+            # returning the response tells pecan it has been filled already
+            return downloads.serve(request, response, self.binary.path, etag=etag)
         else:
             relative_path = self.binary.path.split(pecan.conf.binary_root)[-1].strip('/')
             # FIXME: this should be read from configuration, this is not configurable
@@ -128,9 +150,14 @@ class BinaryController(object):
             error('/errors/invalid/', 'no file object found in "file" param in POST request')
         file_obj = contents.file
         # this looks odd, path is not changing, but we need to 'ping' the object by
-        # re-saving the attribute so that the listener can update the checksum and modified
-        # timestamps
-        self.binary.path = self.save_file(file_obj)
+        # re-saving the attribute so that the listener can update the modified
+        # timestamps. The checksums are computed while the file is written.
+        path, digests = self.save_file(file_obj)
+        if digests is None:
+            # same contents as the existing file, nothing changed
+            return dict()
+        self.binary.path = path
+        self.binary.set_digests(digests)
         return dict()
 
     @secure(basic_auth)
@@ -138,17 +165,10 @@ class BinaryController(object):
     def index_delete(self):
         if not self.binary:
             abort(404)
-        binary_path = self.binary.path
         repo = self.binary.repo
         project = self.binary.project
-        self.binary.delete()
-        try:
-            if binary_path:
-                os.remove(binary_path)
-        except (IOError, OSError):
-            msg = "Could not remove the binary path: %s" % binary_path
-            logger.exception(msg)
-            error('/errors/error/', msg)
+        # the file is removed in the background, see purge_tombstones
+        tombstones.bury_binary(self.binary)
         if repo.binaries.count() > 0:
             # there are still binaries related to this repo, mark it to rebuild
             repo.needs_update = True
@@ -159,39 +179,5 @@ class BinaryController(object):
         if project.binaries.count() == 0:
             project.delete()
 
-        response.status = 204
+        response.status = 202
         return dict()
-
-    def create_directory(self):
-        urlpath = Path(request.url)
-        # remove binary_name if it exists
-        if urlpath.name == self.binary_name:
-            urlpath = urlpath.parent
-        # replace '...binaries' with binary_root
-        rootindex = urlpath.parts.index('binaries')
-        path = Path(pecan.conf.binary_root, *(urlpath.parts[rootindex+1:]))
-        if not os.path.isdir(path):
-            os.makedirs(path)
-        return path
-
-    def save_file(self, file_obj):
-        # TODO: we should just use self.binary.path for this
-        dir_path = self.create_directory()
-        if self.binary_name in os.listdir(dir_path):
-            # resource exists so we will update it
-            response.status = 200
-        else:
-            # TODO: enforce this.
-            # we will create a resource, but this SHOULD NOT HAPPEN
-            # because we are PUT not POST
-            response.status = 201
-
-        destination = os.path.join(dir_path, self.binary_name)
-
-        with open(destination, 'wb') as f:
-            file_iterable = FileIter(file_obj)
-            for chunk in file_iterable:
-                f.write(chunk)
-
-        # return the full path to the saved object:
-        return destination
@@ -0,0 +1,130 @@
+import os
+import logging
+import posixpath
+import tarfile
+from pecan import request, response
+from chacra import models, storage
+from chacra.controllers import error
+
+logger = logging.getLogger(__name__)
+
+
+# content types that are unpacked as a stream of binaries, compressed
+# archives are detected (and decompressed) on the fly
+TAR_TYPES = [
+    'application/x-tar',
+    'application/x-gtar',
+    'application/gzip',
+    'application/x-gzip',
+]
+
+
+def is_tar_request():
+    return request.content_type in TAR_TYPES
+
+
+def tar_members(file_obj):
+    """
+    Go over a tar stream (optionally compressed) one member at a time without
+    seeking, so that it can be read straight from the request body. Yields
+    the name, a file object, and the size of every file in it.
+    """
+    with tarfile.open(fileobj=file_obj, mode='r|*') as tar:
+        for member in tar:
+            if member.isdir():
+                continue
+            if not member.isfile():
+                raise ValueError('only regular files are allowed: %s' % member.name)
+            yield member.name, tar.extractfile(member), member.size
+
+
+def multipart_members(fields):
+    for field in fields:
+        if not hasattr(field, 'file'):
+            raise ValueError('no file object found in "file" param in POST request')
+        yield field.filename, field.file, None
+
+
+def binary_name(name):
+    # archives created from a directory ("tar -C dir -cf - .") prefix every
+    # member with "./" but nested directories are not allowed
+    name = posixpath.normpath(name or '')
+    if '/' in name or name.startswith('.'):
+        raise ValueError('invalid binary name: %s' % name)
+    return name
+
+
+def save_binaries(parent, members, force=False):
+    """
+    Save many binaries, uploaded in a single request, to the location of
+    ``parent`` (an arch or a flavor controller). Nothing is put in place
+    until every file has been received, so an invalid or truncated request
+    does not leave any binary behind. All the binaries are created (or
+    updated) with a few statements, regardless of how many there are, and
+    related repos are marked only once.
+    """
+    parent.binary_name = None
+    dir_path = parent.create_directory()
+    staged = []
+    try:
+        for name, file_obj, size in members:
+            name = binary_name(name)
+            if name in [s[0] for s in staged]:
+                raise ValueError('%s was included more than once' % name)
+            destination = os.path.join(dir_path, name)
+            tmp_path, digests = storage.stage_file(file_obj, destination, size)
+            staged.append((name, destination, tmp_path, digests))
+        if not staged:
+            raise ValueError('no binaries found in request')
+
+        existing = dict(
+            (b.name, b) for b in parent.get_binaries([s[0] for s in staged])
+        )
+        conflicts = sorted(
+            name for name, b in existing.items() if b.path and os.path.exists(b.path)
+        )
+        if conflicts and not force:
+            raise ValueError(
+                'resource already exists and "force" key was not used: %s' % ', '.join(conflicts)
+            )
+    except (ValueError, tarfile.TarError) as exc:
+        discard(staged)
+        error('/errors/invalid/', str(exc))
+    except Exception:
+        discard(staged)
+        raise
+
+    entries = []
+    while staged:
+        name, destination, tmp_path, digests = staged[0]
+        try:
+            digests['file_identity'] = storage.commit_staged(tmp_path, destination, digests)
+        except OSError:
+            discard(staged[1:])
+            raise
+        staged.pop(0)
+        entries.append(dict(
+            digests, name=name, path=destination, arch=parent.arch,
+            distro=parent.distro, distro_version=parent.distro_version,
+            ref=parent.ref, sha1=parent.sha1,
+            flavor=request.context.get('flavor', 'default'),
+        ))
+
+    # all of them are written at once, the digests are already known and
+    # their repo is only looked up (or created) once
+    ids = models.registration.register_binaries(parent.project, entries)
+    binaries = dict(
+        (binary.name, binary) for binary in
+        models.Binary.query.filter(models.Binary.id.in_(list(ids.values())))
+    )
+
+    response.status = 200 if existing else 201
+    # check if these binaries are interesting for other configured projects,
+    # and if so, then mark those other repos so that they can be re-built
+    parent.mark_related_repos([binaries[entry['name']] for entry in entries])
+    return binaries
+
+
+def discard(staged):
+    for _, _, tmp_path, _ in staged:
+        storage.discard_staged(tmp_path)
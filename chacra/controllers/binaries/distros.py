@@ -8,7 +8,7 @@ class DistroVersionController(object):
 
     def __init__(self, distro_version):
         self.distro_version = distro_version
-        self.project = models.Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.distro_name = request.context['distro']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
@@ -16,21 +16,18 @@ class DistroVersionController(object):
 
     @expose('json', generic=True)
     def index(self):
-        if self.distro_version not in self.project.distro_versions:
+        if not self.project.has_distro_version(self.distro_version):
             abort(404)
 
         resp = {}
-        for arch in self.project.archs:
-            binaries = [
-                b.name for b in models.Binary.filter_by(
-                    project=self.project,
-                    distro_version=self.distro_version,
-                    distro=self.distro_name,
-                    ref=self.ref,
-                    sha1=self.sha1,
-                    arch=arch).all()]
-            if binaries:
-                resp[arch] = list(set(binaries))
+        query = models.Session.query(models.Binary.arch, models.Binary.name).filter_by(
+            project=self.project,
+            distro_version=self.distro_version,
+            distro=self.distro_name,
+            ref=self.ref,
+            sha1=self.sha1).distinct()
+        for arch, name in query:
+            resp.setdefault(arch, []).append(name)
         return resp
 
     @index.when(method='POST', template='json')
@@ -39,8 +36,10 @@ class DistroVersionController(object):
 
     @expose()
     def _lookup(self, name, *remainder):
-        if request.method in  ['HEAD', 'GET']:
-            if self.distro_version not in self.project.distro_versions:
+        # resumable uploads can be queried before any binary exists, and a
+        # path resolved to a binary doesn't need checking
+        if request.method in  ['HEAD', 'GET'] and 'uploads' not in remainder:
+            if 'binary' not in request.context and not self.project.has_distro_version(self.distro_version):
                 abort(404)
         return ArchController(name), remainder
 
@@ -48,32 +47,16 @@ class DistroVersionController(object):
 class DistroController(object):
     def __init__(self, distro_name):
         self.distro_name = distro_name
-        self.project = models.Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
         request.context['distro'] = distro_name
 
     @expose('json', generic=True)
     def index(self):
-        resp = {}
-
-        binaries = models.Binary.filter_by(
-            project=self.project,
-            distro=self.distro_name,
-            ref=self.ref,
-            sha1=self.sha1).all()
-
-        if not binaries:
-            abort(404)
-
-        distro_versions = set([b.distro_version for b in binaries])
-
-        for distro_version in distro_versions:
-            resp[distro_version] = list(
-                set(
-                    [b.arch for b in binaries if b.distro_version == distro_version]
-                )
-            )
+        resp = self.project.tree(
+            models.Catalog.distro_version, models.Catalog.arch,
+            ref=self.ref, sha1=self.sha1, distro=self.distro_name)
         if not resp:
             abort(404)
         return resp
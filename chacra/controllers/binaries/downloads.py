@@ -0,0 +1,173 @@
+"""
+Serve binaries straight from the application, for deployments that do not
+delegate downloads to a web server (``delegate_downloads = False``). Supports
+(multiple) byte ranges so that interrupted downloads can be resumed and
+segmented downloaders can be used, and lets the WSGI server use ``sendfile``
+through ``wsgi.file_wrapper`` when it can.
+"""
+import os
+import re
+import uuid
+from email.utils import parsedate_to_datetime
+from webob.static import FileIter
+from chacra.storage import CHUNK_SIZE
+
+# more ranges than these are most likely abuse, the whole file is served
+MAX_RANGES = 64
+
+range_re = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_ranges(header, size):
+    """
+    Parse a ``Range`` header for a file of ``size`` bytes into a sorted list
+    of ``(start, end)`` tuples (``end`` is exclusive). Returns ``None`` if the
+    header is invalid (and should be ignored), or an empty list if none of the
+    ranges can be satisfied.
+
+    Ranges that overlap or are next to each other are merged, so no byte is
+    sent more than once (``bytes=0-,0-,0-`` is the whole file, once).
+    """
+    unit, _, specs = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = range_re.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # a suffix: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size
+        else:
+            start = int(first)
+            end = size if last == '' else min(int(last) + 1, size)
+            if last != '' and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(header, etag, last_modified):
+    """
+    ``If-Range`` makes the ranges conditional: they only apply if the file is
+    still the one the client has, identified by its (strong) entity tag or by
+    its exact modification date
+    """
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"'):
+        return etag is not None and header == '"%s"' % etag
+    if header.startswith('W/'):
+        return False
+    try:
+        return parsedate_to_datetime(header) == last_modified
+    except (TypeError, ValueError):
+        return False
+
+
+def iter_range(f, start, end):
+    position = start
+    while position < end:
+        data = os.pread(f.fileno(), min(CHUNK_SIZE, end - position), position)
+        if not data:
+            break
+        position += len(data)
+        yield data
+
+
+def serve(request, response, path, content_type='application/octet-stream', etag=None):
+    """
+    Fill ``response`` with the file at ``path``, honoring the ``Range``
+    headers in ``request``. ``If-Range`` is checked against ``etag`` and the
+    ``Last-Modified`` date of the response (the modification time of the file
+    if it is not set already)
+    """
+    f = open(path, 'rb')
+    stat = os.fstat(f.fileno())
+    size = stat.st_size
+    response.headers['Accept-Ranges'] = 'bytes'
+    if response.last_modified is None:
+        response.last_modified = stat.st_mtime
+
+    ranges = None
+    if request.method in ('GET', 'HEAD') and 'Range' in request.headers:
+        if_range = request.headers.get('If-Range')
+        if if_range_matches(if_range, etag, response.last_modified):
+            ranges = parse_ranges(request.headers['Range'], size)
+
+    if ranges is None:
+        response.content_type = content_type
+        response.content_length = size
+        response.app_iter = file_iter(request, f)
+    elif not ranges:
+        f.close()
+        response.status = 416
+        response.headers['Content-Range'] = 'bytes */%s' % size
+        response.content_length = 0
+        response.app_iter = []
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response.status = 206
+        response.content_type = content_type
+        response.headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end - 1, size)
+        response.content_length = end - start
+        if end == size:
+            # servers stop at the content length, but some can't start at an
+            # offset, so only the end of the file can go through file_wrapper
+            f.seek(start)
+            response.app_iter = file_iter(request, f)
+        else:
+            response.app_iter = FileIter(f).app_iter_range(start, end)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = []
+        length = 0
+        for start, end in ranges:
+            headers = (
+                '--%s\r\n'
+                'Content-Type: %s\r\n'
+                'Content-Range: bytes %s-%s/%s\r\n\r\n' % (boundary, content_type, start, end - 1, size)
+            ).encode('ascii')
+            parts.append((headers, start, end))
+            length += len(headers) + (end - start) + 2
+        closing = ('--%s--\r\n' % boundary).encode('ascii')
+        response.status = 206
+        response.content_type = 'multipart/byteranges; boundary=%s' % boundary
+        response.content_length = length + len(closing)
+        response.app_iter = multipart_iter(f, parts, closing)
+    return response
+
+
+def file_iter(request, f):
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        return file_wrapper(f, CHUNK_SIZE)
+    return FileIter(f)
+
+
+def multipart_iter(f, parts, closing):
+    try:
+        for headers, start, end in parts:
+            yield headers
+            for data in iter_range(f, start, end):
+                yield data
+            yield b'\r\n'
+        yield closing
+    finally:
+        f.close()
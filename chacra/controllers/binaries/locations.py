@@ -0,0 +1,194 @@
+import os
+import pecan
+from pecan import response, request
+from chacra import models, util, storage
+from chacra.controllers import error
+from chacra.controllers.util import repository_is_automatic
+from chacra.controllers.binaries import bulk, stored
+from pathlib import Path
+
+
+class BinaryFiles(object):
+    """
+    Saving the file of the binary ``self.binary_name`` (``self.binary``, if
+    it exists already) to the directory the URL of the request points to.
+    Single binaries and the places binaries are uploaded to share this, so
+    that files are always saved the same way.
+    """
+
+    def create_directory(self):
+        urlpath = Path(request.path)
+        # remove binary_name if it exists
+        if urlpath.name == self.binary_name:
+            urlpath = urlpath.parent
+        # replace '...binaries' with binary_root
+        rootindex = urlpath.parts.index('binaries')
+        path = Path(pecan.conf.binary_root, *(urlpath.parts[rootindex+1:]))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def save_file(self, file_obj):
+        dir_path = self.create_directory()
+        if self.binary_name in os.listdir(dir_path):
+            # resource exists so we will update it
+            response.status = 200
+        else:
+            # we will create a resource
+            response.status = 201
+
+        destination = os.path.join(dir_path, self.binary_name)
+        tmp_path, digests = storage.stage_file(file_obj, destination)
+        if self.binary is not None and self.binary.path == destination:
+            if self.binary.has_contents(digests['checksum']):
+                storage.discard_staged(tmp_path)
+                return destination, None
+        digests['file_identity'] = storage.commit_staged(tmp_path, destination, digests)
+
+        # return the full path to the saved object, along with its checksums
+        # (or None if the binary was already there with the same contents)
+        return destination, digests
+
+
+class BinaryLocation(BinaryFiles):
+    """
+    What the arch and the flavor controllers have in common, as the two
+    places binaries are uploaded to: finding the binaries that are already
+    there, and saving new ones (in any of the ways they can be uploaded).
+    ``location()`` is all that tells them apart.
+    """
+
+    def location(self):
+        """
+        The columns that identify where the binaries of this controller are,
+        to look them up
+        """
+        return dict(
+            project=self.project, arch=self.arch,
+            distro=self.distro, distro_version=self.distro_version,
+            ref=self.ref, sha1=self.sha1,
+        )
+
+    def get_binary(self, name):
+        return models.Binary.filter_by(name=name, **self.location()).first()
+
+    def get_binaries(self, names):
+        return models.Binary.filter_by(
+            **self.location()
+        ).filter(models.Binary.name.in_(names)).all()
+
+    def save_upload(self):
+        """
+        Save what was POSTed, which can be a checksum to link a stored file,
+        many binaries (a tar stream or several "file" fields) or a single
+        one, as the raw body or as a "file" field
+        """
+        # clients can send the checksum first, and skip uploading binaries
+        # that chacra already has
+        if request.content_type == 'application/json':
+            return stored.save_stored_binary(self)
+        # many binaries can be uploaded at once, either as a tar stream or
+        # as several "file" fields in a multipart request
+        if bulk.is_tar_request():
+            return bulk.save_binaries(
+                self,
+                bulk.tar_members(request.body_file),
+                force=request.GET.get('force', False) is not False
+            )
+        if len(request.POST.getall('file')) > 1:
+            return bulk.save_binaries(
+                self,
+                bulk.multipart_members(request.POST.getall('file')),
+                force=request.POST.get('force', False) is not False
+            )
+        if request.content_type == 'application/octet-stream':
+            # the raw binary as the body, which can be linked into place if the
+            # web server spooled it to a file
+            filename = request.GET.get('name')
+            if not filename:
+                error('/errors/invalid/', "could not find required 'name' in query string")
+            if '/' in filename or filename.startswith('.'):
+                error('/errors/invalid/', 'invalid binary name: %s' % filename)
+            file_obj = request.body_file
+            force = request.GET.get('force', False) is not False
+        else:
+            contents = request.POST.get('file', False)
+            if contents is False:
+                error('/errors/invalid/', 'no file object found in "file" param in POST request')
+            file_obj = contents.file
+            filename = contents.filename
+            force = request.POST.get('force', False) is not False
+        self.binary = self.get_binary(filename)
+        self.binary_name = filename
+        if self.binary is not None:
+            if os.path.exists(self.binary.path):
+                if not force:
+                    error('/errors/invalid', 'resource already exists and "force" key was not used')
+
+        full_path, digests = self.save_file(file_obj)
+        if digests is None:
+            # forced upload of the same file, nothing changed
+            return dict()
+
+        if self.binary is None:
+            self.binary = models.Binary(
+                self.binary_name, self.project, arch=self.arch,
+                distro=self.distro, distro_version=self.distro_version,
+                ref=self.ref, sha1=self.sha1, path=full_path,
+                flavor=request.context.get('flavor', 'default'),
+                digests=digests
+            )
+        else:
+            self.binary.path = full_path
+            self.binary.set_digests(digests)
+
+        # check if this binary is interesting for other configured projects,
+        # and if so, then mark those other repos so that they can be re-built
+        self.mark_related_repos()
+        return dict()
+
+    def mark_related_repos(self, binaries=None):
+        """
+        Mark the repos of related projects (see ``util.get_related_projects``)
+        to be rebuilt because ``binaries`` (``self.binary`` by default) were
+        just saved
+        """
+        binaries = binaries or [self.binary]
+        # binaries in one location go in the same type of repo
+        repo_type = binaries[0]._get_repo_type()
+        related_projects = util.get_related_projects(self.project.name)
+        repos = []
+        projects = []
+        for project_name, refs in related_projects.items():
+            p = models.projects.get_or_create(name=project_name)
+            projects.append(p)
+            repo_query = []
+            if refs == ['all']:
+                # we need all the repos available
+                repo_query = models.Repo.filter_by(project=p).all()
+            else:
+                for ref in refs:
+                    repo_query = models.Repo.filter_by(project=p, ref=ref).all()
+            if repo_query:
+                for r in repo_query:
+                    repos.append(r)
+
+        if not repos:
+            # there are no repositories associated with this project, so go ahead
+            # and create one so that it can be queried by the celery task later
+            for project in projects:
+                repo = models.repos.get_or_create(
+                    project,
+                    self.ref,
+                    self.distro,
+                    self.distro_version,
+                    sha1=self.sha1,
+                )
+                repo.needs_update = repository_is_automatic(project.name)
+                repo.type = repo_type
+
+        else:
+            for repo in repos:
+                repo.needs_update = repository_is_automatic(repo.project.name)
+                if repo.type is None:
+                    repo.type = repo_type
@@ -8,27 +8,13 @@ class RefController(object):
 
     def __init__(self, ref_name):
         self.ref_name = ref_name
-        self.project = models.Project.get(request.context['project_id'])
+        self.project = request.context['project']
         request.context['ref'] = self.ref_name
 
     @expose('json', generic=True)
     def index(self):
-        if self.ref_name not in self.project.refs:
-            abort(404)
-        resp = {}
-        binaries = models.Binary.filter_by(
-            project=self.project,
-            ref=self.ref_name).all()
-
-        sha1s = set([b.sha1 for b in binaries])
-
-        for sha1 in sha1s:
-            resp[sha1] = list(
-                set(
-                    [b.distro for b in binaries if b.sha1 == sha1]
-                )
-            )
-
+        resp = self.project.tree(
+            models.Catalog.sha1, models.Catalog.distro, ref=self.ref_name)
         if not resp:
             abort(404)
 
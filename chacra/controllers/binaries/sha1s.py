@@ -1,5 +1,8 @@
-from pecan import expose, abort, request
+from pecan import expose, abort, request, response
+from pecan.secure import secure
 from chacra import models
+from chacra.auth import basic_auth
+from chacra.models import tombstones
 from chacra.controllers import error
 from chacra.controllers.binaries.distros import DistroController
 
@@ -8,29 +11,15 @@ class SHA1Controller(object):
 
     def __init__(self, sha1):
         self.sha1 = sha1
-        self.project = models.Project.get(request.context['project_id'])
+        self.project = request.context['project']
         request.context['sha1'] = sha1
         self.ref = request.context["ref"]
 
     @expose('json', generic=True)
     def index(self):
-        if self.sha1 not in self.project.sha1s:
-            abort(404)
-        resp = {}
-        binaries = models.Binary.filter_by(
-            project=self.project,
-            sha1=self.sha1,
-            ref=self.ref).all()
-
-        distros = set([b.distro for b in binaries])
-
-        for distro in distros:
-            resp[distro] = list(
-                set(
-                    [b.distro_version for b in binaries if b.distro == distro ]
-                )
-            )
-
+        resp = self.project.tree(
+            models.Catalog.distro, models.Catalog.distro_version,
+            ref=self.ref, sha1=self.sha1)
         if not resp:
             abort(404)
 
@@ -40,6 +29,25 @@ class SHA1Controller(object):
     def index_post(self):
         error('/errors/not_allowed', 'POST requests to this url are not allowed')
 
+    @secure(basic_auth)
+    @index.when(method='DELETE', template='json')
+    def index_delete(self):
+        """
+        Delete every binary and repo for this sha1 with a couple of
+        statements, without loading any of them. Their files are removed in
+        the background, see purge_tombstones
+        """
+        binaries = tombstones.bury_binaries(
+            self.project, models.Binary.ref == self.ref, models.Binary.sha1 == self.sha1)
+        repos = tombstones.bury_repos(
+            self.project, models.Repo.ref == self.ref, models.Repo.sha1 == self.sha1)
+        if not binaries and not repos:
+            abort(404)
+        if self.project.binaries.count() == 0 and self.project.repos.count() == 0:
+            self.project.delete()
+        response.status = 202
+        return dict(binaries=binaries, repos=repos)
+
     @expose()
     def _lookup(self, name, *remainder):
         return DistroController(name), remainder
@@ -0,0 +1,122 @@
+import os
+import logging
+from pecan import request, response
+from chacra import models, storage
+from chacra.controllers import error
+
+logger = logging.getLogger(__name__)
+
+
+def find_contents(checksum):
+    """
+    Look for a file that is already on disk with the SHA-512 ``checksum``.
+    Returns its path and its digests, or ``(None, None)`` if there isn't one.
+
+    The object store is tried first, then the files of binaries with the same
+    checksum (in case deduplication is disabled) as long as they have not
+    changed since they were hashed. There can be thousands of binaries with
+    the same contents, so only the columns needed are read, and only until
+    one of them is usable.
+    """
+    Binary = models.Binary
+    known = models.Session.query(
+        Binary.path, Binary.file_identity
+    ).filter(Binary.checksum == checksum)
+    source = storage.stored_object(checksum)
+    if source is None:
+        candidates = known.filter(
+            Binary.path.isnot(None), Binary.file_identity.isnot(None)
+        ).yield_per(100)
+        for path, identity in candidates:
+            if storage.file_identity(path) == identity:
+                source = path
+                break
+        else:
+            return None, None
+
+    known_digests = models.Session.query(Binary.sha256, Binary.md5).filter(
+        Binary.checksum == checksum, Binary.sha256.isnot(None), Binary.md5.isnot(None)
+    ).first()
+    if known_digests is not None:
+        digests = dict(
+            checksum=checksum, sha256=known_digests.sha256, md5=known_digests.md5,
+            size=os.path.getsize(source)
+        )
+    else:
+        # a stored object nothing points to, read it once to be sure
+        digests = storage.checksums(source)
+        del digests['file_identity']
+        if digests['checksum'] != checksum:
+            logger.warning('%s does not have the checksum it should', source)
+            return None, None
+    return source, digests
+
+
+def save_binary(parent, name, destination, digests):
+    """
+    Create (or update) the binary ``name`` for ``parent`` (an arch or
+    a flavor controller) that was just saved to ``destination``
+    """
+    binary = parent.get_binary(name)
+    if binary is None:
+        binary = models.Binary(
+            name, parent.project, arch=parent.arch,
+            distro=parent.distro, distro_version=parent.distro_version,
+            ref=parent.ref, sha1=parent.sha1,
+            flavor=request.context.get('flavor', 'default'),
+            path=destination, digests=digests
+        )
+    else:
+        binary.path = destination
+        binary.set_digests(digests)
+
+    # check if this binary is interesting for other configured projects,
+    # and if so, then mark those other repos so that they can be re-built
+    parent.binary = binary
+    parent.binary_name = name
+    parent.mark_related_repos()
+    return binary
+
+
+def save_stored_binary(parent):
+    """
+    Checksum negotiation: the client sends the name and the SHA-512 of
+    a binary instead of the file. If chacra already has a file with that
+    checksum the binary is created by linking to it, and nothing needs to be
+    uploaded. Otherwise a 404 tells the client it has to upload the file.
+    """
+    try:
+        data = request.json
+        name = data.get('name')
+        checksum = data.get('checksum')
+    except (ValueError, AttributeError):
+        error('/errors/invalid/', 'could not decode JSON body')
+    if not name:
+        error('/errors/invalid/', "could not find required key: 'name'")
+    if '/' in name or name.startswith('.'):
+        error('/errors/invalid/', 'invalid binary name: %s' % name)
+    if not storage.checksum_re.match(checksum or ''):
+        error('/errors/invalid/', "'checksum' needs to be a SHA-512 hex digest")
+
+    binary = parent.get_binary(name)
+    if binary is not None and binary.path and os.path.exists(binary.path):
+        if not data.get('force', False):
+            error('/errors/invalid', 'resource already exists and "force" key was not used')
+        if binary.has_contents(checksum):
+            # the very same file is already there, nothing to do
+            response.status = 200
+            return binary
+
+    source, digests = find_contents(checksum)
+    if source is None or ('size' in data and data['size'] != digests['size']):
+        error(
+            '/errors/not_found/',
+            'no binary with checksum %s is stored, it needs to be uploaded' % checksum
+        )
+
+    parent.binary_name = name
+    dir_path = parent.create_directory()
+    destination = os.path.join(dir_path, name)
+    response.status = 201 if binary is None else 200
+    digests = storage.link_file(source, destination, digests=digests)
+    return save_binary(parent, name, destination, digests)
@@ -0,0 +1,238 @@
+import os
+import logging
+from pecan import expose, abort, request, response, conf
+from pecan.secure import secure
+from chacra import models, storage
+from chacra.controllers import error
+from chacra.auth import basic_auth
+from chacra.controllers.binaries.stored import save_binary
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class UploadController(object):
+    """
+    A single resumable upload. Pieces of the binary are sent with ``PUT``
+    requests (the raw bytes as the body) at a given ``offset``, the status can
+    be queried with ``GET`` and once all the bytes are there a ``POST`` to
+    ``commit/`` creates (or updates) the binary.
+    """
+
+    def __init__(self, parent, upload_id):
+        self.parent = parent
+        self.upload = storage.StagedUpload.load(
+            storage.upload_staging_root(), upload_id)
+        if self.upload is None:
+            abort(404)
+        # uploads are only valid for the URL they were created for
+        directory = uploads_directory(conf.binary_root, request.path)
+        if self.upload.metadata.get('directory') != str(directory):
+            abort(404)
+
+    @secure(basic_auth)
+    @expose(generic=True, template='json')
+    def index(self):
+        return self.upload
+
+    @secure(basic_auth)
+    @index.when(method='PUT', template='json')
+    def index_put(self):
+        try:
+            offset = int(request.GET.get('offset', 0))
+            assert offset >= 0
+        except (ValueError, AssertionError):
+            error('/errors/invalid/', 'offset needs to be a positive integer')
+        try:
+            self.upload.write(offset, request.body_file)
+        except ValueError as exc:
+            error('/errors/invalid/', str(exc))
+        return self.upload
+
+    @secure(basic_auth)
+    @index.when(method='DELETE', template='json')
+    def index_delete(self):
+        self.upload.remove()
+        response.status = 204
+        return dict()
+
+    @secure(basic_auth)
+    @expose('json')
+    def commit(self):
+        if request.method != 'POST':
+            error(
+                '/errors/not_allowed',
+                'only POST request are accepted for this url'
+            )
+        if not self.upload.is_complete():
+            error(
+                '/errors/invalid/',
+                'upload is not complete, received %s bytes out of %s' % (
+                    self.upload.received, self.upload.size)
+            )
+        metadata = self.upload.metadata
+        name = metadata['name']
+        data_path = self.upload.finalize()
+        digests = storage.checksums(data_path)
+        expected = metadata.get('checksum')
+        if expected and expected != digests['checksum']:
+            self.upload.remove()
+            error('/errors/invalid/', 'checksum mismatch, upload has been discarded')
+
+        destination = os.path.join(metadata['directory'], name)
+        if not os.path.isdir(metadata['directory']):
+            os.makedirs(metadata['directory'])
+        if os.path.exists(destination):
+            response.status = 200
+        else:
+            response.status = 201
+        digests = storage.link_file(data_path, destination, move=True, digests=digests)
+        self.upload.remove()
+        return save_binary(self.parent, name, destination, digests)
+
+
+class UploadsController(object):
+    """
+    Resumable uploads for large binaries. Instead of a single (multipart)
+    request with the whole file, an upload is created first, then the bytes
+    are sent in as many requests as needed.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+
+    @secure(basic_auth)
+    @expose(generic=True, template='json')
+    def index(self):
+        abort(405)
+
+    @secure(basic_auth)
+    @index.when(method='POST', template='json')
+    def index_post(self):
+        try:
+            data = request.json
+            name = data.get('name')
+        except ValueError:
+            error('/errors/invalid/', 'could not decode JSON body')
+        if not name:
+            error('/errors/invalid/', "could not find required key: 'name'")
+        if '/' in name or name.startswith('.'):
+            error('/errors/invalid/', 'invalid binary name: %s' % name)
+        size = data.get('size')
+        if size is not None and (not isinstance(size, int) or size < 0):
+            error('/errors/invalid/', 'size needs to be a positive integer')
+        chunks = data.get('chunks')
+        if chunks is not None:
+            try:
+                validate_chunks(chunks, size, data.get('checksum'))
+            except ValueError as exc:
+                error('/errors/invalid/', str(exc))
+
+        binary = self.parent.get_binary(name)
+        if binary is not None and binary.path and os.path.exists(binary.path):
+            if not data.get('force', False):
+                error('/errors/invalid', 'resource already exists and "force" key was not used')
+
+        upload = storage.StagedUpload.create(
+            storage.upload_staging_root(),
+            name=name,
+            size=size,
+            checksum=data.get('checksum'),
+            directory=str(uploads_directory(conf.binary_root, request.path)),
+        )
+        if chunks:
+            reuse_chunks(upload, chunks)
+        response.status = 201
+        return upload
+
+    @expose()
+    def _lookup(self, upload_id, *remainder):
+        return UploadController(self.parent, upload_id), remainder
+
+
+def validate_chunks(chunks, size, checksum):
+    if not checksum:
+        raise ValueError('"checksum" is required for delta uploads')
+    if size is None:
+        raise ValueError('"size" is required for delta uploads')
+    if not isinstance(chunks, list):
+        raise ValueError('"chunks" needs to be a list of [sha256, size] items')
+    total = 0
+    for chunk in chunks:
+        try:
+            digest, chunk_size = chunk
+        except (TypeError, ValueError):
+            raise ValueError('"chunks" needs to be a list of [sha256, size] items')
+        if not isinstance(digest, str) or len(digest) != 64:
+            raise ValueError('invalid chunk digest: %s' % digest)
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise ValueError('invalid chunk size: %s' % chunk_size)
+        total += chunk_size
+    if total != size:
+        raise ValueError('chunks add up to %s bytes, but the size is %s' % (total, size))
+
+
+def reuse_chunks(upload, chunks):
+    """
+    Delta uploads: copy every chunk of the new binary that chacra already has
+    (as part of any other indexed binary) into the upload, so that the client
+    only needs to send what is missing (what is not in the ``ranges`` of the
+    upload). Only the byte ranges of the matched chunks are copied, from the
+    files of binaries that have not changed since they were indexed. Returns
+    how many bytes were copied. The upload is still verified with its
+    checksum when it is committed.
+    """
+    wanted = {}
+    offset = 0
+    for digest, size in chunks:
+        wanted.setdefault(digest, []).append((offset, size))
+        offset += size
+
+    Binary, Chunk = models.Binary, models.Chunk
+    known = {}
+    digests = list(wanted)
+    for i in range(0, len(digests), 1000):
+        query = models.Session.query(
+            Chunk.digest, Chunk.offset, Chunk.size, Binary.path, Binary.file_identity
+        ).join(Binary, Chunk.binary_id == Binary.id).filter(
+            Chunk.digest.in_(digests[i:i+1000]),
+            Binary.chunks_identity == Binary.file_identity,
+        )
+        for row in query:
+            known.setdefault(row.digest, []).append(row)
+
+    # files that changed since they were indexed can't be used
+    unchanged = {}
+    pieces = []
+    for digest, places in wanted.items():
+        for row in known.get(digest, []):
+            if row.path not in unchanged:
+                unchanged[row.path] = storage.file_identity(row.path) == row.file_identity
+            if unchanged[row.path]:
+                pieces.extend(
+                    (offset, row.path, row.offset, size)
+                    for offset, size in places if size == row.size
+                )
+                break
+    if not pieces:
+        return 0
+    try:
+        return upload.copy(pieces)
+    except (OSError, ValueError):
+        # whatever could not be copied will be uploaded by the client
+        logger.exception('could not reuse chunks for upload %s', upload.id)
+        return 0
+
+
+def uploads_directory(binary_root, url):
+    """
+    The directory where binaries uploaded through ``url`` end up, following
+    the same structure as the URL (up to the ``uploads`` part)
+    """
+    urlpath = Path(url)
+    rootindex = urlpath.parts.index('binaries')
+    parts = urlpath.parts[rootindex+1:]
+    # the last 'uploads' part is the one for this controller, names before it
+    # might be called 'uploads' too
+    uploads_index = len(parts) - 1 - parts[::-1].index('uploads')
+    return Path(binary_root, *parts[:uploads_index])
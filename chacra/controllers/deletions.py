@@ -0,0 +1,13 @@
+from pecan import expose
+from chacra.models import tombstones
+
+
+class DeletionsController(object):
+
+    @expose('json')
+    def index(self):
+        """
+        What is left to remove from disk for every project, after deleting
+        binaries and repos: how many files and directory trees, and their size
+        """
+        return tombstones.pending()
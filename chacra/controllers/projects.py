@@ -1,6 +1,7 @@
-from pecan import expose, abort, request
+from pecan import expose, abort, request, response, override_template
 from chacra.models import Project
 from chacra import models
+from chacra.controllers import resolve, util
 from chacra.controllers.binaries.refs import RefController
 
 
@@ -8,16 +9,27 @@ class ProjectController(object):
 
     def __init__(self, project_name):
         self.project_name = project_name
-        self.project = Project.query.filter_by(name=project_name).first()
+        if 'project' not in request.context:
+            request.context['project'] = Project.query.filter_by(name=project_name).first()
+        self.project = request.context['project']
         if not self.project:
             if request.method != 'POST':
                 abort(404)
             elif request.method == 'POST':
                 self.project = models.get_or_create(Project, name=project_name)
+                request.context['project'] = self.project
         request.context['project_id'] = self.project.id
 
     @expose('json')
-    def index(self):
+    @expose(content_type=util.ndjson_type)
+    def index(self, **kw):
+        if util.wants_stream(request):
+            # one line for every ref, with its sha1s
+            query = models.Session.query(models.Catalog.ref, models.Catalog.sha1).filter(
+                models.Catalog.project_id == self.project.id
+            ).distinct().order_by(models.Catalog.ref, models.Catalog.sha1)
+            return util.stream(response, query, transform=util.grouped)
+        override_template('json', 'application/json')
         return self.project
 
     @expose()
@@ -29,11 +41,14 @@ class ProjectsController(object):
 
     @expose('json')
     def index(self):
-        resp = {}
-        for project in Project.query.all():
-            resp[project.name] = project.refs
+        resp = dict((name, []) for name, in models.Session.query(Project.name))
+        query = models.Session.query(Project.name, models.Catalog.ref).join(
+            models.Catalog, models.Catalog.project_id == Project.id).distinct()
+        for name, ref in query:
+            resp[name].append(ref)
         return resp
 
     @expose()
     def _lookup(self, project_name, *remainder):
+        resolve.binary(project_name, remainder)
         return ProjectController(project_name), remainder
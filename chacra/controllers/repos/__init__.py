@@ -1,12 +1,12 @@
 import logging
 import os
-import shutil
 
 from pecan import expose, abort, request, response
 from pecan.secure import secure
 from pecan_notario import validate
 
-from chacra.models import Project
+from chacra import models
+from chacra.models import Repo, tombstones
 from chacra.controllers import error
 from chacra.auth import basic_auth
 from chacra import schemas, asynch
@@ -20,21 +20,23 @@ class FlavorsController(object):
 
     def __init__(self):
         self.distro_version = request.context['distro_version']
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.distro_name = request.context['distro']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
-        self.repos = self.project.repos.filter_by(
+
+    def get_flavors(self):
+        query = self.project.repos.filter_by(
             distro=self.distro_name,
             distro_version=self.distro_version,
             ref=self.ref,
             sha1=self.sha1,
-        ).all()
-        self.flavors = list(set([r.flavor for r in self.repos]))
+        )
+        return [flavor for flavor, in query.with_entities(Repo.flavor).distinct()]
 
     @expose('json', generic=True)
     def index(self):
-        return self.flavors
+        return self.get_flavors()
 
     @index.when(method='POST', template='json')
     def index_post(self):
@@ -42,7 +44,8 @@ class FlavorsController(object):
 
     @expose()
     def _lookup(self, flavor, *remainder):
-        if flavor not in self.flavors:
+        # a path resolved to a repo doesn't need checking
+        if 'repo' not in request.context and flavor not in self.get_flavors():
             abort(404)
         return RepoController(self.distro_version, flavor), remainder
 
@@ -51,13 +54,17 @@ class RepoController(object):
 
     def __init__(self, distro_version, flavor=None):
         self.distro_version = distro_version
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.distro_name = request.context['distro']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
         if not request.context.get('distro_version'):
             request.context['distro_version'] = self.distro_version
         self.flavor = flavor
+        if 'repo' in request.context:
+            # already resolved along with the project, for the whole path
+            self.repo_obj = request.context['repo']
+            return
         self.repo_obj = self.project.repos.filter_by(
             distro=self.distro_name,
             distro_version=self.distro_version,
@@ -130,11 +137,11 @@ class RepoController(object):
                 '/errors/not_allowed',
                 'only POST request are accepted for this url'
             )
-        # completely remove the path to the repository
+        # completely remove the path to the repository, it is moved out of
+        # the way now so that it can be built again right away, and removed
+        # in the background
         logger.info('removing repository path: %s', self.repo_obj.path)
-        try:
-            shutil.rmtree(self.repo_obj.path)
-        except OSError:
+        if not tombstones.bury_tree(self.repo_obj.path, project=self.project.name):
             logger.warning("could not remove repo path: %s", self.repo_obj.path)
 
         # mark the repo so that celery picks it up
@@ -143,33 +150,23 @@ class RepoController(object):
         self.repo_obj.is_queued = False
 
         asynch.post_requested(self.repo_obj)
+        response.status = 202
         return self.repo_obj
 
     @secure(basic_auth)
     @index.when(method='DELETE', template='json')
     @validate(schemas.repo_schema, handler='/errors/schema')
     def index_delete(self):
-        repo_path = self.repo_obj.path
-        logger.info('nuke repository path: %s', repo_path)
-        try:
-            shutil.rmtree(repo_path)
-        except OSError:
-            msg = "could not remove repo path: {}".format(repo_path)
-            logger.exception(msg)
-            error('/errors/error/', msg)
-        for binary in self.repo_obj.binaries:
-            binary_path = binary.binary.path
-            if binary_path:
-                try:
-                    os.remove(binary_path)
-                except (IOError, OSError):
-                    msg = "Could not remove the binary path: %s" % binary_path
-                    logger.exception(msg)
-            binary.delete()
-        self.repo_obj.delete()
+        if self.repo_obj is None:
+            abort(404)
+        # only the rows are removed now, the repo and the files of its
+        # binaries are removed in the background, see purge_tombstones
+        logger.info('nuke repository path: %s', self.repo_obj.path)
+        tombstones.bury_binaries(self.project, models.Binary.repo_id == self.repo_obj.id)
+        tombstones.bury_repos(self.project, models.Repo.id == self.repo_obj.id)
         if self.project.repos.count() == 0:
             self.project.delete()
-        response.status = 204
+        response.status = 202
         return dict()
 
     @secure(basic_auth)
@@ -1,5 +1,5 @@
 from pecan import expose, abort, request
-from chacra.models import Project
+from chacra.models import Repo
 from chacra.controllers import error
 from chacra.controllers.repos import RepoController
 
@@ -7,7 +7,7 @@ from chacra.controllers.repos import RepoController
 class DistroController(object):
     def __init__(self, distro_name):
         self.distro_name = distro_name
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.ref = request.context['ref']
         self.sha1 = request.context['sha1']
         request.context['distro'] = distro_name
@@ -15,15 +15,12 @@ class DistroController(object):
     @expose('json', generic=True)
     def index(self):
         # TODO: Improve this duplication here (and spread to other controllers)
-        if self.distro_name not in self.project.repo_distros:
+        if not self.project.has_repo_distro(self.distro_name):
             abort(404)
-        if self.ref not in self.project.repo_refs:
+        if not self.project.has_repo_ref(self.ref):
             abort(404)
-        resp = []
-
-        for repo in self.project.repos.filter_by(distro=self.distro_name, ref=self.ref, sha1=self.sha1).all():
-            resp.append(repo.distro_version)
-        return list(set(resp))
+        return self.project.distinct(
+            Repo.distro_version, distro=self.distro_name, ref=self.ref, sha1=self.sha1)
 
     @index.when(method='POST', template='json')
     def index_post(self):
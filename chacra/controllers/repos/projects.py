@@ -1,6 +1,6 @@
 from pecan import expose, abort, request
-from chacra.models import Project
-from chacra.controllers import error
+from chacra.models import Project, Repo, Session
+from chacra.controllers import error, resolve
 from chacra.controllers.repos.refs import RefController
 
 
@@ -8,9 +8,11 @@ class ProjectController(object):
 
     def __init__(self, project_name):
         self.project_name = project_name
-        self.project = Project.query.filter_by(
-            name=project_name
-        ).first()
+        if 'project' not in request.context:
+            request.context['project'] = Project.query.filter_by(
+                name=project_name
+            ).first()
+        self.project = request.context['project']
         if not self.project:
             abort(404)
         request.context['project_id'] = self.project.id
@@ -20,13 +22,7 @@ class ProjectController(object):
         if request.method == 'POST':
             error('/errors/not_allowed',
                   'POST requests to this url are not allowed')
-        resp = {}
-        for ref in self.project.repo_refs:
-            resp[ref] = list(set(
-                [r.sha1 for r in
-                    self.project.repos.filter_by(ref=ref).all()]
-            ))
-        return resp
+        return self.project.tree(Repo.ref, Repo.sha1)
 
     @expose()
     def _lookup(self, name, *remainder):
@@ -37,11 +33,14 @@ class ProjectsController(object):
 
     @expose('json')
     def index(self):
-        resp = {}
-        for project in Project.query.all():
-            resp[project.name] = project.repo_refs
+        resp = dict((name, []) for name, in Session.query(Project.name))
+        query = Session.query(Project.name, Repo.ref).join(
+            Repo, Repo.project_id == Project.id).distinct()
+        for name, ref in query:
+            resp[name].append(ref)
         return resp
 
     @expose()
     def _lookup(self, project_name, *remainder):
+        resolve.repo(project_name, remainder)
         return ProjectController(project_name), remainder
@@ -1,5 +1,5 @@
 from pecan import expose, abort, request
-from chacra.models import Project
+from chacra.models import Repo
 from chacra.controllers import error
 from chacra.controllers.repos.sha1s import SHA1Controller
 
@@ -8,24 +8,14 @@ class RefController(object):
 
     def __init__(self, ref_name):
         self.ref_name = ref_name
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         request.context['ref'] = self.ref_name
 
     @expose('json', generic=True)
     def index(self):
-        if self.ref_name not in self.project.repo_refs:
+        if not self.project.has_repo_ref(self.ref_name):
             abort(404)
-        resp = {}
-        sha1s = list(set(
-            [r.sha1 for r in
-                self.project.repos.filter_by(ref=self.ref_name).all()]
-        ))
-        for sha1 in sha1s:
-            resp[sha1] = list(set(
-                [b.distro for b in
-                    self.project.repos.filter_by(ref=self.ref_name, sha1=sha1).all()]
-            ))
-        return resp
+        return self.project.tree(Repo.sha1, Repo.distro, ref=self.ref_name)
 
     @index.when(method='POST', template='json')
     def index_post(self):
@@ -1,5 +1,5 @@
 from pecan import expose, abort, request
-from chacra.models import Project
+from chacra.models import Repo
 from chacra.controllers import error
 from chacra.controllers.repos.distros import DistroController
 
@@ -8,21 +8,16 @@ class SHA1Controller(object):
 
     def __init__(self, sha1):
         self.sha1 = sha1
-        self.project = Project.get(request.context['project_id'])
+        self.project = request.context['project']
         self.ref = request.context['ref']
         request.context['sha1'] = sha1
 
     @expose('json', generic=True)
     def index(self):
-        if self.sha1 not in self.project.repo_sha1s:
+        if not self.project.has_repo_sha1(self.sha1):
             abort(404)
-        resp = {}
-        for distro in self.project.repo_distros:
-            resp[distro] = list(set(
-                [b.distro_version for b in
-                    self.project.repos.filter_by(distro=distro, ref=self.ref, sha1=self.sha1).all()]
-            ))
-        return resp
+        return self.project.tree(
+            Repo.distro, Repo.distro_version, ref=self.ref, sha1=self.sha1)
 
     @index.when(method='POST', template='json')
     def index_post(self):
@@ -0,0 +1,90 @@
+"""
+Resolve the objects behind a URL in a single query, before the ``_lookup``
+chain of controllers walks it. The results go in ``request.context`` so that
+the controllers read them from there instead of querying (or checking
+membership) once per level.
+
+Only GET and HEAD requests for the deepest paths (a binary or a repo) are
+resolved, anything else is left to the controllers as before.
+"""
+from pecan import request
+from sqlalchemy import and_
+from sqlalchemy.orm import Load
+from chacra.models import Binary, Project, Repo, Session
+
+# names that the arch and flavor controllers route themselves, so they can't
+# be binaries
+routed_names = ('index', 'flavors', 'uploads')
+
+
+def _parts(remainder):
+    parts = list(remainder)
+    while parts and not parts[-1]:
+        parts.pop()
+    return parts
+
+
+def _binary_key(parts):
+    """
+    ``ref/sha1/distro/distro_version/arch/name`` or
+    ``ref/sha1/distro/distro_version/arch/flavors/flavor/name``
+    """
+    if len(parts) == 6:
+        key = dict(zip(['ref', 'sha1', 'distro', 'distro_version', 'arch', 'name'], parts))
+        key['flavor'] = 'default'
+    elif len(parts) == 8 and parts[5] == 'flavors':
+        key = dict(zip(['ref', 'sha1', 'distro', 'distro_version', 'arch'], parts))
+        key['flavor'], key['name'] = parts[6], parts[7]
+    else:
+        return None
+    if key['name'] in routed_names:
+        return None
+    return key
+
+
+def _repo_key(parts):
+    """
+    ``ref/sha1/distro/distro_version`` or
+    ``ref/sha1/distro/distro_version/flavors/flavor``
+    """
+    if len(parts) == 4:
+        key = dict(zip(['ref', 'sha1', 'distro', 'distro_version'], parts))
+        key['flavor'] = 'default'
+    elif len(parts) == 6 and parts[4] == 'flavors':
+        key = dict(zip(['ref', 'sha1', 'distro', 'distro_version'], parts))
+        key['flavor'] = parts[5]
+    else:
+        return None
+    return key
+
+
+def _resolve(project_name, name, model, key):
+    if key is None or request.method not in ('GET', 'HEAD'):
+        request.context['project'] = Project.query.filter_by(name=project_name).first()
+        return
+    conditions = [model.project_id == Project.id]
+    conditions.extend(getattr(model, column) == value for column, value in key.items())
+    # deferred columns too, they are needed to render the object
+    query = Session.query(Project, model).options(Load(model).undefer('*'))
+    project, obj = query.outerjoin(model, and_(*conditions)).filter(
+        Project.name == project_name).first() or (None, None)
+    request.context['project'] = project
+    request.context[name] = obj
+
+
+def binary(project_name, remainder):
+    """
+    Resolve the project and, for a binary path, the binary at once. After
+    this ``request.context['project']`` is always set (to ``None`` if it
+    doesn't exist) and ``request.context['binary']`` is set only when the path
+    was resolved to a binary (``None`` meaning there isn't one)
+    """
+    _resolve(project_name, 'binary', Binary, _binary_key(_parts(remainder)))
+
+
+def repo(project_name, remainder):
+    """
+    Same as :func:`binary`, for the repos tree: ``request.context['repo']`` is
+    set only when the path was resolved to a repo
+    """
+    _resolve(project_name, 'repo', Repo, _repo_key(_parts(remainder)))
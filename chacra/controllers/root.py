@@ -4,6 +4,7 @@ from chacra.controllers.projects import ProjectsController
 from chacra.controllers.errors import ErrorsController
 from chacra.controllers.search import SearchController
 from chacra.controllers.health import HealthController
+from chacra.controllers.deletions import DeletionsController
 from chacra.controllers.repos.projects import (
     ProjectsController as RepoProjectsController,
 )
@@ -33,3 +34,4 @@ class RootController(object):
     search = SearchController()
     repos = RepoProjectsController()
     health = HealthController()
+    deletions = DeletionsController()
@@ -1,6 +1,39 @@
-from pecan import expose
+import base64
+import datetime
+import json
+from urllib.parse import urlencode
+
+from pecan import expose, request, response, override_template
+from sqlalchemy import func, tuple_
 from chacra.models import Binary
-from chacra.controllers import error
+from chacra.controllers import error, util
+from chacra.serializers import BinaryRecord
+
+# no page is larger than this, no matter what ``limit`` asks for
+max_limit = 1000
+
+# operators that can be appended to the columns that allow ranges, e.g.
+# ``size-gte=1024`` or ``created-lt=2024-01-01``
+range_operators = {
+    'gt': lambda column, value: column > value,
+    'gte': lambda column, value: column >= value,
+    'lt': lambda column, value: column < value,
+    'lte': lambda column, value: column <= value,
+}
+
+
+def parse_size(value):
+    return int(value)
+
+
+def parse_date(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def escape_like(value):
+    for char in ('\\', '%', '_'):
+        value = value.replace(char, '\\' + char)
+    return value
 
 
 class SearchController(object):
@@ -11,21 +44,83 @@ class SearchController(object):
                 'distro_version': Binary.distro_version,
                 'arch': Binary.arch,
                 'ref': Binary.ref,
+                'sha1': Binary.sha1,
+                'flavor': Binary.flavor,
+                'checksum': Binary.checksum,
                 'built_by': Binary.built_by,
                 'size': Binary.size,
                 'name': Binary.name,
                 'name-has': Binary.name.like,
         }
+        # columns that allow range operators, with how to parse their values
+        self.ranges = {
+                'size': (Binary.size, parse_size),
+                'created': (Binary.created, parse_date),
+                'modified': (Binary.modified, parse_date),
+        }
+        for name, (column, parse) in self.ranges.items():
+            for operator in range_operators:
+                self.filters['%s-%s' % (name, operator)] = column
+        # pages are always ordered by one of these and then by id, so that
+        # the cursor of a page can pick up exactly where it left off
+        self.sorting = {
+                'created': (Binary.created, parse_date),
+                'modified': (Binary.modified, parse_date),
+                'name': (Binary.name, str),
+                'size': (func.coalesce(Binary.size, 0), parse_size),
+        }
 
     @expose('json')
+    @expose(content_type=util.ndjson_type)
     def index(self, **kw):
+        # streamed results are not paginated, there is no limit unless one is
+        # asked for
+        stream = util.wants_stream(request)
+        if not stream:
+            override_template('json', 'application/json')
+        kw.pop('stream', None)
+        limit = kw.pop('limit', None if stream else max_limit)
+        sort = kw.pop('sort', 'created')
+        cursor = kw.pop('cursor', None)
+        try:
+            fields = BinaryRecord.parse_fields(kw.pop('fields', None))
+        except ValueError as exc:
+            return error('/errors/invalid/', str(exc))
         query = self.apply_filters(kw)
         if not query:
+            if stream:
+                # nothing matches, just like a stream without results
+                response.app_iter = []
+                return response
             return {}
-        return query.all()
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                limit = 0
+            if limit < 1:
+                return error('/errors/invalid/', 'limit must be a positive integer')
+        if not isinstance(sort, str) or sort.lstrip('-') not in self.sorting:
+            return error('/errors/invalid/', 'cannot sort by: %s' % sort)
+
+        # only the columns for the fields (and the position of the last row
+        # for the cursor) are selected, rows are not loaded as binaries
+        query = BinaryRecord.query(
+            self.paginate(query, sort, cursor), fields, extra=[sort.lstrip('-')])
+        if stream:
+            if limit is not None:
+                query = query.limit(limit)
+            return util.stream(
+                response, query, transform=lambda rows: BinaryRecord.records(rows, fields))
+        limit = min(limit, max_limit)
+        # one more than needed tells if there is a next page
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            self.link_next_page(kw, limit, sort, fields, rows[-1])
+        return list(BinaryRecord.records(rows, fields))
 
     def apply_filters(self, filters):
-        # TODO: allow operators
         query = None
         for k, v in filters.items():
             if k not in self.filters:
@@ -36,15 +131,85 @@ class SearchController(object):
 
     def filter_binary(self, key, value, query=None):
         filter_obj = self.filters[key]
-        # for *-has search only
-        search_value = '%{value}%'.format(value=value)
 
         # query will exist if multiple filters are being applied, e.g. by name
         # and by distro but otherwise it will be None
-        if query:
-            if key.endswith('-has'):
-                return query.filter(filter_obj(search_value))
-            return query.filter(filter_obj == value)
+        if query is None:
+            query = Binary.query
         if key.endswith('-has'):
-            return Binary.query.filter(filter_obj(search_value))
-        return Binary.query.filter(filter_obj == value)
+            # wildcards in the value are escaped so that they match literally,
+            # in PostgreSQL this uses the trigram index on the name
+            if not isinstance(value, str):
+                return error('/errors/invalid/', 'only one value is allowed for %s' % key)
+            search_value = '%{value}%'.format(value=escape_like(value))
+            return query.filter(filter_obj(search_value, escape='\\'))
+        name, _, operator = key.rpartition('-')
+        if operator in range_operators and name in self.ranges:
+            try:
+                value = self.ranges[name][1](value)
+            except (TypeError, ValueError):
+                return error('/errors/invalid/', 'invalid value for %s: %s' % (key, value))
+            return query.filter(range_operators[operator](filter_obj, value))
+        return query.filter(filter_obj == value)
+
+    def paginate(self, query, sort, cursor=None):
+        """
+        Order by the ``sort`` column (descending if it starts with ``-``) and
+        then by id, starting right after the binary the ``cursor`` points to.
+        Every page is then a walk over the index from where the last one
+        stopped, instead of skipping over all the rows of the pages before it.
+        """
+        descending = sort.startswith('-')
+        column, parse = self.sorting[sort.lstrip('-')]
+        if cursor is not None:
+            try:
+                cursor_sort, value, last_id = decode_cursor(cursor)
+                value = parse(value)
+            except (TypeError, ValueError):
+                return error('/errors/invalid/', 'invalid cursor: %s' % cursor)
+            if cursor_sort != sort:
+                return error('/errors/invalid/', 'cursor is not for sort: %s' % sort)
+            position = tuple_(column, Binary.id)
+            if descending:
+                query = query.filter(position < tuple_(value, last_id))
+            else:
+                query = query.filter(position > tuple_(value, last_id))
+        if descending:
+            return query.order_by(column.desc(), Binary.id.desc())
+        return query.order_by(column, Binary.id)
+
+    def link_next_page(self, filters, limit, sort, fields, last):
+        name = sort.lstrip('-')
+        value = getattr(last, name)
+        if name == 'size':
+            value = value or 0
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        cursor = encode_cursor(sort, value, last.id)
+        params = dict(filters, limit=limit, sort=sort, cursor=cursor)
+        if fields != BinaryRecord.fields:
+            params['fields'] = ','.join(fields)
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = '<%s?%s>; rel="next"' % (
+            request.path_url, urlencode(params))
+
+
+def encode_cursor(sort, value, last_id):
+    """
+    Cursors are opaque to clients, they just hand them back to get the next
+    page. The padding is left out so that they don't need quoting in URLs
+    """
+    data = json.dumps([sort, value, last_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = base64.urlsafe_b64decode((cursor + padding).encode('ascii'))
+        sort, value, last_id = json.loads(data)
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(last_id, int) or not isinstance(sort, str):
+        raise ValueError('invalid cursor')
+    return sort, value, last_id
@@ -5,11 +5,19 @@ except:
     UTC=datetime.timezone.utc
 from datetime import datetime, timedelta
 
+import functools
+import itertools
 import logging
-from pecan import conf
+from pecan import conf, jsonify
+from chacra import models
 
 logger = logging.getLogger(__name__)
 
+ndjson_type = 'application/x-ndjson'
+
+# rows fetched from the database at a time when streaming
+stream_batch = 1000
+
 
 def repository_is_automatic(project_name, repo_config=None):
     repo_config = repo_config or getattr(conf, 'repos', {})
@@ -22,11 +30,86 @@ def repository_is_automatic(project_name, repo_config=None):
     return False
 
 
-def last_seen(timestamp):
-    now = datetime.now(UTC)
+def not_modified(request, etag=None, last_modified=None):
+    """
+    Tell if the client that made ``request`` already has the current version
+    of a resource (and a 304 can be returned) by checking ``If-None-Match``
+    and, only when that is not used, ``If-Modified-Since``
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if 'If-None-Match' in request.headers:
+        return etag is not None and etag in request.if_none_match
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=UTC)
+    # HTTP dates have no fractions of a second
+    return last_modified.replace(microsecond=0) <= since
+
+
+def wants_stream(request):
+    """
+    Tell if the client asked for a streamed response, with one JSON record per
+    line, either with ``?stream=1`` or by preferring ``application/x-ndjson``
+    over ``application/json``. Controllers that can stream are exposed for
+    both, so when this is false they need to render JSON with
+    ``override_template`` (pecan could pick NDJSON if the client accepts both).
+    """
+    if request.GET.get('stream') in ('1', 'true', 'yes'):
+        return True
+    offers = request.accept.acceptable_offers(['application/json', ndjson_type])
+    return bool(offers) and offers[0][0] == ndjson_type
+
+
+def stream(response, query, transform=None):
+    """
+    Send the results of ``query`` as newline delimited JSON, one record per
+    line as they come from a server-side cursor, so memory use does not
+    depend on how many there are. ``transform`` can turn the rows into
+    different records. The response is returned so that controllers can
+    return it and skip rendering.
+    """
+    response.content_type = ndjson_type
+    response.app_iter = _ndjson_lines(query, transform)
+    return response
+
+
+def _ndjson_lines(query, transform=None):
+    # the request (and its session) is over by the time the body is sent,
+    # so the rows come from a (read only) session of their own
+    session = models.read_only_session()
+    try:
+        records = query.with_session(session).yield_per(stream_batch)
+        if transform is not None:
+            records = transform(records)
+        for record in records:
+            yield (jsonify.encode(record) + '\n').encode('utf-8')
+    finally:
+        session.close()
+
+
+def grouped(rows):
+    """
+    Turn ``(parent, child)`` rows, ordered by parent, into one
+    ``{parent: [child, ...]}`` record for each parent
+    """
+    for parent, group in itertools.groupby(rows, key=lambda row: row[0]):
+        yield {parent: [row[1] for row in group]}
+
+
+def last_seen(timestamp, now=None):
+    now = now or datetime.now(UTC)
     difference = now - timestamp.replace(tzinfo=UTC)
-    formatted = ReadableSeconds(difference.seconds)
-    return "%s ago" % formatted
+    return "%s ago" % readable_seconds(difference.seconds)
+
+
+@functools.lru_cache(maxsize=None)
+def readable_seconds(seconds):
+    # there are only so many seconds in a day, listings of many binaries
+    # format the same ones over and over
+    return str(ReadableSeconds(seconds))
 
 
 class ReadableSeconds(object):
@@ -1,6 +1,10 @@
+import hashlib
 import logging
+import os
 from webob.exc import WSGIHTTPException
+from pecan import conf, abort
 from pecan.hooks import PecanHook
+from chacra.controllers import util
 
 
 log = logging.getLogger(__name__)
@@ -24,3 +28,70 @@ class CustomErrorHook(PecanHook):
 
         log.exception('unhandled error by Chacra')
 
+
+
+class SpooledBodyHook(PecanHook):
+    """
+    Lets the web server receive request bodies instead of the app. Nginx
+    (with ``client_body_in_file_only``) writes the body to a file in
+    ``upload_spool_dir`` and only sends its path in the
+    ``X-Request-Body-File`` header. The body of the request is replaced with
+    that file, so uploads can be linked into place and workers are not tied
+    up for the length of an upload.
+
+    Only uploads (``POST`` and ``PUT`` requests to ``/binaries/``, which is
+    the only location Nginx sets the header for) use it, the header is
+    ignored everywhere else. Paths outside of ``upload_spool_dir`` are
+    rejected, and nothing is done when it is not configured.
+    """
+
+    header = 'X-Request-Body-File'
+    methods = ('POST', 'PUT')
+    prefix = '/binaries/'
+
+    def on_route(self, state):
+        spool_dir = getattr(conf, 'upload_spool_dir', None)
+        path = state.request.headers.get(self.header)
+        if not spool_dir or not path:
+            return
+        if state.request.method not in self.methods or not state.request.path.startswith(self.prefix):
+            log.warning('ignoring %s for %s %s', self.header, state.request.method, state.request.path)
+            return
+        spool_dir = os.path.realpath(spool_dir)
+        path = os.path.realpath(path)
+        if not path.startswith(spool_dir + os.sep) or not os.path.isfile(path):
+            log.error('refusing to use %s as a request body', path)
+            abort(400)
+        body = open(path, 'rb')
+        state.request.body_file = body
+        state.request.content_length = os.fstat(body.fileno()).st_size
+        # it is a regular file, which can be used as is (and linked)
+        state.request.is_body_seekable = True
+        state.request.environ['chacra.spooled_body'] = body
+
+    def after(self, state):
+        body = state.request.environ.get('chacra.spooled_body')
+        if body is not None:
+            body.close()
+
+
+class JSONETagHook(PecanHook):
+    """
+    Adds a weak entity tag to JSON responses (like the listings of binaries,
+    repos and projects) so that clients and caches can revalidate them with
+    ``If-None-Match`` and get a 304 when nothing changed. The tag is a hash of
+    the rendered body, which is still built for every request, but it does
+    not need to be sent again.
+    """
+
+    def after(self, state):
+        request, response = state.request, state.response
+        if request.method not in ('GET', 'HEAD') or response.status_int != 200:
+            return
+        if response.content_type != 'application/json' or 'ETag' in response.headers:
+            return
+        etag = hashlib.md5(response.body).hexdigest()
+        response.headers['ETag'] = 'W/"%s"' % etag
+        if util.not_modified(request, etag):
+            response.status = 304
+            response.body = b''
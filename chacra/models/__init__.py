@@ -1,5 +1,6 @@
 import datetime
 from sqlalchemy import create_engine, MetaData, event
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import scoped_session, sessionmaker, object_session, mapper
 from sqlalchemy.ext.declarative import declarative_base
 from pecan import conf
@@ -63,14 +64,43 @@ def update_timestamp(mapper, connection, target):
 
 # Utilities:
 
-def get_or_create(model, **kwargs):
+def insert_or_ignore(table, rows):
+    """
+    Insert ``rows`` (a dictionary, or a list of them) into ``table`` skipping
+    the ones that already exist (that would violate a unique constraint),
+    like a row that a concurrent request has just inserted, without an error.
+    Returns the ids of the rows that were inserted when the database can tell
+    (PostgreSQL), an empty list otherwise.
+    """
+    connection = Session.connection()
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+        return [row.id for row in connection.execute(statement.returning(table.c.id))]
+    statement = table.insert().values(rows)
+    if dialect == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    elif dialect == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    connection.execute(statement)
+    return []
+
+
+def get_or_create(model, defaults=None, **kwargs):
+    """
+    The instance of ``model`` that matches ``kwargs``, which must be the
+    columns of a unique constraint. If there isn't one it is inserted (along
+    with any other values in ``defaults``) in a way that concurrent requests
+    doing the same end up with the very same row. Nothing is committed.
+    """
     instance = model.filter_by(**kwargs).first()
     if instance:
         return instance
-    else:
-        instance = model(**kwargs)
-        commit()
-        return instance
+    values = dict(defaults or {}, **kwargs)
+    ids = insert_or_ignore(model.__table__, values)
+    if ids:
+        return model.get(ids[0])
+    return model.filter_by(**kwargs).one()
 
 
 def init_model():
@@ -91,6 +121,9 @@ def init_model():
     """
     conf.sqlalchemy.engine = _engine_from_config(conf.sqlalchemy)
     Session.configure(bind=conf.sqlalchemy.engine)
+    # requests that only read can use a replica, with a pool of its own
+    if getattr(conf, 'sqlalchemy_read', None):
+        conf.sqlalchemy_read.engine = _engine_from_config(conf.sqlalchemy_read)
 
 
 def _engine_from_config(configuration):
@@ -104,8 +137,39 @@ def start():
     metadata.bind = conf.sqlalchemy.engine
 
 
+def read_engine():
+    """
+    The engine for reading only, which is the one for ``sqlalchemy_read``
+    (usually a replica) when it is configured
+    """
+    read = getattr(conf, 'sqlalchemy_read', None)
+    return getattr(read, 'engine', None) or conf.sqlalchemy.engine
+
+
+def read_only_session():
+    """
+    A session bound to the read engine, that never autoflushes since there
+    is nothing to write
+    """
+    return Session.session_factory(
+        bind=read_engine(), autoflush=False, info={'read_only': True}
+    )
+
+
 def start_read_only():
-    start()
+    """
+    GET and HEAD requests are not committed, and run on a read only session.
+    A session that is already open with pending changes (which can only
+    come from outside of a request) is kept instead of throwing them away.
+    """
+    if Session.registry.has():
+        session = Session.registry()
+        if session.new or session.dirty or session.deleted:
+            metadata.bind = conf.sqlalchemy.engine
+            return
+        session.close()
+    Session.registry.set(read_only_session())
+    metadata.bind = conf.sqlalchemy.engine
 
 
 def commit():
@@ -128,3 +192,7 @@ def flush():
 from .projects import Project  # noqa
 from .binaries import Binary  # noqa
 from .repos import Repo  # noqa
+from .chunks import Chunk  # noqa
+from .catalog import Catalog  # noqa
+from .tombstones import Tombstone  # noqa
+from . import registration  # noqa
@@ -1,22 +1,57 @@
-import hashlib
 import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, BigInteger
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, BigInteger, Index, DDL
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.event import listen
 from sqlalchemy.orm.exc import DetachedInstanceError
 from sqlalchemy.exc import InvalidRequestError
 from chacra.models import Base, update_timestamp
-from chacra.models.repos import Repo
+from chacra.models import repos
 from chacra.controllers import util
+from chacra import storage
 try:
     from datetime import UTC
 except:
     UTC=datetime.timezone.utc
 
 
+# distro versions of binaries that work in any version of a distro
+generic_versions = ['generic', 'universal', 'any']
+
+# substring searches on names (``LIKE '%value%'``) can't use a B-tree index,
+# in PostgreSQL they use this trigram index instead
+name_trigram_index = 'ix_binaries_name_trgm'
+
+
+def repo_type(name):
+    """
+    The type of repo (``rpm`` or ``deb``) a binary called ``name`` goes in
+    """
+    extension_map = {
+        'rpm': 'rpm',
+        'deb': 'deb',
+        'ddeb': 'deb',
+        'dsc': 'deb',
+        'changes': 'deb'
+    }
+
+    # XXX This is very naive, but 'deb' repos are the only ones that
+    # will have .tar or .tar.gz or just .gz extensions for source
+    # files, so fallback to that
+    return extension_map.get(name.split('.')[-1], 'deb')
+
+
 class Binary(Base):
 
     __tablename__ = 'binaries'
+    __table_args__ = (
+        # every binary URL resolves to these, in this order, so listings use a
+        # prefix of the index and single binaries all of it. Files on disk
+        # follow the same structure, so there can't be two binaries for one
+        Index(
+            'ix_binaries_lookup', 'project_id', 'ref', 'sha1', 'distro',
+            'distro_version', 'arch', 'name', 'flavor', unique=True,
+        ),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(256), nullable=False, index=True)
     path = Column(String(256))
@@ -31,7 +66,13 @@ class Binary(Base):
     modified = Column(DateTime, index=True)
     signed = Column(Boolean(), default=False)
     size = Column(BigInteger, default=0)
-    checksum = Column(String(256))
+    checksum = Column(String(256), index=True)
+    sha256 = Column(String(64))
+    md5 = Column(String(32))
+    # inode:size:mtime_ns of the file when the checksums were computed
+    file_identity = Column(String(64))
+    # file_identity of the file when its chunks were indexed
+    chunks_identity = Column(String(64))
 
     project_id = Column(Integer, ForeignKey('projects.id'))
     project = relationship('Project', backref=backref('binaries', lazy='dynamic'))
@@ -51,7 +92,17 @@ class Binary(Base):
         'flavor',
     ]
 
-    def __init__(self, name, project, repo=None, **kw):
+    # only chacra computes digests (see ``set_digests``), clients can't set
+    # them, or they could claim any checksum for any file. The identity of
+    # the file tells if it still has those digests, so it is one of them
+    digest_keys = [
+        'checksum',
+        'sha256',
+        'md5',
+        'file_identity',
+    ]
+
+    def __init__(self, name, project, repo=None, digests=None, **kw):
         self.name = name
         self.project = project
         now = datetime.datetime.now(UTC)
@@ -62,27 +113,42 @@ class Binary(Base):
         for key in self.allowed_keys:
             if key in kw.keys():
                 setattr(self, key, kw[key])
+        if digests:
+            # before looking up the repo, which can flush this binary
+            self.set_digests(digests)
         self.repo = repo or self._get_or_create_repo()
         # ensure that the repo.type is set
         self._set_repo_type()
+        # the rest of the summary of the repo is updated when this is flushed,
+        # but other binaries need to know right away
+        if self.is_generic:
+            self.repo.has_generic = True
+
+    def update_from_json(self, data):
+        """
+        Same as for other models, except for the digests, which are ignored
+        """
+        super(Binary, self).update_from_json(
+            dict((k, v) for k, v in data.items() if k not in self.digest_keys)
+        )
+
+    def set_digests(self, digests):
+        """
+        Set the digests (along with the size and the identity of the file)
+        that ``storage`` computed while writing the file, so that it is not
+        read again when this binary is flushed
+        """
+        for key in self.digest_keys + ['size']:
+            if key in digests:
+                setattr(self, key, digests[key])
+        self._computed_digests = True
 
     @property
     def extension(self):
         return self.name.split('.')[-1]
 
     def _get_repo_type(self):
-        extension_map = {
-            'rpm': 'rpm',
-            'deb': 'deb',
-            'ddeb': 'deb',
-            'dsc': 'deb',
-            'changes': 'deb'
-        }
-
-        # XXX This is very naive, but 'deb' repos are the only ones that
-        # will have .tar or .tar.gz or just .gz extensions for source
-        # files, so fallback to that
-        return extension_map.get(self.extension, 'deb')
+        return repo_type(self.name)
 
     def _set_repo_type(self):
         if self.repo.type is None:
@@ -93,26 +159,15 @@ class Binary(Base):
         A repo model object may exist for this binary, if it exists, then
         return it otherwise create it and then return it.
         """
-        # try to find one that matches our needs first
-        repo = Repo.query.filter_by(
-            ref=self.ref,
+        repo = repos.get_or_create(
+            self.project,
+            self.ref,
+            self.distro,
+            self.distro_version,
             sha1=self.sha1,
             flavor=self.flavor,
-            distro=self.distro,
-            distro_version=self.distro_version,
-            project=self.project).first()
-
-        # create one otherwise
-        if not repo:
-            repo = Repo(
-                self.project,
-                self.ref,
-                self.distro,
-                self.distro_version,
-                sha1=self.sha1,
-                flavor=self.flavor,
-                type=self._get_repo_type(),
-            )
+            type=self._get_repo_type(),
+        )
         # only needs_update when binary is not generic and automatic repos
         # are configured for this project
         repo.needs_update = not self.is_generic and util.repository_is_automatic(self.project.name)
@@ -132,6 +187,17 @@ class Binary(Base):
             last = self.created
         return util.last_seen(last)
 
+    def has_contents(self, checksum):
+        """
+        Tell if the file for this binary is still the one that was hashed and
+        its SHA-512 is ``checksum``, without reading it
+        """
+        if not self.path or not self.file_identity:
+            return False
+        if self.checksum != checksum:
+            return False
+        return storage.file_identity(self.path) == self.file_identity
+
     @property
     def is_generic(self):
         """
@@ -144,8 +210,7 @@ class Binary(Base):
         * universal
         * any
         """
-        target_versions = ['generic', 'universal', 'any']
-        if self.distro_version in target_versions:
+        if self.distro_version in generic_versions:
             return True
         return False
 
@@ -163,6 +228,8 @@ class Binary(Base):
             distro=self.distro,
             distro_version=self.distro_version,
             checksum=self.checksum,
+            sha256=self.sha256,
+            md5=self.md5,
             arch=self.arch,
             ref=self.ref,
             sha1=self.sha1,
@@ -186,16 +253,27 @@ def generate_checksum(mapper, connection, target):
     # paths and files, this should be required.
     if not target.path:
         return
-    chsum = hashlib.sha512()
-    with open(target.path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            chsum.update(chunk)
-        target.checksum = chsum.hexdigest()
+    # uploads compute the digests while writing the file, when they are
+    # already known there is no need to read the file again. Only digests
+    # set by chacra count, a checksum assigned any other way is not trusted
+    if getattr(target, '_computed_digests', False):
+        target._computed_digests = False
+        return
+    # metadata-only changes should not re-read (potentially huge) files, only
+    # compute the checksums again if the file is not the one that was hashed
+    if target.checksum and target.file_identity:
+        if storage.file_identity(target.path) == target.file_identity:
+            return
+    digests = storage.checksums(target.path)
+    target.checksum = digests['checksum']
+    target.sha256 = digests['sha256']
+    target.md5 = digests['md5']
+    target.file_identity = digests['file_identity']
 
 
 def update_repo(mapper, connection, target):
     try:
-        if target.repo.is_generic:
+        if target.repo.has_generic:
             return
     except (AttributeError, InvalidRequestError):
         # SQLA might not have finished flushing the object
@@ -230,3 +308,28 @@ add_timestamp_listeners()
 listen(Binary, 'before_insert', update_repo)
 listen(Binary, 'before_update', update_repo)
 
+
+
+def trigrams_available(ddl, target, bind, **kw):
+    """
+    The trigram index needs PostgreSQL with the ``pg_trgm`` extension (it
+    comes with ``postgresql-contrib``), everywhere else (like SQLite)
+    substring searches just scan the table
+    """
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    ).first() is not None
+
+# the index is not part of the table so that it only gets created where it can
+listen(
+    Binary.__table__, 'after_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(callable_=trigrams_available)
+)
+listen(
+    Binary.__table__, 'after_create',
+    DDL(
+        'CREATE INDEX %s ON binaries USING gin (name gin_trgm_ops)' % name_trigram_index
+    ).execute_if(callable_=trigrams_available)
+)
@@ -0,0 +1,266 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, BigInteger, Index, and_, or_, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.event import listen
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, object_session
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+from sqlalchemy.orm.util import identity_key
+from chacra.models import Base, Session
+from chacra.models.binaries import Binary, generic_versions
+from chacra.models.repos import Repo
+
+
+class Catalog(Base):
+    """
+    A summary of the binaries of every project: one row for each distinct
+    (project, ref, sha1, distro, distro_version, arch, flavor) with how many
+    binaries are there and their total size. The ``Binary`` listeners keep it
+    current, so the navigation endpoints only go through as many rows as they
+    return, regardless of how many binaries there are.
+    """
+
+    __tablename__ = 'catalog'
+    __table_args__ = (
+        Index(
+            'ix_catalog_lookup', 'project_id', 'ref', 'sha1', 'distro',
+            'distro_version', 'arch', 'flavor', unique=True,
+        ),
+    )
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
+    ref = Column(String(256))
+    sha1 = Column(String(256))
+    distro = Column(String(256), nullable=False)
+    distro_version = Column(String(256), nullable=False)
+    arch = Column(String(256), nullable=False)
+    flavor = Column(String(256), nullable=False)
+    binaries = Column(Integer, nullable=False, default=0)
+    size = Column(BigInteger, nullable=False, default=0)
+
+    # rows are only ever changed by the listeners, so there is no backref
+    project = relationship('Project')
+
+    keys = ['project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch', 'flavor']
+
+    def __repr__(self):
+        return '<Catalog %s/%s/%s/%s/%s/%s>' % (
+            self.ref, self.sha1, self.distro, self.distro_version, self.arch, self.flavor)
+
+
+def adjust(connection, key, binaries, size):
+    """
+    Add (or subtract) ``binaries`` and ``size`` to the row for ``key``,
+    creating it when a binary is added to a new location and removing it when
+    there are no binaries left
+    """
+    if key['project_id'] is None:
+        return
+    table = Catalog.__table__
+    where = and_(*[table.c[name] == value for name, value in key.items()])
+    if binaries > 0:
+        _upsert(connection, key, binaries, size)
+        return
+    connection.execute(
+        table.update().where(where).values(
+            binaries=table.c.binaries + binaries,
+            size=table.c.size + size,
+        )
+    )
+    if binaries < 0:
+        connection.execute(table.delete().where(and_(where, table.c.binaries <= 0)))
+
+
+def _upsert(connection, key, binaries, size, replace=False):
+    """
+    Add ``binaries`` and ``size`` to the row for ``key`` (or set them, with
+    ``replace``), inserting it if it doesn't exist yet. Concurrent requests
+    for a new location would otherwise both try to insert it: PostgreSQL does
+    it in a single ``INSERT ... ON CONFLICT DO UPDATE``, other databases
+    update the row that won instead.
+    """
+    table = Catalog.__table__
+    where = and_(*[table.c[name] == value for name, value in key.items()])
+    if replace:
+        update = table.update().where(where).values(binaries=binaries, size=size)
+    else:
+        update = table.update().where(where).values(
+            binaries=table.c.binaries + binaries,
+            size=table.c.size + size,
+        )
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(binaries=binaries, size=size, **key)
+        excluded = statement.excluded
+        if replace:
+            values = dict(binaries=excluded.binaries, size=excluded.size)
+        else:
+            values = dict(
+                binaries=table.c.binaries + excluded.binaries,
+                size=table.c.size + excluded.size,
+            )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=Catalog.keys, set_=values,
+        ))
+        return
+    if connection.execute(update).rowcount:
+        return
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(table.insert().values(binaries=binaries, size=size, **key))
+    except IntegrityError:
+        savepoint.rollback()
+        connection.execute(update)
+    else:
+        savepoint.commit()
+
+
+def recount(connection, keys):
+    """
+    Set the rows for every key in ``keys`` to what the binaries table has
+    for them, counting all of them in a single query. This is for binaries
+    that were written without going through the ORM (and its listeners),
+    where there is no history to tell what changed.
+    """
+    keys = [key for key in keys if key['project_id'] is not None]
+    if not keys:
+        return
+    binaries = Binary.__table__
+    columns = [binaries.c[name] for name in Catalog.keys]
+    rows = connection.execute(
+        select(columns + [
+            func.count().label('binaries'),
+            func.coalesce(func.sum(binaries.c.size), 0).label('size'),
+        ]).where(or_(*[
+            and_(*[binaries.c[name] == value for name, value in key.items()])
+            for key in keys
+        ])).group_by(*columns)
+    ).fetchall()
+    totals = dict(
+        (tuple(row[name] for name in Catalog.keys), (row.binaries, row.size))
+        for row in rows
+    )
+    table = Catalog.__table__
+    for key in keys:
+        count, size = totals.get(tuple(key[name] for name in Catalog.keys), (0, 0))
+        where = and_(*[table.c[name] == value for name, value in key.items()])
+        if not count:
+            connection.execute(table.delete().where(where))
+            continue
+        _upsert(connection, key, count, size, replace=True)
+
+
+def summarize_repo(connection, repo_id, session=None):
+    """
+    Update the summary of the binaries in a repo (``archs``, ``has_generic``
+    and ``binary_count``) from the catalog rows for its location, which are
+    only a handful regardless of how many binaries there are. The repo is
+    locked first so that concurrent uploads see each other's binaries.
+    """
+    repos = Repo.__table__
+    repo = connection.execute(
+        select([
+            repos.c.project_id, repos.c.ref, repos.c.sha1, repos.c.distro,
+            repos.c.distro_version, repos.c.flavor,
+        ]).where(repos.c.id == repo_id).with_for_update()
+    ).first()
+    if repo is None:
+        return
+    table = Catalog.__table__
+    rows = connection.execute(
+        select([table.c.arch, table.c.binaries]).where(and_(
+            *[table.c[name] == value for name, value in repo.items()]
+        ))
+    ).fetchall()
+    binary_count = sum(row.binaries for row in rows)
+    values = dict(
+        archs=sorted(set(row.arch for row in rows if row.binaries > 0)),
+        has_generic=binary_count > 0 and repo.distro_version in generic_versions,
+        binary_count=binary_count,
+    )
+    connection.execute(repos.update().where(repos.c.id == repo_id).values(**values))
+    # the repo might already be loaded, and it should not be stale
+    instance = session.identity_map.get(identity_key(Repo, repo_id)) if session else None
+    if instance is not None:
+        for name, value in values.items():
+            set_committed_value(instance, name, value)
+
+
+def _changed_repos(target, *repo_ids):
+    """
+    Repos are summarized once per flush, no matter how many of their
+    binaries changed
+    """
+    session = object_session(target)
+    pending = session.info.setdefault('chacra.changed_repos', set())
+    pending.update(repo_id for repo_id in repo_ids if repo_id is not None)
+
+
+def _key(target, history=False):
+    key = {}
+    for name in Catalog.keys:
+        value = getattr(target, name)
+        if history:
+            deleted = get_history(target, name).deleted
+            if deleted:
+                value = deleted[0]
+        key[name] = value
+    return key
+
+
+# Listeners
+
+
+def binary_added(mapper, connection, target):
+    adjust(connection, _key(target), 1, target.size or 0)
+    _changed_repos(target, target.repo_id)
+
+
+def binary_removed(mapper, connection, target):
+    adjust(connection, _key(target, history=True), -1, -_old_size(target))
+    _changed_repos(target, _old_repo_id(target))
+
+
+def binary_changed(mapper, connection, target):
+    old_key, new_key = _key(target, history=True), _key(target)
+    old_size, new_size = _old_size(target), target.size or 0
+    if old_key != new_key:
+        adjust(connection, old_key, -1, -old_size)
+        adjust(connection, new_key, 1, new_size)
+        _changed_repos(target, _old_repo_id(target), target.repo_id)
+    elif old_size != new_size:
+        adjust(connection, new_key, 0, new_size - old_size)
+    # binaries can be flushed before they get their repo (when creating the
+    # repo autoflushes), so check the relationship too
+    if get_history(target, 'repo').has_changes() or get_history(target, 'repo_id').has_changes():
+        _changed_repos(target, _old_repo_id(target), target.repo_id)
+
+
+def summarize_changed_repos(session, flush_context):
+    repo_ids = session.info.pop('chacra.changed_repos', None)
+    if not repo_ids:
+        return
+    connection = session.connection()
+    for repo_id in sorted(repo_ids):
+        summarize_repo(connection, repo_id, session)
+
+
+def _old_repo_id(target):
+    deleted = get_history(target, 'repo').deleted
+    if deleted:
+        return deleted[0].id if deleted[0] is not None else None
+    deleted = get_history(target, 'repo_id').deleted
+    if deleted:
+        return deleted[0]
+    return target.repo_id
+
+
+def _old_size(target):
+    deleted = get_history(target, 'size').deleted
+    if deleted:
+        return deleted[0] or 0
+    return target.size or 0
+
+
+listen(Binary, 'after_insert', binary_added)
+listen(Binary, 'after_update', binary_changed)
+listen(Binary, 'after_delete', binary_removed)
+listen(Session, 'after_flush_postexec', summarize_changed_repos)
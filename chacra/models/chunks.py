@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, BigInteger
+from sqlalchemy.orm import relationship, backref
+from chacra.models import Base
+
+
+class Chunk(Base):
+    """
+    A content-defined piece of a binary (see ``chacra.chunking``), used to
+    find what a delta upload can reuse from binaries that are already stored
+    """
+
+    __tablename__ = 'chunks'
+    id = Column(Integer, primary_key=True)
+    digest = Column(String(64), nullable=False, index=True)
+    offset = Column(BigInteger, nullable=False)
+    size = Column(Integer, nullable=False)
+
+    binary_id = Column(
+        Integer, ForeignKey('binaries.id', ondelete='CASCADE'), index=True
+    )
+    binary = relationship(
+        'Binary',
+        backref=backref('chunks', lazy='dynamic', passive_deletes=True)
+    )
+
+    def __init__(self, binary, offset, size, digest):
+        self.binary = binary
+        self.offset = offset
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return '<Chunk %s:%s>' % (self.offset, self.size)
@@ -1,8 +1,9 @@
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm.exc import DetachedInstanceError
-from chacra.models import Base
+from chacra import models
+from chacra.models import Base, Session
 from chacra.models.repos import Repo
-from chacra.models.binaries import Binary
+from chacra.models.catalog import Catalog
 
 
 class Project(Base):
@@ -14,47 +15,67 @@ class Project(Base):
     def __init__(self, name):
         self.name = name
 
+    def distinct(self, column, **filters):
+        """
+        The distinct values of ``column`` (of the catalog of binaries or of
+        repos) for this project, without loading any rows
+        """
+        model = column.class_
+        query = Session.query(column).filter(model.project == self)
+        return [row[0] for row in query.filter_by(**filters).distinct()]
+
+    def tree(self, parent, child, **filters):
+        """
+        Map every distinct value of the ``parent`` column (of the catalog of
+        binaries or of repos) to the distinct values of the ``child`` column
+        under it, for this project, in a single query
+        """
+        model = parent.class_
+        query = Session.query(parent, child).filter(model.project == self)
+        result = {}
+        for parent_value, child_value in query.filter_by(**filters).distinct():
+            result.setdefault(parent_value, []).append(child_value)
+        return result
+
+    def _exists(self, model, **filters):
+        query = model.query.filter(model.project == self).filter_by(**filters)
+        return Session.query(query.exists()).scalar()
+
     @property
     def archs(self):
-        return list(set(
-            [b.arch for b in
-             Binary.query.distinct(Binary.arch).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.arch)
 
     @property
     def distro_versions(self):
-        return list(set(
-            [b.distro_version for b in
-             Binary.query.distinct(Binary.distro_version).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.distro_version)
 
     @property
     def distros(self):
-        return list(set(
-            [b.distro for b in
-             Binary.query.distinct(Binary.distro).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.distro)
 
     @property
     def refs(self):
-        return list(set(
-            [b.ref for b in
-             Binary.query.distinct(Binary.ref).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.ref)
 
     @property
     def sha1s(self):
-        return list(set(
-            [b.sha1 for b in
-             Binary.query.distinct(Binary.sha1).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.sha1)
 
     @property
     def flavors(self):
-        return list(set(
-            [b.flavor for b in
-             Binary.query.distinct(Binary.flavor).filter_by(project=self).all()]
-        ))
+        return self.distinct(Catalog.flavor)
+
+    def has_ref(self, ref):
+        return self._exists(Catalog, ref=ref)
+
+    def has_sha1(self, sha1):
+        return self._exists(Catalog, sha1=sha1)
+
+    def has_distro_version(self, distro_version):
+        return self._exists(Catalog, distro_version=distro_version)
+
+    def has_flavor(self, flavor):
+        return self._exists(Catalog, flavor=flavor)
 
     @property
     def built_repos(self):
@@ -62,19 +83,28 @@ class Project(Base):
 
     @property
     def repo_refs(self):
-        return list(set([r.ref for r in self.repos.all()]))
+        return self.distinct(Repo.ref)
 
     @property
     def repo_sha1s(self):
-        return list(set([r.sha1 for r in self.repos.all()]))
+        return self.distinct(Repo.sha1)
 
     @property
     def repo_distros(self):
-        return list(set([r.distro for r in self.repos.all()]))
+        return self.distinct(Repo.distro)
 
     @property
     def repo_distro_versions(self):
-        return list(set([r.distro_version for r in self.repos.all()]))
+        return self.distinct(Repo.distro_version)
+
+    def has_repo_ref(self, ref):
+        return self._exists(Repo, ref=ref)
+
+    def has_repo_sha1(self, sha1):
+        return self._exists(Repo, sha1=sha1)
+
+    def has_repo_distro(self, distro):
+        return self._exists(Repo, distro=distro)
 
     def __repr__(self):
         try:
@@ -83,19 +113,8 @@ class Project(Base):
             return '<Project detached>'
 
     def __json__(self):
-        json_ = {}
-        for ref in self.refs:
-            json_[ref] = list(
-                set(
-                    [b.sha1 for b in
-                     Binary.query.distinct(Binary.sha1).filter_by(ref=ref, project=self).all()]
-                )
-            )
-        return json_
+        return self.tree(Catalog.ref, Catalog.sha1)
 
 
 def get_or_create(name, **kw):
-    project = Project.filter_by(name=name).first()
-    if not project:
-        project = Project(name=name)
-    return project
+    return models.get_or_create(Project, name=name)
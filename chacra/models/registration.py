@@ -0,0 +1,281 @@
+"""
+Register many binaries at once (like every binary of a build) with a handful
+of statements, instead of creating a ``Binary`` for each one of them. The ORM
+listeners are skipped: digests come from the upload, every repo is looked up
+(or created) once, and the catalog and the summaries of the repos are updated
+once for all the binaries.
+"""
+import datetime
+from sqlalchemy import and_, or_, bindparam, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from chacra import models
+from chacra.models import Session
+from chacra.models.binaries import Binary, generic_versions, repo_type
+from chacra.models.catalog import recount, summarize_repo
+from chacra.models.repos import Repo
+from chacra.controllers import util
+try:
+    from datetime import UTC
+except ImportError:
+    UTC = datetime.timezone.utc
+
+
+# where a binary is, along with its name these identify it in a project
+location_keys = ('ref', 'sha1', 'distro', 'distro_version', 'arch', 'flavor')
+repo_keys = ('ref', 'sha1', 'distro', 'distro_version', 'flavor')
+
+# digests are computed when uploading, so they are required
+required_keys = ('name', 'path', 'size', 'checksum', 'sha256', 'md5')
+value_keys = ('path', 'size', 'checksum', 'sha256', 'md5', 'file_identity', 'built_by')
+
+# rows per INSERT statement
+batch_size = 1000
+
+# rows matched per SELECT statement, each one adds a term to a long OR and
+# SQLite limits how deep expressions can be (1000 by default)
+match_batch_size = 500
+
+
+def register_binaries(project, entries):
+    """
+    Create (or update, when they already exist) the binaries of ``project``
+    described by ``entries``: dictionaries with the name, the location
+    (``ref``, ``sha1``, ``distro``, ``distro_version``, ``arch`` and
+    ``flavor``) and the values of every binary, which need to include its
+    path, size and digests. ``sha1`` and ``flavor`` default to ``head`` and
+    ``default``.
+
+    Returns the ids of the binaries keyed by their location and name, in the
+    order of ``location_keys``. ``ValueError`` is raised for incomplete
+    entries, or when the same binary is included more than once.
+    """
+    rows = _rows(entries)
+    if not rows:
+        return {}
+    session = Session()
+    # the project (and anything pending) needs to be in the database first
+    session.flush()
+    connection = session.connection()
+    now = datetime.datetime.now(UTC)
+
+    repos = _repos(session, project, rows)
+    for key, row in rows.items():
+        row.update(
+            project_id=project.id, repo_id=repos[_repo_key(row)],
+            created=now, modified=now, signed=False,
+        )
+
+    if connection.dialect.name == 'postgresql':
+        ids = _upsert(connection, rows)
+    else:
+        ids = _update_or_insert(connection, rows)
+
+    recount(connection, [
+        dict(project_id=project.id, **dict(zip(location_keys, location)))
+        for location in set(key[:-1] for key in rows)
+    ])
+    _mark_repos(connection, project, rows)
+    for repo_id in sorted(set(repos.values())):
+        summarize_repo(connection, repo_id, session)
+
+    # binaries that were already loaded are stale now
+    for binary_id in ids.values():
+        binary = session.identity_map.get(identity_key(Binary, binary_id))
+        if binary is not None:
+            session.expire(binary)
+    return ids
+
+
+def _rows(entries):
+    rows = {}
+    for entry in entries:
+        missing = [name for name in required_keys if entry.get(name) is None]
+        if missing:
+            raise ValueError('missing %s for binary: %s' % (', '.join(missing), entry.get('name')))
+        row = dict.fromkeys(location_keys)
+        row.update(sha1='head', flavor='default')
+        row.update((name, entry[name]) for name in location_keys if entry.get(name) is not None)
+        row.update((name, entry.get(name)) for name in value_keys)
+        row['name'] = entry['name']
+        key = _key(row)
+        if key in rows:
+            raise ValueError('%s was included more than once' % row['name'])
+        rows[key] = row
+    return rows
+
+
+def _key(row):
+    return tuple(row[name] for name in location_keys + ('name',))
+
+
+def _repo_key(row):
+    return tuple(row[name] for name in repo_keys)
+
+
+def _match(table, keys, names):
+    return or_(*[
+        and_(*[table.c[name] == value for name, value in zip(names, key)])
+        for key in keys
+    ])
+
+
+def _matching(connection, table, columns, project_id, keys, names):
+    """
+    The ``columns`` of the rows of ``table`` in the project that match any
+    of the ``keys`` (values of the ``names`` columns), in batches of
+    ``match_batch_size`` keys
+    """
+    keys = list(keys)
+    for start in range(0, len(keys), match_batch_size):
+        for row in connection.execute(
+            table.select().with_only_columns(columns).where(and_(
+                table.c.project_id == project_id,
+                _match(table, keys[start:start + match_batch_size], names),
+            ))
+        ):
+            yield row
+
+
+def _repos(session, project, rows):
+    """
+    The id of the repo for every distinct location of the binaries, looked up
+    with a single query (for every ``match_batch_size`` locations). The ones that don't exist are inserted all at once,
+    skipping any that a concurrent request has just inserted.
+    """
+    wanted = {}
+    for row in rows.values():
+        wanted.setdefault(_repo_key(row), row['name'])
+    table = Repo.__table__
+    repos = _find_repos(session, project, wanted)
+    missing = [key for key in wanted if key not in repos]
+    if missing:
+        now = datetime.datetime.now(UTC)
+        models.insert_or_ignore(table, [
+            dict(
+                zip(repo_keys, key), project_id=project.id, type=repo_type(wanted[key]),
+                needs_update=False, modified=now,
+            )
+            for key in missing
+        ])
+        repos.update(_find_repos(session, project, missing))
+    for key, (repo_id, type) in list(repos.items()):
+        if type is None:
+            session.connection().execute(
+                table.update().where(table.c.id == repo_id).values(type=repo_type(wanted[key])))
+        repos[key] = repo_id
+    return repos
+
+
+def _find_repos(session, project, keys):
+    table = Repo.__table__
+    found = _matching(
+        session.connection(), table,
+        [table.c.id, table.c.type] + [table.c[name] for name in repo_keys],
+        project.id, keys, repo_keys,
+    )
+    return dict(
+        (tuple(repo[name] for name in repo_keys), (repo.id, repo.type)) for repo in found
+    )
+
+
+def _upsert(connection, rows):
+    """
+    A single ``INSERT ... ON CONFLICT DO UPDATE`` for every batch of rows,
+    existing binaries get the new file and digests but keep when they were
+    created (and who built them, if no one is given now)
+    """
+    table = Binary.__table__
+    ids = {}
+    rows = list(rows.values())
+    for start in range(0, len(rows), batch_size):
+        statement = postgresql.insert(table).values(rows[start:start + batch_size])
+        excluded = statement.excluded
+        updated = dict((name, excluded[name]) for name in value_keys if name != 'built_by')
+        updated['built_by'] = func.coalesce(excluded.built_by, table.c.built_by)
+        updated['modified'] = excluded.modified
+        updated['repo_id'] = excluded.repo_id
+        statement = statement.on_conflict_do_update(
+            index_elements=[
+                'project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch', 'name', 'flavor'
+            ],
+            set_=updated,
+        ).returning(*[table.c[name] for name in ('id',) + location_keys + ('name',)])
+        for row in connection.execute(statement):
+            ids[_key(row)] = row.id
+    return ids
+
+
+def _update_or_insert(connection, rows):
+    """
+    Databases without ``ON CONFLICT`` (like SQLite) update the binaries that
+    exist, all with the same statement, and insert the rest
+    """
+    table = Binary.__table__
+    names = location_keys + ('name',)
+    columns = [table.c.id] + [table.c[name] for name in names]
+    project_id = list(rows.values())[0]['project_id']
+    existing = dict(
+        (_key(row), row.id) for row in _matching(
+            connection, table, columns, project_id, rows, names
+        )
+    )
+    if existing:
+        updated = dict((name, bindparam(name)) for name in value_keys if name != 'built_by')
+        updated['built_by'] = func.coalesce(bindparam('built_by'), table.c.built_by)
+        updated['modified'] = bindparam('modified')
+        updated['repo_id'] = bindparam('repo_id')
+        connection.execute(
+            table.update().where(table.c.id == bindparam('binary_id')).values(updated),
+            # only these, any other column in the parameters would be set too
+            [
+                dict(
+                    [(name, rows[key][name]) for name in updated],
+                    binary_id=binary_id,
+                )
+                for key, binary_id in existing.items()
+            ]
+        )
+    new = [row for key, row in rows.items() if key not in existing]
+    for start in range(0, len(new), batch_size):
+        connection.execute(table.insert().values(new[start:start + batch_size]))
+    if new:
+        inserted = _matching(
+            connection, table, columns, project_id, [_key(row) for row in new], names
+        )
+        existing.update((_key(row), row.id) for row in inserted)
+    return existing
+
+
+def _mark_repos(connection, project, rows):
+    """
+    Repos need to be updated when automatic repos are configured for the
+    project and they got a binary that is not generic, unless they have
+    generic binaries (the same rule as the ``update_repo`` listener)
+    """
+    if not util.repository_is_automatic(project.name):
+        return
+    generic = set(
+        row['repo_id'] for row in rows.values()
+        if row['distro_version'] in generic_versions
+    )
+    marked = set(row['repo_id'] for row in rows.values()) - generic
+    if not marked:
+        return
+    table = Repo.__table__
+    marked -= set(
+        repo.id for repo in connection.execute(
+            table.select().with_only_columns([table.c.id]).where(and_(
+                table.c.id.in_(sorted(marked)), table.c.has_generic.is_(True),
+            ))
+        )
+    )
+    if not marked:
+        return
+    connection.execute(table.update().where(table.c.id.in_(sorted(marked))).values(needs_update=True))
+    session = Session()
+    for repo_id in marked:
+        repo = session.identity_map.get(identity_key(Repo, repo_id))
+        if repo is not None:
+            set_committed_value(repo, 'needs_update', True)
@@ -2,10 +2,11 @@ import datetime
 import os
 import socket
 from pecan import conf
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Index
 from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy.event import listen, remove
 from sqlalchemy.orm.exc import DetachedInstanceError
+from chacra import models
 from chacra.models import Base, update_timestamp
 from chacra.models.types import JSONType
 try:
@@ -17,6 +18,14 @@ except:
 class Repo(Base):
 
     __tablename__ = 'repos'
+    __table_args__ = (
+        # repos are looked up by their URL parts, in this order, and there
+        # can only be one for each of them
+        Index(
+            'ix_repos_lookup', 'project_id', 'ref', 'sha1', 'distro',
+            'distro_version', 'flavor', unique=True,
+        ),
+    )
     id = Column(Integer, primary_key=True)
     path = Column(String(256))
     ref = Column(String(256), index=True)
@@ -32,6 +41,11 @@ class Repo(Base):
     type = Column(String(12))
     size = Column(Integer, default=0)
     extra = deferred(Column(JSONType(), default={}))
+    # a summary of the binaries in the repo, kept up to date by the listeners
+    # in chacra.models.catalog so that they don't need to be loaded
+    archs = Column(JSONType(), default=[])
+    has_generic = Column(Boolean(), default=False)
+    binary_count = Column(Integer, default=0)
 
     project_id = Column(Integer, ForeignKey('projects.id'))
     project = relationship('Project', backref=backref('repos', lazy='dynamic'))
@@ -44,6 +58,9 @@ class Repo(Base):
         self.modified = datetime.datetime.now(UTC)
         self.sha1 = kwargs.get('sha1', 'head')
         self.flavor = kwargs.get('flavor', 'default')
+        self.archs = []
+        self.has_generic = False
+        self.binary_count = 0
 
     def __repr__(self):
         try:
@@ -74,7 +91,8 @@ class Repo(Base):
             type=self.type,
             size=self.size,
             flavor=self.flavor,
-            archs=self.archs,
+            archs=self.archs or [],
+            binary_count=self.binary_count or 0,
             extra=self.extra,
         )
 
@@ -97,10 +115,7 @@ class Repo(Base):
 
     @property
     def is_generic(self):
-        for binary in self.binaries:
-            if binary.is_generic:
-                return True
-        return False
+        return bool(self.has_generic)
 
     @property
     def metric_name(self):
@@ -118,9 +133,20 @@ class Repo(Base):
         for binary in self.binaries:
             return binary._get_repo_type()
 
-    @property
-    def archs(self):
-        return list(set(b.arch for b in self.binaries))
+def get_or_create(project, ref, distro, distro_version, sha1='head', flavor='default', **values):
+    """
+    The repo of ``project`` for a location, created (with ``values``) if it
+    doesn't exist yet. Concurrent uploads for a new location (like a new
+    sha1 from many builders at once) all end up with the same repo
+    """
+    if project.id is None:
+        project.flush()
+    values.setdefault('modified', datetime.datetime.now(UTC))
+    return models.get_or_create(
+        Repo, defaults=values, project_id=project.id, ref=ref, sha1=sha1,
+        distro=distro, distro_version=distro_version, flavor=flavor,
+    )
+
 
 def add_timestamp_listeners():
     # listen for timestamp modifications
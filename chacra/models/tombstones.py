@@ -0,0 +1,150 @@
+import datetime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger, and_, func, literal, select
+from chacra import storage
+from chacra.models import Base, Session
+from chacra.models.binaries import Binary
+from chacra.models.catalog import Catalog, recount, summarize_repo
+from chacra.models.repos import Repo
+try:
+    from datetime import UTC
+except ImportError:
+    UTC = datetime.timezone.utc
+
+
+class Tombstone(Base):
+    """
+    A file (or a whole directory tree) that is no longer used and needs to be
+    removed from disk. Deleting binaries and repos only removes their rows and
+    leaves one of these behind, so that requests don't wait on the
+    filesystem. The ``purge_tombstones`` task goes through them in batches.
+    """
+
+    __tablename__ = 'tombstones'
+    id = Column(Integer, primary_key=True)
+    path = Column(String(512), nullable=False)
+    is_tree = Column(Boolean(), default=False)
+    # for binaries, to release their stored object and to tell if the file at
+    # ``path`` is still the one that was deleted
+    checksum = Column(String(256))
+    file_identity = Column(String(64))
+    size = Column(BigInteger, default=0)
+    # the name, since the project itself might be gone
+    project = Column(String(256), index=True)
+    created = Column(DateTime)
+    # how many times removing it failed
+    attempts = Column(Integer, default=0)
+
+    def __init__(self, path, project=None, is_tree=False, **kw):
+        self.path = path
+        self.project = project
+        self.is_tree = is_tree
+        self.checksum = kw.get('checksum')
+        self.file_identity = kw.get('file_identity')
+        self.size = kw.get('size') or 0
+        self.attempts = 0
+        self.created = datetime.datetime.now(UTC)
+
+    def __repr__(self):
+        return '<Tombstone %r>' % self.path
+
+    def __json__(self):
+        return dict(
+            path=self.path,
+            is_tree=self.is_tree,
+            size=self.size,
+            project=self.project,
+            attempts=self.attempts,
+            created=self.created,
+        )
+
+
+def bury_binary(binary):
+    """
+    Delete ``binary``, leaving a tombstone for its file
+    """
+    if binary.path:
+        Tombstone(
+            binary.path, project=binary.project.name, checksum=binary.checksum,
+            file_identity=binary.file_identity, size=binary.size,
+        )
+    binary.delete()
+
+
+def bury_tree(path, project=None):
+    """
+    Move the directory tree at ``path`` (like a repo) out of the way right
+    away, and leave a tombstone for it
+    """
+    if not path:
+        return None
+    trashed = storage.trash(path)
+    if trashed is None:
+        return None
+    return Tombstone(trashed, project=project, is_tree=True)
+
+
+def bury_binaries(project, *criteria):
+    """
+    Delete every binary of ``project`` that matches ``criteria`` (expressions
+    on ``Binary`` columns) without loading them, leaving a tombstone for each
+    of their files. The catalog and the summaries of their repos are updated
+    once for all of them. Returns how many binaries were deleted.
+    """
+    Session.flush()
+    connection = Session.connection()
+    criteria = (Binary.project_id == project.id,) + criteria
+    where = and_(*criteria)
+    locations = connection.execute(
+        select([getattr(Binary, name) for name in Catalog.keys]).where(where).distinct()
+    ).fetchall()
+    repo_ids = [
+        repo_id for repo_id, in Session.query(Binary.repo_id).filter(*criteria).distinct()
+        if repo_id is not None
+    ]
+    now = datetime.datetime.now(UTC)
+    tombstones = Tombstone.__table__
+    connection.execute(tombstones.insert().from_select(
+        ['path', 'is_tree', 'checksum', 'file_identity', 'size', 'project', 'created'],
+        select([
+            Binary.path, literal(False), Binary.checksum, Binary.file_identity,
+            func.coalesce(Binary.size, 0), literal(project.name), literal(now),
+        ]).where(and_(where, Binary.path.isnot(None)))
+    ))
+    # binaries that were already loaded are removed from the session too
+    count = Binary.query.filter(*criteria).delete(synchronize_session='evaluate')
+    recount(connection, [dict(zip(Catalog.keys, location)) for location in locations])
+    for repo_id in repo_ids:
+        summarize_repo(connection, repo_id, Session())
+    return count
+
+
+def bury_repos(project, *criteria):
+    """
+    Delete every repo of ``project`` that matches ``criteria`` (expressions on
+    ``Repo`` columns), leaving a tombstone for their trees. Their binaries
+    need to be deleted first. Returns how many repos were deleted.
+    """
+    criteria = (Repo.project_id == project.id,) + criteria
+    for path, in Session.query(Repo.path).filter(*criteria).filter(Repo.path.isnot(None)):
+        bury_tree(path, project=project.name)
+    return Repo.query.filter(*criteria).delete(synchronize_session='evaluate')
+
+
+def pending():
+    """
+    What is left to remove for every project, in a single query, including
+    how many paths could not be removed so far
+    """
+    failed = Tombstone.attempts > 0
+    query = Session.query(
+        Tombstone.project, Tombstone.is_tree, failed, func.count(Tombstone.id),
+        func.coalesce(func.sum(Tombstone.size), 0),
+    ).group_by(Tombstone.project, Tombstone.is_tree, failed)
+    result = {}
+    for project, is_tree, has_failed, count, size in query:
+        summary = result.setdefault(project, dict(files=0, trees=0, size=0, failed=0))
+        summary['trees' if is_tree else 'files'] += count
+        summary['size'] += int(size)
+        if has_failed:
+            summary['failed'] += count
+    return result
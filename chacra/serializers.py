@@ -0,0 +1,111 @@
+"""
+Serialize listings of binaries straight from the columns they need,
+without loading (and tracking) a model object for every row. Each row becomes
+a small record, which renders as the same JSON as the ``__json__`` of its model
+but only with the fields that were asked for (``?fields=name,checksum,size``).
+"""
+import datetime
+from chacra.models import Binary, Project
+from chacra.controllers import util
+
+try:
+    from datetime import UTC
+except ImportError:
+    UTC = datetime.timezone.utc
+
+
+class Record(object):
+    """
+    The values of a single row. Only the fields that were asked for are
+    rendered, any other value is there because it was needed for something
+    else (like ``created`` and ``modified`` for ``last_changed``, or the
+    position of the row for the cursor of the next page)
+    """
+
+    __slots__ = ('_fields',)
+
+    # field name -> column, for the fields that come straight from a column
+    columns = {}
+    # field name -> the columns needed to compute it
+    derived = {}
+    # every field, in the order they are rendered by default
+    fields = ()
+
+    def __init__(self, fields, row, now):
+        self._fields = fields
+        for name, value in zip(row.keys(), row):
+            setattr(self, name, value)
+
+    def __json__(self):
+        return dict((name, getattr(self, name)) for name in self._fields)
+
+    @classmethod
+    def parse_fields(cls, value=None):
+        """
+        Turn a comma separated list of fields into a tuple of them, in the
+        order they are rendered. ``ValueError`` is raised for unknown fields
+        """
+        if not value:
+            return cls.fields
+        if not isinstance(value, str):
+            raise ValueError('fields can only be used once')
+        requested = set(name.strip() for name in value.split(',') if name.strip())
+        unknown = requested.difference(cls.fields)
+        if unknown:
+            raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+        return tuple(name for name in cls.fields if name in requested)
+
+    @classmethod
+    def query(cls, query, fields, extra=()):
+        """
+        Change ``query`` (with any filters, ordering and limits already in
+        place) so that it only selects the columns needed for ``fields``,
+        plus the ``extra`` ones (and always the id)
+        """
+        names = ['id']
+        for name in tuple(fields) + tuple(extra):
+            for needed in cls.derived.get(name, (name,)):
+                if needed not in names:
+                    names.append(needed)
+        return query.with_entities(*[cls.columns[name].label(name) for name in names])
+
+    @classmethod
+    def records(cls, rows, fields, now=None):
+        """
+        Yield a record for every row, ``now`` is shared by all of them so
+        that relative times are only based on a single point in time
+        """
+        now = now or datetime.datetime.now(UTC)
+        for row in rows:
+            yield cls(fields, row, now)
+
+
+class BinaryRecord(Record):
+
+    fields = (
+        'name', 'project', 'created', 'modified', 'signed', 'size', 'path',
+        'last_changed', 'built_by', 'distro', 'distro_version', 'checksum',
+        'sha256', 'md5', 'arch', 'ref', 'sha1', 'flavor',
+    )
+    __slots__ = fields + ('id',)
+
+    columns = dict(
+        (name, getattr(Binary, name)) for name in fields
+        if name not in ('project', 'last_changed')
+    )
+    columns['id'] = Binary.id
+    columns['project'] = Project.name
+    derived = {'last_changed': ('created', 'modified')}
+
+    def __init__(self, fields, row, now):
+        super(BinaryRecord, self).__init__(fields, row, now)
+        if 'last_changed' in fields:
+            last = max((t for t in (self.created, self.modified) if t is not None), default=None)
+            self.last_changed = util.last_seen(last, now) if last else None
+
+    @classmethod
+    def query(cls, query, fields, extra=()):
+        query = super(BinaryRecord, cls).query(query, fields, extra)
+        if 'project' in fields or 'project' in extra:
+            query = query.outerjoin(Project, Binary.project_id == Project.id)
+        return query
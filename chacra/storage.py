@@ -0,0 +1,694 @@
+"""
+Helpers to get binaries onto disk (and read them back) while doing as little
+I/O as possible. Uploads can be several gigabytes in size, so every extra pass
+over a file is expensive.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from pecan import conf
+
+
+logger = logging.getLogger(__name__)
+
+# size of the blocks read from (and written to) files, large enough so that
+# hashing is not dominated by Python call overhead
+CHUNK_SIZE = 1024 * 1024
+
+
+class Digests(object):
+    """
+    Keep track of all the checksums chacra stores for a binary so that they
+    can be computed in a single pass, as data is streamed. ``checksum`` is the
+    SHA-512 (the historical name of the attribute in the ``Binary`` model) and
+    ``sha256`` and ``md5`` are the ones that repository indices need.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._sha512 = hashlib.sha512()
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        self._sha512.update(chunk)
+        self._sha256.update(chunk)
+        self._md5.update(chunk)
+
+    def as_dict(self):
+        return dict(
+            checksum=self._sha512.hexdigest(),
+            sha256=self._sha256.hexdigest(),
+            md5=self._md5.hexdigest(),
+            size=self.size,
+        )
+
+
+def read_chunks(file_obj, chunk_size=CHUNK_SIZE):
+    for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+        yield chunk
+
+
+def file_identity(path):
+    """
+    A cheap way to tell if a file changed without reading it: the inode, size
+    and modification time (in nanoseconds) of ``path`` combined in a string. If
+    the identity is the same, the checksums computed for the file are still
+    valid. Returns ``None`` when the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _identity(stat)
+
+
+def _identity(stat):
+    return '%d:%d:%d' % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def checksums(path):
+    """
+    Read the file at ``path`` once, and return all of its digests (along with
+    its size and identity) as a dictionary
+    """
+    digests = Digests()
+    with open(path, 'rb') as f:
+        identity = _identity(os.fstat(f.fileno()))
+        for chunk in read_chunks(f):
+            digests.update(chunk)
+    result = digests.as_dict()
+    result['file_identity'] = identity
+    return result
+
+
+def save_file(file_obj, destination, size=None):
+    """
+    Stream ``file_obj`` into ``destination`` computing every digest in the
+    same pass that writes the bytes, so that the file never needs to be read
+    back. The file is written next to its final location and then renamed over
+    it, which means readers never see a partially written binary. ``size`` is
+    used to preallocate the file when the stream can't tell how big it is.
+
+    Returns a dictionary with the digests, the size and the identity of the
+    file.
+    """
+    tmp_path, result = _write_partial(file_obj, destination, size)
+    result['file_identity'] = commit_staged(tmp_path, destination, result)
+    return result
+
+
+def _partial_path(destination):
+    return os.path.join(
+        os.path.dirname(destination),
+        '.%s.%s.partial' % (os.path.basename(destination), uuid.uuid4().hex)
+    )
+
+
+def _write_partial(file_obj, destination, size=None):
+    digests = Digests()
+    dir_path = os.path.dirname(destination)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(destination),
+        suffix='.partial',
+        dir=dir_path,
+    )
+    try:
+        preallocate(fd, size if size is not None else stream_size(file_obj))
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in read_chunks(file_obj):
+                digests.update(chunk)
+                f.write(chunk)
+            # preallocation might have reserved more than what was read
+            f.truncate(digests.size)
+        os.chmod(tmp_path, 0o644)
+    except Exception:
+        logger.exception('could not save file to %s', destination)
+        discard_staged(tmp_path)
+        raise
+    return tmp_path, digests.as_dict()
+
+
+def stage_file(file_obj, destination, size=None):
+    """
+    Like ``ingest``, but the file is left next to ``destination`` with
+    a temporary name, so that many files can be received before any of them
+    is put in place. Returns the temporary path and the digests of the file,
+    ``commit_staged`` (or ``discard_staged``) needs to be called with it.
+
+    A file the web server spooled is linked instead of copied, so its data is
+    never written again, but it is still read once to compute its digests.
+    """
+    source = spooled_path(file_obj)
+    if source is not None:
+        tmp_path = _partial_path(destination)
+        try:
+            digests = checksums(source)
+            os.chmod(source, 0o644)
+            os.link(source, tmp_path)
+            del digests['file_identity']
+            return tmp_path, digests
+        except OSError as err:
+            logger.info(
+                'could not link %s to %s (%s), will copy it instead',
+                source, destination, err
+            )
+    return _write_partial(file_obj, destination, size)
+
+
+def commit_staged(tmp_path, destination, digests=None):
+    """
+    Rename a staged file into its final location, returning its identity.
+    When the ``digests`` are known the file goes through the object store, so
+    that identical binaries share the same data on disk.
+    """
+    if digests:
+        tmp_path = deduplicate(tmp_path, digests['checksum'], digests['size'])
+    try:
+        _replace(tmp_path, destination)
+    except OSError:
+        discard_staged(tmp_path)
+        raise
+    return file_identity(destination)
+
+
+def _replace(source, destination):
+    os.replace(source, destination)
+    # renaming a link over another link to the same file (a binary uploaded
+    # again with the same contents) does nothing, the source stays
+    if os.path.lexists(source):
+        os.remove(source)
+
+
+def discard_staged(tmp_path):
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def stream_size(file_obj):
+    """
+    Size of the (remaining) contents of ``file_obj`` if it can be known without
+    reading it, ``None`` otherwise.
+    """
+    try:
+        position = file_obj.tell()
+        size = file_obj.seek(0, os.SEEK_END) - position
+        file_obj.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return size
+
+
+def preallocate(fd, size):
+    """
+    Reserve ``size`` bytes for the file open in ``fd`` so that large binaries
+    are laid out contiguously on disk, and so that a full disk is detected
+    before any byte is written. Not every filesystem supports this, in which
+    case it does nothing.
+    """
+    if not size or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as err:
+        if err.errno == errno.ENOSPC:
+            raise
+        logger.debug('could not preallocate %s bytes: %s', size, err)
+
+
+def copy_range(fd_in, offset_in, fd_out, offset_out, size):
+    """
+    Copy ``size`` bytes between two open files without going through Python
+    when the kernel supports ``copy_file_range`` (filesystems with reflinks
+    will even share the blocks instead of copying them). Raises ``ValueError``
+    if the source does not have enough bytes.
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                count = os.copy_file_range(
+                    fd_in, fd_out, size - copied, offset_in + copied, offset_out + copied
+                )
+                if not count:
+                    break
+                copied += count
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    while copied < size:
+        data = os.pread(fd_in, min(CHUNK_SIZE, size - copied), offset_in + copied)
+        if not data:
+            break
+        os.pwrite(fd_out, data, offset_out + copied)
+        copied += len(data)
+    if copied != size:
+        raise ValueError('expected to copy %s bytes, but only %s were available' % (size, copied))
+    return copied
+
+
+def spooled_path(file_obj):
+    """
+    If ``file_obj`` is backed by a file that has a name in the filesystem (or
+    is a path already) return that path, otherwise ``None``. Anonymous
+    temporary files (like the ones WebOb uses for multipart uploads) do not
+    have one.
+    """
+    path = file_obj if isinstance(file_obj, str) else getattr(file_obj, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
+def link_file(source, destination, move=False, digests=None):
+    """
+    Place the file at ``source`` in ``destination`` without copying any data,
+    by hard-linking it (or renaming it if ``move`` is set and the caller owns
+    ``source``). Both paths need to be in the same filesystem, otherwise an
+    ``OSError`` is raised. The source is read once to get its checksums unless
+    they are passed in as ``digests``.
+    """
+    digests = digests or checksums(source)
+    os.chmod(source, 0o644)
+    if move:
+        tmp_path = source
+    else:
+        tmp_path = _partial_path(destination)
+        os.link(source, tmp_path)
+    tmp_path = deduplicate(tmp_path, digests['checksum'], digests['size'])
+    try:
+        _replace(tmp_path, destination)
+    except OSError:
+        # a source that could not be moved is left alone so that callers can
+        # fall back to copying it
+        if tmp_path != source:
+            os.remove(tmp_path)
+        raise
+    digests['file_identity'] = file_identity(destination)
+    return digests
+
+
+def ingest(file_obj, destination, move=False):
+    """
+    Get an uploaded file into ``destination`` with the least amount of I/O
+    possible. When the upload was spooled to a named file on the same
+    filesystem it is linked (or moved) into place, so the data is never written
+    twice. Otherwise it falls back to a (preallocated) copy.
+
+    Returns a dictionary with the digests, the size and the identity of the
+    file, just like ``save_file``.
+    """
+    source = spooled_path(file_obj)
+    if source is not None:
+        try:
+            return link_file(source, destination, move=move)
+        except OSError as err:
+            logger.info(
+                'could not link %s to %s (%s), will copy it instead',
+                source, destination, err
+            )
+    if isinstance(file_obj, str):
+        with open(file_obj, 'rb') as f:
+            digests = save_file(f, destination)
+        if move:
+            os.remove(file_obj)
+        return digests
+    return save_file(file_obj, destination)
+
+
+def object_store_root():
+    """
+    Where the content-addressed copies of every binary live. Files in
+    ``binary_root`` are hard links to these, so it must be in the same
+    filesystem.
+    """
+    return getattr(
+        conf, 'object_store_root', os.path.join(conf.binary_root, '.objects')
+    )
+
+
+checksum_re = re.compile(r'^[0-9a-f]{128}$')
+
+
+def object_path(checksum):
+    # fan out on the first two characters so that no directory gets too big
+    return os.path.join(object_store_root(), checksum[:2], checksum)
+
+
+def stored_object(checksum):
+    """
+    The path to the stored object for ``checksum`` (a SHA-512 hex digest) if
+    there is one, ``None`` otherwise
+    """
+    if not checksum_re.match(checksum or ''):
+        return None
+    path = object_path(checksum)
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def deduplicate(path, checksum, size=None):
+    """
+    Make ``path`` share its data with every other file that has the same
+    ``checksum``. If the object store does not have it yet, ``path`` is linked
+    into it. Otherwise the path of a new link to the stored object is returned
+    (and ``path`` is removed), so callers must use the returned path.
+
+    Deduplication is skipped (returning ``path`` untouched) if it is disabled
+    with ``deduplicate_binaries = False`` or if linking is not possible. A
+    stored object that does not have the contents its name says is replaced
+    with ``path``.
+    """
+    if not getattr(conf, 'deduplicate_binaries', True):
+        return path
+    stored = object_path(checksum)
+    try:
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        try:
+            os.link(path, stored)
+            return path
+        except FileExistsError:
+            pass
+        stat = os.stat(stored)
+        if os.path.samestat(stat, os.stat(path)):
+            return path
+        if size is not None and stat.st_size != size:
+            logger.warning('stored object %s does not have the expected size, ignoring it', stored)
+            return path
+        if not verified_object(stored, checksum):
+            logger.warning('stored object %s does not have the expected contents, replacing it', stored)
+            replacement = _partial_path(stored)
+            os.link(path, replacement)
+            _replace(replacement, stored)
+            return path
+        linked = _partial_path(path)
+        os.link(stored, linked)
+    except OSError as err:
+        logger.info('could not deduplicate %s (%s)', path, err)
+        return path
+    os.remove(path)
+    return linked
+
+
+# identities of stored objects that were hashed and have the contents their
+# name says, so that each one is only read once
+_verified_objects = {}
+
+
+def verified_object(stored, checksum):
+    """
+    Tell if the object at ``stored`` has the SHA-512 ``checksum``. Objects are
+    links to binaries, so anything that writes to one of those changes its
+    object too. The object is hashed the first time it is checked, and only
+    again if its identity changes.
+    """
+    identity = file_identity(stored)
+    if identity is not None and _verified_objects.get(stored) == identity:
+        return True
+    try:
+        digests = checksums(stored)
+    except OSError:
+        return False
+    if digests['checksum'] != checksum:
+        _verified_objects.pop(stored, None)
+        return False
+    _verified_objects[stored] = digests['file_identity']
+    return True
+
+
+def deduplicate_in_place(path, checksum, identity, size=None):
+    """
+    Deduplicate a binary that is already in place, like the ones saved before
+    the object store existed. ``identity`` is the identity the file had when
+    ``checksum`` was computed, if it changed since then the checksum is not
+    trusted and nothing is done. Returns ``True`` if ``path`` now shares its
+    data with other binaries.
+    """
+    tmp_path = _partial_path(path)
+    os.link(path, tmp_path)
+    # the link has the same identity, and can't be swapped for another file
+    if file_identity(tmp_path) != identity:
+        os.remove(tmp_path)
+        return False
+    linked = deduplicate(tmp_path, checksum, size)
+    if linked == tmp_path:
+        # either this is the first copy (and it is in the store now) or it
+        # could not be deduplicated
+        os.remove(tmp_path)
+        return False
+    _replace(linked, path)
+    return True
+
+
+def release(path, checksum=None):
+    """
+    Remove a binary file. If it was the last reference to its stored object,
+    the object is removed too. Errors removing ``path`` are raised (just like
+    ``os.remove``), the object store is cleaned up on a best effort basis.
+    """
+    os.remove(path)
+    if checksum:
+        release_object(object_path(checksum))
+
+
+def release_object(stored):
+    """
+    Remove ``stored`` from the object store if no binary links to it anymore
+    (its link count is one). A concurrent upload that links to it right before
+    it is removed keeps the data, it just stops being deduplicated.
+    """
+    try:
+        if os.stat(stored).st_nlink == 1:
+            os.remove(stored)
+            return True
+    except OSError:
+        pass
+    return False
+
+
+def trash(path):
+    """
+    Move ``path`` (a file or a whole directory tree) out of the way so that it
+    can be removed later, returning where it went (or ``None`` if there was
+    nothing there). The new name is hidden, in the same directory, so this is
+    a single rename no matter how much is in it, and the path is free to be
+    used right away.
+    """
+    head, tail = os.path.split(path.rstrip(os.sep))
+    destination = os.path.join(head, '.%s.deleted-%s' % (tail, uuid.uuid4().hex))
+    try:
+        os.rename(path, destination)
+    except FileNotFoundError:
+        return None
+    return destination
+
+
+def upload_staging_root():
+    """
+    Where partial (resumable) uploads are kept until they are complete. It
+    defaults to a hidden directory in ``binary_root`` so that a complete
+    upload can be renamed into its final location.
+    """
+    return getattr(
+        conf, 'upload_staging_root', os.path.join(conf.binary_root, '.uploads')
+    )
+
+
+class StagedUpload(object):
+    """
+    A binary that is uploaded in pieces, possibly in parallel and across
+    several connections. The bytes are written (at their offsets) to a single
+    file in a staging directory, and every piece that is written is recorded
+    so that clients can ask what is still missing and resume from there.
+
+    The staging directory for an upload looks like::
+
+        <staging root>/<id>/data         the binary being assembled
+        <staging root>/<id>/ranges       one "start end" line per written piece
+        <staging root>/<id>/upload.json  metadata (name, size, checksum, ...)
+    """
+
+    id_re = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, root, upload_id):
+        self.id = upload_id
+        self.path = os.path.join(root, upload_id)
+        self.data_path = os.path.join(self.path, 'data')
+        self.ranges_path = os.path.join(self.path, 'ranges')
+        self.metadata_path = os.path.join(self.path, 'upload.json')
+        self._metadata = None
+
+    @classmethod
+    def create(cls, root, **metadata):
+        upload = cls(root, uuid.uuid4().hex)
+        os.makedirs(upload.path)
+        size = metadata.get('size')
+        with open(upload.data_path, 'wb') as f:
+            if size:
+                preallocate(f.fileno(), size)
+        open(upload.ranges_path, 'w').close()
+        with open(upload.metadata_path, 'w') as f:
+            json.dump(metadata, f)
+        return upload
+
+    @classmethod
+    def load(cls, root, upload_id):
+        """
+        Get an existing upload, or ``None`` if there is no upload with that
+        id (or the id is not a valid one)
+        """
+        if not cls.id_re.match(upload_id):
+            return None
+        upload = cls(root, upload_id)
+        if not os.path.exists(upload.metadata_path):
+            return None
+        return upload
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            with open(self.metadata_path) as f:
+                self._metadata = json.load(f)
+        return self._metadata
+
+    @property
+    def size(self):
+        return self.metadata.get('size')
+
+    def write(self, offset, file_obj):
+        """
+        Write everything in ``file_obj`` starting at ``offset``. Whatever made
+        it to disk is recorded even if reading ``file_obj`` fails midway (a
+        dropped connection) so that it is never sent again.
+
+        Returns the number of bytes written.
+        """
+        written = 0
+        try:
+            with open(self.data_path, 'r+b') as f:
+                f.seek(offset)
+                for chunk in read_chunks(file_obj):
+                    if self.size is not None and offset + written + len(chunk) > self.size:
+                        raise ValueError(
+                            'data goes past the size of the upload (%s bytes)' % self.size
+                        )
+                    f.write(chunk)
+                    written += len(chunk)
+        finally:
+            if written:
+                self._record(offset, offset + written)
+        return written
+
+    def copy(self, pieces):
+        """
+        Fill parts of the upload with bytes that are already on disk. Every
+        item in ``pieces`` is an ``(offset, source path, source offset, size)``
+        tuple. Returns the number of bytes copied.
+        """
+        sources = {}
+        copied = 0
+        run = None
+        try:
+            with open(self.data_path, 'r+b') as f:
+                for offset, source, source_offset, size in sorted(pieces):
+                    if self.size is not None and offset + size > self.size:
+                        raise ValueError(
+                            'data goes past the size of the upload (%s bytes)' % self.size
+                        )
+                    if source not in sources:
+                        sources[source] = open(source, 'rb')
+                    copy_range(sources[source].fileno(), source_offset, f.fileno(), offset, size)
+                    copied += size
+                    # record contiguous pieces as a single range
+                    if run and run[1] == offset:
+                        run[1] = offset + size
+                    else:
+                        if run:
+                            self._record(*run)
+                        run = [offset, offset + size]
+        finally:
+            if run:
+                self._record(*run)
+            for source_file in sources.values():
+                source_file.close()
+        return copied
+
+    def _record(self, start, end):
+        # appends this small are atomic, so parallel writers never interleave
+        fd = os.open(self.ranges_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, ('%d %d\n' % (start, end)).encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def ranges(self):
+        """
+        The byte ranges received so far, merged and sorted, as a list of
+        ``[start, end]`` pairs (``end`` is exclusive).
+        """
+        with open(self.ranges_path) as f:
+            pieces = sorted(
+                tuple(int(i) for i in line.split()) for line in f if line.strip()
+            )
+        merged = []
+        for start, end in pieces:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    @property
+    def offset(self):
+        """
+        How many bytes have been received contiguously from the start, which
+        is where a client should resume a sequential upload.
+        """
+        ranges = self.ranges()
+        if ranges and ranges[0][0] == 0:
+            return ranges[0][1]
+        return 0
+
+    @property
+    def received(self):
+        return sum(end - start for start, end in self.ranges())
+
+    def is_complete(self):
+        ranges = self.ranges()
+        if self.size is None:
+            # without a declared size, any gap-free upload is complete
+            return len(ranges) == 1 and ranges[0][0] == 0
+        if self.size == 0:
+            return True
+        return ranges == [[0, self.size]]
+
+    def finalize(self):
+        """
+        Trim the data file to what was actually received (or to the declared
+        size) so that it is ready to be moved into place.
+        """
+        ranges = self.ranges()
+        size = self.size if self.size is not None else (ranges[-1][1] if ranges else 0)
+        os.truncate(self.data_path, size)
+        return self.data_path
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __json__(self):
+        return dict(
+            id=self.id,
+            name=self.metadata.get('name'),
+            size=self.size,
+            offset=self.offset,
+            received=self.received,
+            ranges=self.ranges(),
+        )
@@ -1,10 +1,15 @@
 import datetime
+import errno
+import io
 import os
 import pytest
+import pecan
+import shutil
 from pecan import conf
 from chacra.tests import conftest
 from chacra.asynch import recurring
-from chacra.models import Repo, Project, Binary
+from chacra import storage
+from chacra.models import Repo, Project, Binary, Chunk, Tombstone, tombstones
 from chacra.models.repos import (
     add_timestamp_listeners as add_repo_listeners,
     remove_timestamp_listeners as remove_repo_listeners
@@ -334,3 +339,230 @@ class TestPurgeRepos(object):
         assert len(Repo.query.all()) == 1
 
 
+
+
+class TestPurgeUploads(object):
+
+    def test_removes_abandoned_uploads(self, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        root = storage.upload_staging_root()
+        upload = storage.StagedUpload.create(root, name='ceph.rpm')
+        future = datetime.datetime.now(UTC) + datetime.timedelta(days=3)
+        recurring.purge_uploads(_now=future)
+        assert not os.path.exists(upload.path)
+
+    def test_keeps_recent_uploads(self, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        root = storage.upload_staging_root()
+        upload = storage.StagedUpload.create(root, name='ceph.rpm')
+        recurring.purge_uploads()
+        assert os.path.exists(upload.path)
+
+    def test_no_staging_directory(self, tmpdir):
+        pecan.conf.binary_root = os.path.join(str(tmpdir), 'missing')
+        recurring.purge_uploads()
+
+
+class TestPurgeObjects(object):
+
+    def save(self, tmpdir, name):
+        path = os.path.join(str(tmpdir), name)
+        return path, storage.save_file(io.BytesIO(b'hello tharrrr'), path)
+
+    def test_removes_unreferenced_objects(self, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        path, digests = self.save(tmpdir, 'ceph.rpm')
+        # overwriting leaves the old object behind
+        storage.save_file(io.BytesIO(b'something changed'), path)
+        recurring.purge_objects()
+        assert not os.path.exists(storage.object_path(digests['checksum']))
+
+    def test_keeps_objects_in_use(self, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        path, digests = self.save(tmpdir, 'ceph.rpm')
+        recurring.purge_objects()
+        assert os.path.exists(storage.object_path(digests['checksum']))
+
+    def test_no_object_store(self, tmpdir):
+        pecan.conf.binary_root = os.path.join(str(tmpdir), 'missing')
+        recurring.purge_objects()
+
+
+class TestIndexChunks(object):
+
+    def setup_method(self):
+        pecan.conf.chunk_index_min_size = 0
+
+    def teardown_method(self):
+        conftest.reload_config()
+
+    def binary(self, session, tmpdir, contents=b'hello tharrrr'):
+        pecan.conf.binary_root = str(tmpdir)
+        path = os.path.join(str(tmpdir), 'ceph.rpm')
+        digests = storage.save_file(io.BytesIO(contents), path)
+        Binary('ceph.rpm', Project('ceph'), ref='main', distro='centos',
+               distro_version='7', arch='x86_64', path=path, digests=digests)
+        session.commit()
+        return path
+
+    def test_indexes_chunks(self, session, tmpdir):
+        self.binary(session, tmpdir, os.urandom(2 * 1024 * 1024))
+        recurring.index_chunks()
+        binary = Binary.query.first()
+        chunks = binary.chunks.order_by(Chunk.offset).all()
+        assert sum(c.size for c in chunks) == 2 * 1024 * 1024
+        assert binary.chunks_identity == binary.file_identity
+
+    def test_binary_is_not_modified(self, session, tmpdir):
+        self.binary(session, tmpdir)
+        Repo.query.first().needs_update = False
+        session.commit()
+        modified = Binary.query.first().modified
+        recurring.index_chunks()
+        assert Binary.query.first().modified == modified
+        assert Repo.query.first().needs_update is False
+
+    def test_indexes_once(self, session, tmpdir):
+        self.binary(session, tmpdir)
+        recurring.index_chunks()
+        recurring.index_chunks()
+        assert Chunk.query.count() == 1
+
+    def test_skips_small_binaries(self, session, tmpdir):
+        pecan.conf.chunk_index_min_size = 1024
+        self.binary(session, tmpdir)
+        recurring.index_chunks()
+        assert Chunk.query.count() == 0
+
+    def test_reindexes_changed_files(self, session, tmpdir):
+        path = self.binary(session, tmpdir)
+        recurring.index_chunks()
+        binary = Binary.query.first()
+        binary.set_digests(
+            storage.save_file(io.BytesIO(b'something changed'), path))
+        session.commit()
+        recurring.index_chunks()
+        assert [c.size for c in Chunk.query.all()] == [17]
+
+
+class TestPurgeTombstones(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def binary(self, session, tmpdir, name='ceph.rpm'):
+        pecan.conf.binary_root = str(tmpdir)
+        path = os.path.join(str(tmpdir), name)
+        digests = storage.save_file(io.BytesIO(b'hello tharrrr'), path)
+        binary = Binary(
+            name, self.p, ref='main', distro='centos', distro_version='8',
+            arch='x86_64', path=path, digests=digests
+        )
+        session.commit()
+        return binary
+
+    def test_removes_files(self, session, tmpdir):
+        binary = self.binary(session, tmpdir)
+        path, checksum = binary.path, binary.checksum
+        tombstones.bury_binary(binary)
+        session.commit()
+        assert os.path.exists(path)
+        assert recurring.purge_tombstones() == 1
+        assert not os.path.exists(path)
+        assert not os.path.exists(storage.object_path(checksum))
+        assert Tombstone.query.count() == 0
+
+    def test_removes_trees(self, session, tmpdir):
+        path = os.path.join(str(tmpdir), 'repo')
+        os.makedirs(os.path.join(path, 'x86_64'))
+        tombstones.bury_tree(path, project='ceph')
+        session.commit()
+        recurring.purge_tombstones()
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_works_in_batches(self, session, tmpdir):
+        for i in range(5):
+            tombstones.bury_binary(self.binary(session, tmpdir, 'ceph-%d.rpm' % i))
+        session.commit()
+        assert recurring.purge_tombstones(batch_size=2) == 5
+        assert Tombstone.query.count() == 0
+
+    def test_keeps_files_uploaded_again(self, session, tmpdir):
+        binary = self.binary(session, tmpdir)
+        path = binary.path
+        tombstones.bury_binary(binary)
+        session.commit()
+        self.binary(session, tmpdir)
+        recurring.purge_tombstones()
+        assert os.path.exists(path)
+
+    def test_keeps_files_that_changed(self, session, tmpdir):
+        binary = self.binary(session, tmpdir)
+        path = binary.path
+        tombstones.bury_binary(binary)
+        session.commit()
+        storage.save_file(io.BytesIO(b'something changed'), path)
+        recurring.purge_tombstones()
+        assert os.path.exists(path)
+
+    def test_missing_files(self, session, tmpdir):
+        binary = self.binary(session, tmpdir)
+        os.remove(binary.path)
+        tombstones.bury_binary(binary)
+        session.commit()
+        assert recurring.purge_tombstones() == 1
+
+    def test_failures_do_not_hold_back_the_rest(self, session, tmpdir, monkeypatch):
+        binaries = [self.binary(session, tmpdir, 'ceph-%d.rpm' % i) for i in range(3)]
+        paths = [binary.path for binary in binaries]
+        for binary in binaries:
+            tombstones.bury_binary(binary)
+        session.commit()
+        remove = os.remove
+
+        def fail_first(path):
+            if path == paths[0]:
+                raise OSError(errno.EACCES, 'Permission denied', path)
+            remove(path)
+
+        monkeypatch.setattr(recurring.os, 'remove', fail_first)
+        assert recurring.purge_tombstones(batch_size=2) == 2
+        session.rollback()
+        assert [os.path.exists(path) for path in paths] == [True, False, False]
+        tombstone = Tombstone.query.one()
+        assert tombstone.path == paths[0]
+        assert tombstone.attempts == 1
+
+    def test_failed_paths_are_tried_again(self, session, tmpdir, monkeypatch):
+        tombstones.bury_binary(self.binary(session, tmpdir))
+        session.commit()
+
+        def fail(path):
+            raise OSError(errno.EBUSY, 'Device or resource busy', path)
+
+        monkeypatch.setattr(recurring.os, 'remove', fail)
+        recurring.purge_tombstones()
+        recurring.purge_tombstones()
+        assert Tombstone.query.one().attempts == 2
+        monkeypatch.undo()
+        assert recurring.purge_tombstones() == 1
+        assert Tombstone.query.count() == 0
+
+    def test_trees_that_fail_are_kept(self, session, tmpdir, monkeypatch):
+        path = os.path.join(str(tmpdir), 'repo')
+        os.makedirs(os.path.join(path, 'x86_64'))
+        tombstones.bury_tree(path, project='ceph')
+        session.commit()
+
+        def fail(path, onerror=None):
+            onerror(os.rmdir, path, (OSError, OSError(errno.EROFS, 'Read-only file system'), None))
+
+        monkeypatch.setattr(recurring.shutil, 'rmtree', fail)
+        assert recurring.purge_tombstones() == 0
+        assert Tombstone.query.one().attempts == 1
+
+    def test_missing_trees(self, session, tmpdir):
+        tombstones.bury_tree(str(tmpdir.mkdir('repo')), project='ceph')
+        session.commit()
+        shutil.rmtree(Tombstone.query.one().path)
+        assert recurring.purge_tombstones() == 1
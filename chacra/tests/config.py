@@ -1,5 +1,6 @@
 from pecan.hooks import TransactionHook
 from chacra import models
+from chacra import hooks
 
 
 # Server Specific Configurations
@@ -24,6 +25,8 @@ app = {
             models.rollback,
             models.clear
         ),
+        hooks.SpooledBodyHook(),
+        hooks.JSONETagHook(),
     ],
     'debug': False,
     #'errors': {
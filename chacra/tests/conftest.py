@@ -7,7 +7,8 @@ import subprocess
 from copy import deepcopy
 from pecan import conf
 from pecan import configuration
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, ResultProxy
 from sqlalchemy.pool import NullPool
 
 from chacra import models as _db
@@ -176,6 +177,48 @@ def session(connection, request):
     return connection
 
 
+@pytest.fixture
+def queries(session, monkeypatch):
+    """
+    Records every SQL statement executed while the test runs, along with the
+    number of rows that were fetched from it, so that tests can check how much
+    work the database is asked to do. Rows are counted as they are fetched,
+    since drivers don't need to report them for a SELECT (SQLite doesn't).
+    """
+    class Queries(list):
+
+        @property
+        def rows(self):
+            return sum(rows for _, rows in self)
+
+        def reset(self):
+            del self[:]
+
+    recorded = Queries()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            query = [statement, 0]
+            recorded.append(query)
+            context.recorded_query = query
+
+    # every way of fetching rows (one, many, all, first) goes through here
+    process_rows = ResultProxy.process_rows
+
+    def count_rows(result, rows):
+        query = getattr(result.context, 'recorded_query', None)
+        if query is not None:
+            query[1] += len(rows)
+        return process_rows(result, rows)
+
+    # flush whatever is pending, so that only the queries of the test count
+    session.flush()
+    monkeypatch.setattr(ResultProxy, 'process_rows', count_rows)
+    event.listen(Engine, 'after_cursor_execute', record)
+    yield recorded
+    event.remove(Engine, 'after_cursor_execute', record)
+
+
 class TestApp(object):
     """
     A controller test starts a database transaction and creates a fake
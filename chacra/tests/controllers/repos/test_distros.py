@@ -35,6 +35,7 @@ class TestDistroController(object):
             "ubuntu",
             "trusty",
             sha1="head",
+            flavor="tcmalloc",
         )
         repo2.path = "some_path"
         session.commit()
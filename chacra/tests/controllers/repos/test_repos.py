@@ -1,9 +1,10 @@
 import os
 import pecan
 import pytest
-from chacra.models import Project, Repo, Binary
+from chacra.models import Project, Repo, Binary, Tombstone
 from chacra.compat import b_
 from chacra import asynch
+from chacra.asynch import recurring
 
 
 class TestRepoApiController(object):
@@ -682,3 +683,52 @@ class TestRepoCRUDOperations(object):
             expect_errors=True,
         )
         assert result.status_int == 404
+
+    def test_recreate_leaves_a_tombstone(self, session, tmpdir):
+        path = os.path.join(str(tmpdir), 'repo')
+        os.makedirs(path)
+        p = Project('foobar')
+        repo = Repo(p, "firefly", "ubuntu", "trusty", sha1="head")
+        repo.path = path
+        session.commit()
+        result = session.app.post_json('/repos/foobar/firefly/head/ubuntu/trusty/recreate')
+        assert result.status_int == 202
+        tombstone = Tombstone.query.one()
+        assert tombstone.is_tree is True
+        assert os.path.isdir(tombstone.path)
+
+
+class TestRepoDelete(object):
+
+    def test_delete_repo(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/foobar/firefly/head/ubuntu/trusty/x86_64/',
+            upload_files=[('file', 'foobar_1.0.deb', b_('hello tharrrr'))]
+        )
+        binary_path = Binary.query.one().path
+        result = session.app.delete('/repos/foobar/firefly/head/ubuntu/trusty/')
+        assert result.status_int == 202
+        assert Repo.query.count() == 0
+        assert Binary.query.count() == 0
+        assert Project.query.count() == 0
+        # the file is removed in the background
+        assert os.path.exists(binary_path)
+        recurring.purge_tombstones()
+        assert not os.path.exists(binary_path)
+
+    def test_delete_keeps_the_project_with_other_repos(self, session):
+        p = Project('foobar')
+        Repo(p, "firefly", "ubuntu", "trusty", sha1="head")
+        Repo(p, "firefly", "ubuntu", "xenial", sha1="head")
+        session.commit()
+        result = session.app.delete('/repos/foobar/firefly/head/ubuntu/trusty/')
+        assert result.status_int == 202
+        assert [r.distro_version for r in Repo.query.all()] == ['xenial']
+
+    def test_delete_repo_not_found(self, session):
+        Project('foobar')
+        session.commit()
+        result = session.app.delete(
+            '/repos/foobar/firefly/head/ubuntu/trusty/', expect_errors=True)
+        assert result.status_int == 404
@@ -1,3 +1,4 @@
+import pytest
 import pecan
 import os
 from chacra.models import Project, Binary
@@ -186,3 +187,25 @@ class TestArchController(object):
             upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
         )
         assert result.status_int == 201
+
+
+class TestArchFields(object):
+
+    @pytest.mark.parametrize('url', [
+        '/binaries/ceph/giant/head/ceph/el6/x86_64/?fields=size,name',
+        '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/?fields=size,name',
+    ])
+    def test_only_requested_fields(self, session, url):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='giant', distro='ceph', distro_version='el6', arch='x86_64', size=10)
+        session.commit()
+        result = session.app.get(url)
+        assert result.json == {'ceph-1.0.0.rpm': {'name': 'ceph-1.0.0.rpm', 'size': 10}}
+
+    def test_unknown_fields(self, session):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='giant', distro='ceph', distro_version='el6', arch='x86_64')
+        session.commit()
+        result = session.app.get(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/?fields=secret', expect_errors=True)
+        assert result.status_int == 400
@@ -1,9 +1,12 @@
+import hashlib
 import os
 import pecan
 import pytest
 
 from chacra.models import Binary, Project, Repo
 from chacra.tests import util
+from chacra import storage
+from chacra.asynch import recurring
 from chacra.compat import b_
 
 
@@ -152,7 +155,7 @@ class TestBinaryController(object):
         result = session.app.get('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
         assert result.status_int == 200
         result = session.app.delete('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
-        assert result.status_int == 204
+        assert result.status_int == 202
         result = session.app.get('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/', expect_errors=True)
         assert result.status_int == 404
 
@@ -173,7 +176,7 @@ class TestBinaryController(object):
             sha1="head",
         )
         result = session.app.delete(url, expect_errors=True)
-        assert result.status_int == 204
+        assert result.status_int == 202
 
     @pytest.mark.parametrize(
             'url',
@@ -185,6 +188,31 @@ class TestBinaryController(object):
         result = session.app.get(url, expect_errors=True)
         assert result.status_int == 404
 
+    def test_identical_binaries_share_data(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        for version in ['el6', 'el7']:
+            session.app.post(
+                '/binaries/ceph/giant/head/ceph/%s/noarch/' % version,
+                upload_files=[('file', 'ceph-9.0.0-0.noarch.rpm', b_('hello tharrrr'))]
+            )
+        first, second = [b.path for b in Binary.query.all()]
+        assert os.stat(first).st_ino == os.stat(second).st_ino
+
+    def test_deleting_shared_binary_keeps_the_other(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        for version in ['el6', 'el7']:
+            session.app.post(
+                '/binaries/ceph/giant/head/ceph/%s/noarch/' % version,
+                upload_files=[('file', 'ceph-9.0.0-0.noarch.rpm', b_('hello tharrrr'))]
+            )
+        checksum = Binary.query.first().checksum
+        session.app.delete('/binaries/ceph/giant/head/ceph/el6/noarch/ceph-9.0.0-0.noarch.rpm/')
+        recurring.purge_tombstones()
+        assert os.path.exists(storage.object_path(checksum))
+        session.app.delete('/binaries/ceph/giant/head/ceph/el7/noarch/ceph-9.0.0-0.noarch.rpm/')
+        recurring.purge_tombstones()
+        assert not os.path.exists(storage.object_path(checksum))
+
     def test_binary_file_deleted_removes_project(self, session, tmpdir):
         # if a project has no binaries related to it after binary deletion, it is deleted as well
         pecan.conf.binary_root = str(tmpdir)
@@ -194,7 +222,7 @@ class TestBinaryController(object):
             upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
         )
         result = session.app.delete('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
-        assert result.status_int == 204
+        assert result.status_int == 202
         p = Project.get(1)
         assert not p
 
@@ -212,7 +240,7 @@ class TestBinaryController(object):
             upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
         )
         result = session.app.delete('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
-        assert result.status_int == 204
+        assert result.status_int == 202
         p = Project.get(1)
         assert p.name == "ceph"
 
@@ -234,7 +262,7 @@ class TestBinaryController(object):
         repo = Repo.get(1)
         assert repo
         result = session.app.delete(url_delete)
-        assert result.status_int == 204
+        assert result.status_int == 202
         repo = Repo.get(1)
         assert not repo
 
@@ -254,7 +282,7 @@ class TestBinaryController(object):
         repo = Repo.get(1)
         assert repo
         result = session.app.delete('/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
-        assert result.status_int == 204
+        assert result.status_int == 202
         repo = Repo.get(1)
         assert repo.needs_update
 
@@ -421,6 +449,84 @@ class TestBinaryController(object):
         result = response['ceph-9.0.0-0.el6.x86_64.rpm']['checksum']
         assert result.startswith('a5725e467')
 
+    def test_checksums_sent_by_clients_are_ignored(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        path = os.path.join(str(tmpdir), 'other.rpm')
+        with open(path, 'wb') as f:
+            f.write(b_('something changed'))
+        session.app.post_json(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/',
+            params={
+                'force': True, 'path': path, 'checksum': 'f' * 128,
+                'sha256': 'f' * 64, 'md5': 'f' * 32,
+            }
+        )
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.sha256 == hashlib.sha256(b_('something changed')).hexdigest()
+        assert binary.md5 == hashlib.md5(b_('something changed')).hexdigest()
+
+    @pytest.mark.parametrize(
+            'url_post, url_get',
+            [('/binaries/ceph/giant/head/ceph/el6/x86_64/',
+              '/binaries/ceph/giant/head/ceph/el6/x86_64/'),
+             ('/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/',
+              '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/')]
+    )
+    def test_binary_gets_index_checksums_computed(self, session, tmpdir, url_post, url_get):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            url_post,
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        response = session.app.get(url_get).json
+        result = response['ceph-9.0.0-0.el6.x86_64.rpm']
+        assert result['sha256'] == hashlib.sha256(b_('hello tharrrr')).hexdigest()
+        assert result['md5'] == hashlib.md5(b_('hello tharrrr')).hexdigest()
+
+    @pytest.mark.parametrize(
+            'url_post',
+            ['/binaries/ceph/giant/head/ceph/el6/x86_64/',
+             '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/']
+    )
+    def test_upload_does_not_read_the_file_again(self, session, tmpdir, monkeypatch, url_post):
+        pecan.conf.binary_root = str(tmpdir)
+
+        def fail(path):
+            raise AssertionError('%s should not be read again' % path)
+
+        monkeypatch.setattr(storage, 'checksums', fail)
+        result = session.app.post(
+            url_post,
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        assert result.status_int == 201
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.checksum.startswith('318b')
+
+    def test_put_does_not_read_the_file_again(self, session, tmpdir, monkeypatch):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+
+        def fail(path):
+            raise AssertionError('%s should not be read again' % path)
+
+        monkeypatch.setattr(storage, 'checksums', fail)
+        session.app.put(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('something changed'))]
+        )
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.size == 17
+
     @pytest.mark.parametrize(
             'url_post, url_head',
             [('/binaries/ceph/giant/head/ceph/el6/x86_64/',
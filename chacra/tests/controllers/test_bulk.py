@@ -0,0 +1,176 @@
+import io
+import os
+import tarfile
+import pecan
+import pytest
+
+from chacra.models import Binary, Project, Repo
+from chacra.tests import util, conftest
+from chacra.compat import b_
+
+
+urls = [
+    '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+    '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/',
+]
+
+
+def make_tar(files, mode='w'):
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode=mode) as tar:
+        for name, contents in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+    return stream.getvalue()
+
+
+def post_tar(session, url, body, content_type='application/x-tar', **kw):
+    return session.app.post(
+        url,
+        params=body,
+        headers={
+            'Authorization': util.make_credentials(),
+            'Content-Type': content_type,
+        },
+        **kw
+    )
+
+
+files = [
+    ('ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr')),
+    ('ceph-common-9.0.0-0.el6.x86_64.rpm', b_('something else')),
+]
+
+
+class TestTarUploads(object):
+
+    def teardown_method(self):
+        # repos configured for related projects are "sticky", reset them
+        conftest.reload_config()
+
+    @pytest.mark.parametrize('url', urls)
+    def test_creates_all_binaries(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        result = post_tar(session, url, make_tar(files))
+        assert result.status_int == 201
+        assert sorted(result.json.keys()) == sorted(f[0] for f in files)
+        assert Binary.query.count() == 2
+
+    def test_files_are_written(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(session, urls[0], make_tar(files))
+        for name, contents in files:
+            binary = Binary.filter_by(name=name).first()
+            with open(binary.path, 'rb') as f:
+                assert f.read() == contents
+            assert binary.size == len(contents)
+
+    def test_binaries_share_a_repo(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(session, urls[0], make_tar(files))
+        assert Repo.query.count() == 1
+        repo = Repo.query.first()
+        assert repo.binaries.count() == 2
+
+    def test_flavor_is_set(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(
+            session,
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/tcmalloc/',
+            make_tar(files)
+        )
+        assert set(b.flavor for b in Binary.query.all()) == set(['tcmalloc'])
+
+    def test_compressed_tar(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = post_tar(
+            session, urls[0], make_tar(files, mode='w:gz'), content_type='application/gzip')
+        assert result.status_int == 201
+        assert Binary.query.count() == 2
+
+    def test_leading_dot_slash_is_ignored(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(session, urls[0], make_tar([('./ceph.rpm', b_('hello'))]))
+        assert Binary.filter_by(name='ceph.rpm').count() == 1
+
+    def test_nested_names_are_rejected(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = post_tar(
+            session, urls[0], make_tar([('../../ceph.rpm', b_('hello'))]), expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_empty_tar(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = post_tar(session, urls[0], make_tar([]), expect_errors=True)
+        assert result.status_int == 400
+        assert result.json['message'] == 'no binaries found in request'
+
+    def test_truncated_tar_leaves_nothing_behind(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        body = make_tar([('ceph.rpm', b_('hello' * 1000)), ('ceph-common.rpm', b_('a' * 2000))])
+        result = post_tar(session, urls[0], body[:2048], expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+        directory = os.path.join(str(tmpdir), 'ceph/giant/head/ceph/el6/x86_64')
+        assert os.listdir(directory) == []
+
+    def test_existing_binaries_require_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(session, urls[0], make_tar(files))
+        result = post_tar(session, urls[0], make_tar(files), expect_errors=True)
+        assert result.status_int == 400
+        assert 'ceph-9.0.0-0.el6.x86_64.rpm' in result.json['message']
+
+    def test_existing_binaries_are_updated_with_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        post_tar(session, urls[0], make_tar(files))
+        result = post_tar(
+            session, urls[0] + '?force=1',
+            make_tar([('ceph-9.0.0-0.el6.x86_64.rpm', b_('changed'))]))
+        assert result.status_int == 200
+        assert Binary.query.count() == 2
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.size == 7
+
+    def test_marks_related_repos(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.repos = {
+            'ceph': {
+                'all': {'ceph-deploy': ['main']}
+            },
+            '__force_dict__': True,
+        }
+        post_tar(session, '/binaries/ceph-deploy/main/head/centos/6/x86_64/', make_tar(files))
+        project = Project.filter_by(name='ceph').first()
+        repo = Repo.filter_by(project=project).first()
+        assert repo.needs_update is True
+
+
+class TestMultipartUploads(object):
+
+    @pytest.mark.parametrize('url', urls)
+    def test_creates_all_binaries(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(
+            url,
+            upload_files=[('file', name, contents) for name, contents in files]
+        )
+        assert result.status_int == 201
+        assert Binary.query.count() == 2
+
+    def test_existing_binaries_require_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_files = [('file', name, contents) for name, contents in files]
+        session.app.post(urls[0], upload_files=upload_files)
+        result = session.app.post(urls[0], upload_files=upload_files, expect_errors=True)
+        assert result.status_int == 400
+        result = session.app.post(
+            urls[0], params={'force': 1}, upload_files=upload_files)
+        assert result.status_int == 200
+
+    def test_single_file_is_not_bulk(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(urls[0], upload_files=[('file',) + files[0]])
+        assert result.json == {}
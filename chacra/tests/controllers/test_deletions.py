@@ -0,0 +1,35 @@
+import os
+import pecan
+from chacra.compat import b_
+from chacra.asynch import recurring
+from chacra.models import Binary
+
+
+class TestDeletionsController(object):
+
+    def test_nothing_to_delete(self, session):
+        result = session.app.get('/deletions/')
+        assert result.json == {}
+
+    def test_pending_deletions(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/main/head/centos/8/x86_64/',
+            upload_files=[('file', 'ceph-1.0.0.rpm', b_('hello tharrrr'))]
+        )
+        session.app.delete('/binaries/ceph/main/head/centos/8/x86_64/ceph-1.0.0.rpm/')
+        result = session.app.get('/deletions/')
+        assert result.json == {'ceph': {'files': 1, 'trees': 0, 'size': 13, 'failed': 0}}
+
+    def test_nothing_left_after_purging(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/main/head/centos/8/x86_64/',
+            upload_files=[('file', 'ceph-1.0.0.rpm', b_('hello tharrrr'))]
+        )
+        path = Binary.query.one().path
+        session.app.delete('/binaries/ceph/main/head/centos/8/x86_64/ceph-1.0.0.rpm/')
+        recurring.purge_tombstones()
+        result = session.app.get('/deletions/')
+        assert result.json == {}
+        assert not os.path.exists(path)
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import pecan
+import pytest
+
+from chacra.controllers.binaries import downloads
+from chacra.compat import b_
+
+
+url = '/binaries/ceph/giant/head/ceph/el6/x86_64/'
+binary_url = url + 'ceph-9.0.0-0.el6.x86_64.rpm/'
+contents = b_('0123456789abcdefghij')
+
+
+@pytest.fixture
+def binary(session, tmpdir):
+    pecan.conf.binary_root = str(tmpdir)
+    session.app.post(
+        url,
+        upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', contents)]
+    )
+    return os.path.join(str(tmpdir), 'ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm')
+
+
+class TestDownloads(object):
+
+    def test_whole_file_advertises_ranges(self, session, binary):
+        result = session.app.get(binary_url)
+        assert result.status_int == 200
+        assert result.body == contents
+        assert result.headers['Accept-Ranges'] == 'bytes'
+        assert result.headers['Content-Length'] == str(len(contents))
+
+    def test_single_range(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=2-5'})
+        assert result.status_int == 206
+        assert result.body == b_('2345')
+        assert result.headers['Content-Range'] == 'bytes 2-5/20'
+        assert result.headers['Content-Length'] == '4'
+
+    def test_open_range_to_the_end(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=15-'})
+        assert result.status_int == 206
+        assert result.body == b_('fghij')
+        assert result.headers['Content-Range'] == 'bytes 15-19/20'
+
+    def test_suffix_range(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=-3'})
+        assert result.status_int == 206
+        assert result.body == b_('hij')
+
+    def test_multiple_ranges(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=0-1,10-11'})
+        assert result.status_int == 206
+        content_type = result.headers['Content-Type']
+        assert content_type.startswith('multipart/byteranges; boundary=')
+        boundary = content_type.split('boundary=')[-1]
+        assert result.headers['Content-Length'] == str(len(result.body))
+        parts = result.body.split(b_('--%s' % boundary))
+        assert parts[-1] == b_('--\r\n')
+        assert b_('Content-Range: bytes 0-1/20\r\n\r\n01\r\n') in parts[1]
+        assert b_('Content-Range: bytes 10-11/20\r\n\r\nab\r\n') in parts[2]
+
+    def test_overlapping_ranges_are_sent_once(self, session, binary):
+        header = 'bytes=' + ','.join(['0-'] * downloads.MAX_RANGES)
+        result = session.app.get(binary_url, headers={'Range': header})
+        assert result.status_int == 206
+        assert result.headers['Content-Range'] == 'bytes 0-19/20'
+        assert result.body == contents
+
+    def test_unsatisfiable_range(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=50-60'}, expect_errors=True)
+        assert result.status_int == 416
+        assert result.headers['Content-Range'] == 'bytes */20'
+
+    def test_invalid_range_is_ignored(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'lines=1-2'})
+        assert result.status_int == 200
+        assert result.body == contents
+
+    def test_if_range_matching_date(self, session, binary):
+        modified = session.app.get(binary_url).headers['Last-Modified']
+        result = session.app.get(binary_url, headers={'Range': 'bytes=2-5', 'If-Range': modified})
+        assert result.status_int == 206
+        assert result.body == b_('2345')
+
+    def test_if_range_matching_etag(self, session, binary):
+        etag = session.app.get(binary_url).headers['ETag']
+        result = session.app.get(binary_url, headers={'Range': 'bytes=2-5', 'If-Range': etag})
+        assert result.status_int == 206
+
+    def test_if_range_stale_etag_sends_everything(self, session, binary):
+        result = session.app.get(binary_url, headers={'Range': 'bytes=2-5', 'If-Range': '"0000"'})
+        assert result.status_int == 200
+        assert result.body == contents
+
+    def test_if_range_stale_date_sends_everything(self, session, binary):
+        result = session.app.get(
+            binary_url,
+            headers={'Range': 'bytes=2-5', 'If-Range': 'Mon, 01 Jan 2001 00:00:00 GMT'}
+        )
+        assert result.status_int == 200
+        assert result.body == contents
+
+    def test_uses_the_file_wrapper(self, session, binary):
+        wrapped = []
+
+        def file_wrapper(f, block_size):
+            wrapped.append(f)
+            return iter(lambda: f.read(block_size), b_(''))
+
+        result = session.app.get(binary_url, extra_environ={'wsgi.file_wrapper': file_wrapper})
+        assert result.body == contents
+        assert len(wrapped) == 1
+
+
+class TestConditionalDownloads(object):
+
+    def test_etag_is_the_checksum(self, session, binary):
+        result = session.app.get(binary_url)
+        assert result.headers['ETag'] == '"%s"' % hashlib.sha512(contents).hexdigest()
+        assert 'Last-Modified' in result.headers
+
+    def test_if_none_match_is_not_modified(self, session, binary):
+        etag = session.app.get(binary_url).headers['ETag']
+        result = session.app.get(binary_url, headers={'If-None-Match': etag})
+        assert result.status_int == 304
+        assert result.body == b_('')
+        assert result.headers['ETag'] == etag
+
+    def test_if_none_match_with_other_etag(self, session, binary):
+        result = session.app.get(binary_url, headers={'If-None-Match': '"0000"'})
+        assert result.status_int == 200
+        assert result.body == contents
+
+    def test_if_modified_since_is_not_modified(self, session, binary):
+        modified = session.app.get(binary_url).headers['Last-Modified']
+        result = session.app.get(binary_url, headers={'If-Modified-Since': modified})
+        assert result.status_int == 304
+
+    def test_if_modified_since_older_date(self, session, binary):
+        result = session.app.get(
+            binary_url, headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        assert result.status_int == 200
+
+    def test_if_none_match_takes_precedence(self, session, binary):
+        modified = session.app.get(binary_url).headers['Last-Modified']
+        result = session.app.get(
+            binary_url, headers={'If-Modified-Since': modified, 'If-None-Match': '"0000"'})
+        assert result.status_int == 200
+
+    def test_head_is_revalidated(self, session, binary):
+        result = session.app.get(binary_url)
+        assert result.headers['Cache-Control'] == 'no-cache'
+
+    def test_sha1_binaries_are_cached(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', contents)]
+        )
+        result = session.app.get('/binaries/ceph/giant/aaaa/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
+        assert result.headers['Cache-Control'] == 'public, max-age=3600, must-revalidate'
+
+    def test_sha1_binaries_are_not_immutable(self, session, tmpdir):
+        # they can be replaced with a forced upload
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/aaaa/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', contents)]
+        )
+        result = session.app.get('/binaries/ceph/giant/aaaa/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/')
+        assert 'immutable' not in result.headers['Cache-Control']
+
+    def test_delegated_downloads_are_conditional(self, session, binary):
+        pecan.conf.delegate_downloads = True
+        try:
+            etag = session.app.get(binary_url).headers['ETag']
+            result = session.app.get(binary_url, headers={'If-None-Match': etag})
+        finally:
+            pecan.conf.delegate_downloads = False
+        assert result.status_int == 304
+        assert 'X-Accel-Redirect' not in result.headers
+
+
+class TestParseRanges(object):
+
+    @pytest.mark.parametrize('header, expected', [
+        ('bytes=0-0', [(0, 1)]),
+        ('bytes=0-99', [(0, 20)]),
+        ('bytes=-100', [(0, 20)]),
+        ('bytes=5-,-2', [(5, 20)]),
+        ('bytes=10-11,0-1', [(0, 2), (10, 12)]),
+        ('bytes=0-1,2-3', [(0, 4)]),
+        ('bytes=0-5,3-9,0-', [(0, 20)]),
+        ('bytes=25-30', []),
+        ('bytes=5-2', None),
+        ('bytes=-', None),
+        ('bytes=a-b', None),
+        ('items=0-1', None),
+        ('', None),
+    ])
+    def test_parses(self, header, expected):
+        assert downloads.parse_ranges(header, 20) == expected
+
+    def test_too_many_ranges_are_ignored(self):
+        header = 'bytes=' + ','.join('%s-%s' % (i, i) for i in range(downloads.MAX_RANGES + 1))
+        assert downloads.parse_ranges(header, 1000) is None
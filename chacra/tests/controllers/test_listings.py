@@ -0,0 +1,61 @@
+import pytest
+from chacra.models import Binary, Project
+
+
+# listings are built from a fixed number of queries, no matter how many refs,
+# sha1s, distros, versions, archs or binaries there are
+MAX_QUERIES = 6
+
+listings = [
+    '/binaries/',
+    '/binaries/ceph/',
+    '/binaries/ceph/ref-0/',
+    '/binaries/ceph/ref-0/sha1-0/',
+    '/binaries/ceph/ref-0/sha1-0/centos/',
+    '/binaries/ceph/ref-0/sha1-0/centos/version-0/',
+    '/binaries/ceph/ref-0/sha1-0/centos/version-0/arch-0/',
+    '/repos/',
+    '/repos/ceph/',
+    '/repos/ceph/ref-0/',
+    '/repos/ceph/ref-0/sha1-0/',
+    '/repos/ceph/ref-0/sha1-0/centos/',
+]
+
+
+def populate(session, size):
+    """
+    Create ``size`` refs, sha1s, distro versions, archs and binaries for each
+    one of them, in two distros and two projects
+    """
+    for project_name in ['ceph', 'ceph-deploy']:
+        project = Project.filter_by(name=project_name).first() or Project(project_name)
+        for ref in range(size):
+            for sha1 in range(size):
+                for distro in ['centos', 'ubuntu']:
+                    for version in range(size):
+                        for arch in range(size):
+                            for name in range(size):
+                                Binary(
+                                    'ceph-%s-%s.rpm' % (size, name), project,
+                                    ref='ref-%s' % ref, sha1='sha1-%s' % sha1,
+                                    distro=distro, distro_version='version-%s' % version,
+                                    arch='arch-%s' % arch,
+                                )
+    session.commit()
+
+
+def count_queries(session, queries, url):
+    queries.reset()
+    result = session.app.get(url)
+    assert result.status_int == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize('url', listings)
+def test_listing_queries_do_not_grow(session, queries, url):
+    populate(session, 1)
+    small = count_queries(session, queries, url)
+    populate(session, 2)
+    large = count_queries(session, queries, url)
+    assert large == small
+    assert large <= MAX_QUERIES
@@ -1,3 +1,4 @@
+import json
 from chacra.models import Project, Binary
 
 
@@ -63,3 +64,29 @@ class TestProjectController(object):
         session.commit()
         result = session.app.get('/binaries/foobar/')
         assert result.json == {'firefly': ['HEAD'], 'main': ['HEAD']}
+
+    def test_stream_project_refs(self, session):
+        p = Project('foobar')
+        for ref, sha1 in [('main', 'aaaa'), ('main', 'bbbb'), ('firefly', 'cccc')]:
+            Binary('ceph-1.0.0.rpm', p, ref=ref, sha1=sha1, distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        result = session.app.get('/binaries/foobar/', headers={'Accept': 'application/x-ndjson'})
+        assert result.content_type == 'application/x-ndjson'
+        lines = [json.loads(line) for line in result.body.decode('utf-8').splitlines()]
+        assert lines == [{'firefly': ['cccc']}, {'main': ['aaaa', 'bbbb']}]
+
+    def test_json_is_preferred(self, session):
+        p = Project('foobar')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1='aaaa', distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        result = session.app.get('/binaries/foobar/', headers={
+            'Accept': 'application/json, application/x-ndjson'})
+        assert result.content_type == 'application/json'
+        assert result.json == {'main': ['aaaa']}
+
+    def test_stream_empty_project(self, session):
+        Project('foobar')
+        session.commit()
+        result = session.app.get('/binaries/foobar/?stream=1')
+        assert result.status_int == 204
+        assert result.body == b''
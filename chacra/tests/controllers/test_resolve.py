@@ -0,0 +1,66 @@
+import pytest
+from chacra.models import Binary, Project
+
+
+@pytest.fixture
+def binaries(session, tmpdir):
+    project = Project('ceph')
+    for flavor in ['default', 'crimson']:
+        path = tmpdir.join('ceph-%s.rpm' % flavor)
+        path.write('binary contents')
+        binary = Binary(
+            'ceph.rpm', project, ref='main', sha1='head', distro='centos',
+            distro_version='8', arch='x86_64', flavor=flavor,
+        )
+        binary.path = str(path)
+    session.commit()
+
+
+class TestBinaryPaths(object):
+
+    @pytest.mark.parametrize('url', [
+        '/binaries/ceph/main/head/centos/8/x86_64/ceph.rpm/',
+        '/binaries/ceph/main/head/centos/8/x86_64/flavors/crimson/ceph.rpm/',
+    ])
+    def test_download_is_a_single_query(self, session, binaries, queries, url):
+        result = session.app.get(url)
+        assert result.body == b'binary contents'
+        assert len(queries) == 1
+
+    @pytest.mark.parametrize('url', [
+        '/binaries/ceph/main/head/centos/8/x86_64/ceph-common.rpm/',
+        '/binaries/ceph/main/head/centos/9/x86_64/ceph.rpm/',
+        '/binaries/ceph/main/head/centos/8/x86_64/flavors/seastore/ceph.rpm/',
+        '/binaries/ceph-deploy/main/head/centos/8/x86_64/ceph.rpm/',
+    ])
+    def test_missing_binary_is_a_single_query(self, session, binaries, queries, url):
+        result = session.app.get(url, expect_errors=True)
+        assert result.status_int == 404
+        assert len(queries) == 1
+
+    def test_head_is_a_single_query(self, session, binaries, queries):
+        result = session.app.head('/binaries/ceph/main/head/centos/8/x86_64/ceph.rpm/')
+        assert result.status_int == 200
+        assert len(queries) == 1
+
+
+class TestRepoPaths(object):
+
+    @pytest.mark.parametrize('url, flavor', [
+        ('/repos/ceph/main/head/centos/8/', 'default'),
+        ('/repos/ceph/main/head/centos/8/flavors/crimson/', 'crimson'),
+    ])
+    def test_repo_is_a_single_query(self, session, binaries, queries, url, flavor):
+        result = session.app.get(url)
+        assert result.json['flavor'] == flavor
+        assert len(queries) == 1
+
+    @pytest.mark.parametrize('url', [
+        '/repos/ceph/main/head/centos/9/',
+        '/repos/ceph/main/head/centos/8/flavors/seastore/',
+        '/repos/ceph-deploy/main/head/centos/8/',
+    ])
+    def test_missing_repo_is_a_single_query(self, session, binaries, queries, url):
+        result = session.app.get(url, expect_errors=True)
+        assert result.status_int == 404
+        assert len(queries) == 1
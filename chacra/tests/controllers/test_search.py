@@ -1,5 +1,11 @@
+import datetime
+import json
+import pecan
+import pytest
+from sqlalchemy import event, inspect
 from chacra.models import Project, Binary
-from chacra.controllers import search
+from chacra.models.binaries import name_trigram_index
+from chacra.controllers import search, util
 
 
 class TestSearchController(object):
@@ -51,3 +57,228 @@ class TestLikeSearch(object):
         result = session.app.get('/search/?name-has=ceph')
         assert len(result.json) == 1
         assert result.json[0]['name'] == 'ceph-1.0.0.rpm'
+
+
+@pytest.fixture
+def binaries(session):
+    project = Project('ceph')
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(7):
+        binary = Binary(
+            'ceph-%s.rpm' % i, project, ref='main', sha1='sha1-%s' % (i % 2),
+            distro='centos', distro_version='8', arch='x86_64',
+            flavor='crimson' if i == 3 else 'default', size=i * 100,
+        )
+        binary.checksum = 'checksum-%s' % i
+        # a few of them share a timestamp, ties are broken by id
+        binary.created = binary.modified = start + datetime.timedelta(days=i // 2)
+    session.commit()
+
+
+def walk(app, url):
+    names, pages = [], 0
+    while url:
+        result = app.get(url)
+        pages += 1
+        names.extend(b['name'] for b in result.json)
+        link = result.headers.get('Link')
+        url = link[1:link.index('>')] if link else None
+    return names, pages
+
+
+class TestPagination(object):
+
+    def test_pages_cover_every_binary_once(self, session, binaries):
+        names, pages = walk(session.app, '/search/?distro=centos&limit=3')
+        assert names == ['ceph-%s.rpm' % i for i in range(7)]
+        assert pages == 3
+
+    def test_descending_pages(self, session, binaries):
+        names, pages = walk(session.app, '/search/?distro=centos&limit=2&sort=-created')
+        assert names == ['ceph-%s.rpm' % i for i in reversed(range(7))]
+        assert pages == 4
+
+    @pytest.mark.parametrize('sort', ['name', '-name', 'size', '-size', 'modified'])
+    def test_sorting(self, session, binaries, sort):
+        names, _ = walk(session.app, '/search/?distro=centos&limit=2&sort=%s' % sort)
+        expected = ['ceph-%s.rpm' % i for i in range(7)]
+        if sort.startswith('-'):
+            expected.reverse()
+        assert names == expected
+
+    def test_last_page_has_no_link(self, session, binaries):
+        result = session.app.get('/search/?distro=centos&limit=7')
+        assert len(result.json) == 7
+        assert 'Link' not in result.headers
+        assert 'X-Next-Cursor' not in result.headers
+
+    def test_cursor_header_matches_link(self, session, binaries):
+        result = session.app.get('/search/?distro=centos&limit=2')
+        cursor = result.headers['X-Next-Cursor']
+        assert 'cursor=%s' % cursor in result.headers['Link']
+        result = session.app.get('/search/?distro=centos&limit=2&cursor=%s' % cursor)
+        assert [b['name'] for b in result.json] == ['ceph-2.rpm', 'ceph-3.rpm']
+
+    def test_limit_is_capped(self, session, binaries):
+        result = session.app.get('/search/?distro=centos&limit=%s' % (search.max_limit * 10))
+        assert len(result.json) == 7
+
+    @pytest.mark.parametrize('params', [
+        'limit=0', 'limit=many', 'sort=path', 'cursor=bogus',
+        'cursor=%s' % search.encode_cursor('-created', '2024-01-01T00:00:00', 1),
+    ])
+    def test_invalid_paging_params(self, session, binaries, params):
+        result = session.app.get('/search/?distro=centos&%s' % params, expect_errors=True)
+        assert result.status_int == 400
+
+
+class TestFilters(object):
+
+    @pytest.mark.parametrize('params, expected', [
+        ('size-gt=300', [4, 5, 6]),
+        ('size-gte=300', [3, 4, 5, 6]),
+        ('size-lt=200', [0, 1]),
+        ('size-lte=200&size-gt=0', [1, 2]),
+        ('created-gte=2024-01-02', [2, 3, 4, 5, 6]),
+        ('created-lt=2024-01-02T00:00:00', [0, 1]),
+        ('modified-lt=2000-01-01', []),
+        ('sha1=sha1-1', [1, 3, 5]),
+        ('flavor=crimson', [3]),
+        ('checksum=checksum-4', [4]),
+    ])
+    def test_filters(self, session, binaries, params, expected):
+        result = session.app.get('/search/?%s' % params)
+        assert [b['name'] for b in result.json] == ['ceph-%s.rpm' % i for i in expected]
+
+    @pytest.mark.parametrize('params', ['size-gt=big', 'created-lt=yesterday'])
+    def test_invalid_range_values(self, session, binaries, params):
+        result = session.app.get('/search/?%s' % params, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_unknown_operator_is_not_allowed(self, session, binaries):
+        result = session.app.get('/search/?name-gt=ceph', expect_errors=True)
+        assert result.status_int == 405
+
+
+class TestSubstringSearch(object):
+
+    @pytest.fixture
+    def names(self, session):
+        project = Project('ceph')
+        for name in ['ceph_1.0.deb', 'ceph-1.0.deb', 'ceph%1.0.deb', 'ceph\\1.0.deb']:
+            Binary(name, project, ref='main', distro='ubuntu', distro_version='jammy', arch='all')
+        session.commit()
+
+    @pytest.mark.parametrize('value, expected', [
+        ('ceph_', ['ceph_1.0.deb']),
+        ('ceph%25', ['ceph%1.0.deb']),
+        ('ceph%5C', ['ceph\\1.0.deb']),
+        ('ceph', ['ceph%1.0.deb', 'ceph-1.0.deb', 'ceph\\1.0.deb', 'ceph_1.0.deb']),
+    ])
+    def test_wildcards_match_literally(self, session, names, value, expected):
+        result = session.app.get('/search/?name-has=%s' % value)
+        assert sorted(b['name'] for b in result.json) == sorted(expected)
+
+    def test_only_one_value(self, session, names):
+        result = session.app.get('/search/?name-has=ceph&name-has=deb', expect_errors=True)
+        assert result.status_int == 400
+
+    def test_uses_the_trigram_index(self, session, names):
+        connection = session.Session.connection()
+        indexes = [index['name'] for index in inspect(connection).get_indexes('binaries')]
+        if name_trigram_index not in indexes:
+            pytest.skip('needs PostgreSQL with the pg_trgm extension')
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if 'LIKE' in statement:
+                executed.append((statement, parameters))
+
+        engine = pecan.conf.sqlalchemy.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            session.app.get('/search/?name-has=ceph-1')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        statement, parameters = executed[0]
+        connection = session.Session.connection()
+        # there are only a few rows, so a sequential scan would be cheaper
+        connection.execute('SET LOCAL enable_seqscan = off')
+        plan = '\n'.join(
+            row[0] for row in connection.execute('EXPLAIN ' + statement, parameters))
+        assert name_trigram_index in plan
+
+
+class TestStreaming(object):
+
+    @pytest.fixture(autouse=True)
+    def small_pages(self, monkeypatch):
+        monkeypatch.setattr(search, 'max_limit', 2)
+        monkeypatch.setattr(util, 'stream_batch', 2)
+
+    def lines(self, result):
+        assert result.content_type == 'application/x-ndjson'
+        return [json.loads(line) for line in result.body.decode('utf-8').splitlines()]
+
+    def test_pages_are_still_limited(self, session, binaries):
+        result = session.app.get('/search/?distro=centos')
+        assert len(result.json) == 2
+
+    @pytest.mark.parametrize('url, headers', [
+        ('/search/?distro=centos&stream=1', {}),
+        ('/search/?distro=centos', {'Accept': 'application/x-ndjson'}),
+    ])
+    def test_streams_every_result(self, session, binaries, url, headers):
+        result = session.app.get(url, headers=headers)
+        names = [b['name'] for b in self.lines(result)]
+        assert names == ['ceph-%s.rpm' % i for i in range(7)]
+        assert 'Link' not in result.headers
+
+    @pytest.mark.parametrize('url, headers', [
+        ('/search/?stream=1', {}),
+        ('/search/', {'Accept': 'application/x-ndjson'}),
+        ('/search/?distro=debian&stream=1', {}),
+        ('/search/?distro=debian', {'Accept': 'application/x-ndjson'}),
+    ])
+    def test_nothing_to_stream(self, session, binaries, url, headers):
+        # no filters or no results, however streaming was asked for
+        result = session.app.get(url, headers=headers)
+        assert result.status_int == 204
+        assert result.body == b''
+
+    def test_json_is_preferred(self, session, binaries):
+        result = session.app.get('/search/?distro=centos', headers={
+            'Accept': 'application/json, application/x-ndjson'})
+        assert result.content_type == 'application/json'
+
+    def test_streams_with_filters_sort_and_limit(self, session, binaries):
+        result = session.app.get('/search/?sha1=sha1-1&sort=-size&limit=2&stream=1')
+        assert [b['name'] for b in self.lines(result)] == ['ceph-5.rpm', 'ceph-3.rpm']
+
+    def test_rows_come_from_a_server_side_cursor(self, session, binaries, queries):
+        result = session.app.get('/search/?distro=centos&stream=1')
+        assert len(self.lines(result)) == 7
+        # a named cursor only sends its declaration through execute, the
+        # rows are fetched in batches afterwards
+        assert len(queries) == 1
+
+
+class TestFields(object):
+
+    def test_only_requested_fields(self, session, binaries):
+        result = session.app.get('/search/?flavor=crimson&fields=name,checksum,size')
+        assert result.json == [{'name': 'ceph-3.rpm', 'checksum': 'checksum-3', 'size': 300}]
+
+    def test_fields_are_kept_in_next_page(self, session, binaries):
+        names, pages = walk(session.app, '/search/?distro=centos&limit=3&fields=name&sort=-size')
+        assert names == ['ceph-%s.rpm' % i for i in reversed(range(7))]
+        result = session.app.get('/search/?distro=centos&limit=3&fields=name')
+        assert 'fields=name' in result.headers['Link']
+
+    def test_streamed_fields(self, session, binaries):
+        result = session.app.get('/search/?flavor=crimson&fields=name&stream=1')
+        assert result.body == b'{"name": "ceph-3.rpm"}\n'
+
+    def test_unknown_fields(self, session, binaries):
+        result = session.app.get('/search/?distro=centos&fields=name,secret', expect_errors=True)
+        assert result.status_int == 400
@@ -1,4 +1,5 @@
-from chacra.models import Project, Binary
+from chacra.models import Project, Binary, Repo
+from chacra.tests import util
 
 
 class TestSHA1Controller(object):
@@ -48,3 +49,41 @@ class TestSHA1Controller(object):
         session.commit()
         result = session.app.get('/binaries/ceph/main/head/')
         assert list(result.json.keys()) == ['ubuntu']
+
+    def test_delete_sha1(self, session):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1="aaaa", distro='centos', distro_version='el6', arch='i386')
+        Binary('ceph-1.0.0.deb', p, ref='main', sha1="aaaa", distro='ubuntu', distro_version='trusty', arch='i386')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1="bbbb", distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        result = session.app.delete('/binaries/ceph/main/aaaa/')
+        assert result.status_int == 202
+        assert result.json == {'binaries': 2, 'repos': 2}
+        assert [b.sha1 for b in Binary.query.all()] == ['bbbb']
+        assert [r.sha1 for r in Repo.query.all()] == ['bbbb']
+
+    def test_delete_last_sha1_deletes_the_project(self, session):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1="aaaa", distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        session.app.delete('/binaries/ceph/main/aaaa/')
+        assert Project.query.count() == 0
+
+    def test_delete_sha1_not_found(self, session):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1="aaaa", distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        result = session.app.delete('/binaries/ceph/main/bbbb/', expect_errors=True)
+        assert result.status_int == 404
+
+    def test_delete_sha1_requires_auth(self, session):
+        p = Project('ceph')
+        Binary('ceph-1.0.0.rpm', p, ref='main', sha1="aaaa", distro='centos', distro_version='el6', arch='i386')
+        session.commit()
+        result = session.app.delete(
+            '/binaries/ceph/main/aaaa/',
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True,
+        )
+        assert result.status_int == 401
+        assert Binary.query.count() == 1
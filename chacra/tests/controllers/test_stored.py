@@ -0,0 +1,221 @@
+import hashlib
+import os
+import pecan
+import pytest
+
+from chacra.models import Binary, Repo
+from chacra.tests import util
+from chacra.compat import b_
+from chacra import storage
+from chacra.controllers.binaries import stored
+
+
+urls = [
+    '/binaries/ceph/giant/head/ceph/el7/x86_64/',
+    '/binaries/ceph/giant/head/ceph/el7/x86_64/flavors/default/',
+]
+
+checksum = hashlib.sha512(b_('hello tharrrr')).hexdigest()
+
+
+def upload(session, url='/binaries/ceph/giant/head/ceph/el6/x86_64/', **kw):
+    return session.app.post(
+        url,
+        upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))],
+        **kw
+    )
+
+
+class TestChecksumNegotiation(object):
+
+    @pytest.mark.parametrize('url', urls)
+    def test_links_known_contents(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        result = session.app.post_json(
+            url, params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum})
+        assert result.status_int == 201
+        assert result.json['checksum'] == checksum
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el7.x86_64.rpm').first()
+        with open(binary.path, 'rb') as f:
+            assert f.read() == b_('hello tharrrr')
+
+    def test_copies_all_digests(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        session.app.post_json(
+            urls[0], params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum})
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el7.x86_64.rpm').first()
+        assert binary.sha256 == hashlib.sha256(b_('hello tharrrr')).hexdigest()
+        assert binary.md5 == hashlib.md5(b_('hello tharrrr')).hexdigest()
+        assert binary.size == 13
+
+    def test_links_without_object_store(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.deduplicate_binaries = False
+        try:
+            upload(session)
+            result = session.app.post_json(
+                urls[0], params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum})
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        assert result.status_int == 201
+
+    def test_marks_the_repo(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        session.app.post_json(
+            urls[0], params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum})
+        repo = Repo.filter_by(distro_version='el7').first()
+        assert repo.binaries.count() == 1
+
+    def test_unknown_contents_need_upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum},
+            expect_errors=True)
+        assert result.status_int == 404
+        assert 'needs to be uploaded' in result.json['message']
+
+    def test_size_mismatch_needs_upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        result = session.app.post_json(
+            urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum, 'size': 1},
+            expect_errors=True)
+        assert result.status_int == 404
+
+    def test_invalid_checksum(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': '../../etc'},
+            expect_errors=True)
+        assert result.status_int == 400
+
+    def test_existing_binary_requires_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        result = session.app.post_json(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            params={'name': 'ceph-9.0.0-0.el6.x86_64.rpm', 'checksum': checksum},
+            expect_errors=True)
+        assert result.status_int == 400
+
+    def test_forced_with_same_checksum_is_a_noop(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        binary = Binary.query.first()
+        modified, identity = binary.modified, binary.file_identity
+        result = session.app.post_json(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            params={'name': 'ceph-9.0.0-0.el6.x86_64.rpm', 'checksum': checksum, 'force': True})
+        assert result.status_int == 200
+        binary = Binary.query.first()
+        assert binary.modified == modified
+        assert binary.file_identity == identity
+
+    def test_requires_auth(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            urls[0],
+            params={'name': 'ceph-9.0.0-0.el7.x86_64.rpm', 'checksum': checksum},
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True)
+        assert result.status_int == 401
+
+
+class TestForcedUploadsOfTheSameFile(object):
+
+    def test_file_is_left_alone(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.deduplicate_binaries = False
+        try:
+            upload(session)
+            path = Binary.query.first().path
+            inode = os.stat(path).st_ino
+            result = upload(session, params={'force': 1})
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        assert result.status_int == 200
+        assert os.stat(path).st_ino == inode
+
+    def test_binary_is_not_modified(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        modified = Binary.query.first().modified
+        upload(session, params={'force': 1})
+        assert Binary.query.first().modified == modified
+
+    def test_no_partial_files_are_left(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        upload(session, params={'force': 1})
+        directory = os.path.join(str(tmpdir), 'ceph/giant/head/ceph/el6/x86_64')
+        assert os.listdir(directory) == ['ceph-9.0.0-0.el6.x86_64.rpm']
+
+    def test_put_with_same_contents(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        modified = Binary.query.first().modified
+        result = session.app.put(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/ceph-9.0.0-0.el6.x86_64.rpm/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        assert result.status_int == 200
+        assert Binary.query.first().modified == modified
+
+    def test_different_contents_are_saved(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            params={'force': 1},
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('something changed'))]
+        )
+        binary = Binary.query.first()
+        assert binary.size == 17
+        assert storage.file_identity(binary.path) == binary.file_identity
+
+
+class TestFindContents(object):
+
+    def test_binaries_are_not_loaded(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload(session)
+        session.Session.expunge_all()
+        source, digests = stored.find_contents(checksum)
+        assert digests['md5'] == hashlib.md5(b_('hello tharrrr')).hexdigest()
+        assert len(session.Session.identity_map) == 0
+
+    def test_stops_at_the_first_usable_file(self, session, tmpdir, monkeypatch):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.deduplicate_binaries = False
+        try:
+            for version in ('el6', 'el7', 'el8'):
+                upload(session, url='/binaries/ceph/giant/head/ceph/%s/x86_64/' % version)
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        checked = []
+        file_identity = storage.file_identity
+
+        def record(path):
+            checked.append(path)
+            return file_identity(path)
+
+        monkeypatch.setattr(storage, 'file_identity', record)
+        source, digests = stored.find_contents(checksum)
+        assert checked == [source]
+
+    def test_changed_files_are_not_used(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.deduplicate_binaries = False
+        try:
+            upload(session)
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        with open(Binary.query.one().path, 'wb') as f:
+            f.write(b_('changed'))
+        assert stored.find_contents(checksum) == (None, None)
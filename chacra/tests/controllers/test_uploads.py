@@ -0,0 +1,331 @@
+import hashlib
+import io
+import os
+import random
+import pecan
+import pytest
+
+from chacra.models import Binary, Project, Repo
+from chacra.tests import util, conftest
+from chacra.compat import b_
+from chacra import chunking
+from chacra.asynch import recurring
+
+
+urls = [
+    '/binaries/ceph/giant/head/ceph/el6/x86_64/uploads/',
+    '/binaries/ceph/giant/head/ceph/el6/x86_64/flavors/default/uploads/',
+]
+
+
+def put_chunk(session, url, data, offset=0, **kw):
+    return session.app.put(
+        '%s?offset=%s' % (url, offset),
+        params=data,
+        headers={
+            'Authorization': util.make_credentials(),
+            'Content-Type': 'application/octet-stream',
+        },
+        **kw
+    )
+
+
+class TestUploadsController(object):
+
+    def teardown_method(self):
+        # repos configured for related projects are "sticky", reset them
+        conftest.reload_config()
+
+    def create(self, session, url, **params):
+        params.setdefault('name', 'ceph-9.0.0-0.el6.x86_64.rpm')
+        return session.app.post_json(url, params=params)
+
+    @pytest.mark.parametrize('url', urls)
+    def test_create_upload(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        result = self.create(session, url, size=13)
+        assert result.status_int == 201
+        assert result.json['offset'] == 0
+        assert result.json['size'] == 13
+        assert len(result.json['id']) == 32
+
+    def test_create_upload_requires_name(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(urls[0], params={'size': 13}, expect_errors=True)
+        assert result.status_int == 400
+        assert result.json['message'] == "could not find required key: 'name'"
+
+    def test_create_upload_rejects_paths_as_names(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            urls[0], params={'name': '../../ceph.rpm'}, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_create_upload_requires_auth(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post_json(
+            urls[0], params={'name': 'ceph.rpm'},
+            headers={'Authorization': util.make_credentials(correct=False)},
+            expect_errors=True)
+        assert result.status_int == 401
+
+    def test_existing_binary_requires_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        result = session.app.post_json(
+            urls[0], params={'name': 'ceph-9.0.0-0.el6.x86_64.rpm'}, expect_errors=True)
+        assert result.status_int == 400
+        result = self.create(session, urls[0], force=True)
+        assert result.status_int == 201
+
+    @pytest.mark.parametrize('url', urls)
+    def test_upload_in_chunks(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (url, self.create(session, url, size=13).json['id'])
+        put_chunk(session, upload_url, b_('hello '))
+        result = put_chunk(session, upload_url, b_('tharrrr'), offset=6)
+        assert result.json['offset'] == 13
+        assert result.json['received'] == 13
+
+    def test_chunks_out_of_order(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0], size=13).json['id'])
+        result = put_chunk(session, upload_url, b_('tharrrr'), offset=6)
+        assert result.json['offset'] == 0
+        assert result.json['received'] == 7
+        assert result.json['ranges'] == [[6, 13]]
+        result = put_chunk(session, upload_url, b_('hello '))
+        assert result.json['ranges'] == [[0, 13]]
+
+    def test_status_reports_received_bytes(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0], size=13).json['id'])
+        put_chunk(session, upload_url, b_('hello '))
+        result = session.app.get(
+            upload_url, headers={'Authorization': util.make_credentials()})
+        assert result.json['offset'] == 6
+        assert result.json['name'] == 'ceph-9.0.0-0.el6.x86_64.rpm'
+
+    def test_chunk_past_size_is_rejected(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0], size=5).json['id'])
+        result = put_chunk(session, upload_url, b_('hello tharrrr'), expect_errors=True)
+        assert result.status_int == 400
+
+    def test_invalid_offset(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0]).json['id'])
+        result = put_chunk(session, upload_url, b_('hello'), offset='-1', expect_errors=True)
+        assert result.status_int == 400
+
+    def test_unknown_upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.get(
+            '%s%s/' % (urls[0], 'a' * 32),
+            headers={'Authorization': util.make_credentials()},
+            expect_errors=True)
+        assert result.status_int == 404
+
+    def test_upload_is_not_valid_for_other_urls(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_id = self.create(session, urls[0]).json['id']
+        result = put_chunk(
+            session,
+            '/binaries/ceph/giant/head/ceph/el7/x86_64/uploads/%s/' % upload_id,
+            b_('hello'), expect_errors=True)
+        assert result.status_int == 404
+
+    @pytest.mark.parametrize('url', urls)
+    def test_commit_creates_binary(self, session, tmpdir, url):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (url, self.create(session, url, size=13).json['id'])
+        put_chunk(session, upload_url, b_('tharrrr'), offset=6)
+        put_chunk(session, upload_url, b_('hello '))
+        result = session.app.post('%scommit/' % upload_url)
+        assert result.status_int == 201
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.size == 13
+        assert binary.checksum == hashlib.sha512(b_('hello tharrrr')).hexdigest()
+        with open(binary.path, 'rb') as f:
+            assert f.read() == b_('hello tharrrr')
+
+    def test_commit_uses_url_directory(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[1], self.create(session, urls[1]).json['id'])
+        put_chunk(session, upload_url, b_('hello tharrrr'))
+        session.app.post('%scommit/' % upload_url)
+        assert os.path.exists(os.path.join(
+            str(tmpdir),
+            'ceph/giant/head/ceph/el6/x86_64/flavors/default/ceph-9.0.0-0.el6.x86_64.rpm'
+        ))
+
+    def test_commit_without_size_uses_received_bytes(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0]).json['id'])
+        put_chunk(session, upload_url, b_('hello tharrrr'))
+        session.app.post('%scommit/' % upload_url)
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.size == 13
+
+    def test_commit_removes_staging(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0]).json['id'])
+        put_chunk(session, upload_url, b_('hello tharrrr'))
+        session.app.post('%scommit/' % upload_url)
+        assert os.listdir(os.path.join(str(tmpdir), '.uploads')) == []
+
+    def test_commit_incomplete_upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0], size=13).json['id'])
+        put_chunk(session, upload_url, b_('hello '))
+        result = session.app.post('%scommit/' % upload_url, expect_errors=True)
+        assert result.status_int == 400
+        assert 'received 6 bytes out of 13' in result.json['message']
+        assert Binary.query.count() == 0
+
+    def test_commit_verifies_checksum(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (
+            urls[0], self.create(session, urls[0], checksum='f' * 128).json['id'])
+        put_chunk(session, upload_url, b_('hello tharrrr'))
+        result = session.app.post('%scommit/' % upload_url, expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_commit_updates_existing_binary(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph-9.0.0-0.el6.x86_64.rpm', b_('hello tharrrr'))]
+        )
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0], force=True).json['id'])
+        put_chunk(session, upload_url, b_('something changed'))
+        result = session.app.post('%scommit/' % upload_url)
+        assert result.status_int == 200
+        assert Binary.query.count() == 1
+        binary = Binary.filter_by(name='ceph-9.0.0-0.el6.x86_64.rpm').first()
+        assert binary.checksum.startswith('a5725e467')
+        assert binary.size == 17
+
+    def test_commit_marks_related_repos(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        pecan.conf.repos = {
+            'ceph': {
+                'all': {'ceph-deploy': ['main']}
+            },
+            '__force_dict__': True,
+        }
+        url = '/binaries/ceph-deploy/main/head/centos/6/x86_64/uploads/'
+        upload_url = '%s%s/' % (url, self.create(session, url).json['id'])
+        put_chunk(session, upload_url, b_('hello tharrrr'))
+        session.app.post('%scommit/' % upload_url)
+        project = Project.filter_by(name='ceph').first()
+        repo = Repo.filter_by(project=project).first()
+        assert repo.needs_update is True
+
+    def test_commit_only_allows_post(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0]).json['id'])
+        result = session.app.get(
+            '%scommit/' % upload_url,
+            headers={'Authorization': util.make_credentials()},
+            expect_errors=True)
+        assert result.status_int == 405
+
+    def test_delete_upload(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        upload_url = '%s%s/' % (urls[0], self.create(session, urls[0]).json['id'])
+        put_chunk(session, upload_url, b_('hello '))
+        result = session.app.delete(upload_url)
+        assert result.status_int == 204
+        result = session.app.get(
+            upload_url,
+            headers={'Authorization': util.make_credentials()},
+            expect_errors=True)
+        assert result.status_int == 404
+
+
+class TestDeltaUploads(object):
+
+    url = '/binaries/ceph/giant/head/ceph/el6/x86_64/'
+
+    def setup_method(self):
+        pecan.conf.chunk_index_min_size = 0
+
+    def teardown_method(self):
+        conftest.reload_config()
+
+    def previous_build(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        contents = random.Random(0).randbytes(3 * 1024 * 1024)
+        session.app.post(
+            self.url, upload_files=[('file', 'ceph-debuginfo-1.rpm', contents)])
+        recurring.index_chunks()
+        return contents
+
+    def create(self, session, contents, **params):
+        chunks = [
+            [digest, size] for _, size, digest in chunking.chunks(io.BytesIO(contents))
+        ]
+        params.setdefault('name', 'ceph-debuginfo-2.rpm')
+        params.setdefault('size', len(contents))
+        params.setdefault('checksum', hashlib.sha512(contents).hexdigest())
+        params.setdefault('chunks', chunks)
+        return session.app.post_json(self.url + 'uploads/', params=params, expect_errors=True)
+
+    def test_reuses_known_chunks(self, session, tmpdir):
+        contents = self.previous_build(session, tmpdir)
+        changed = contents[:2000000] + b'inserted' + contents[2000000:]
+        result = self.create(session, changed)
+        assert result.status_int == 201
+        # most of it is already there
+        assert result.json['received'] > len(changed) / 2
+        assert result.json['received'] < len(changed)
+
+    def test_sends_missing_ranges_and_commits(self, session, tmpdir):
+        contents = self.previous_build(session, tmpdir)
+        changed = contents[:2000000] + b'inserted' + contents[2000000:]
+        upload = self.create(session, changed).json
+        upload_url = '%suploads/%s/' % (self.url, upload['id'])
+        offset = 0
+        for start, end in upload['ranges'] + [[len(changed), len(changed)]]:
+            if start > offset:
+                put_chunk(session, upload_url, changed[offset:start], offset=offset)
+            offset = end
+        result = session.app.post('%scommit/' % upload_url)
+        assert result.status_int == 201
+        binary = Binary.filter_by(name='ceph-debuginfo-2.rpm').first()
+        with open(binary.path, 'rb') as f:
+            assert f.read() == changed
+
+    def test_nothing_is_reused_without_an_index(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        contents = random.Random(0).randbytes(1024 * 1024)
+        result = self.create(session, contents)
+        assert result.json['received'] == 0
+
+    def test_changed_files_are_not_reused(self, session, tmpdir):
+        contents = self.previous_build(session, tmpdir)
+        path = Binary.query.first().path
+        with open(path, 'r+b') as f:
+            f.write(b'corrupted')
+        result = self.create(session, contents)
+        assert result.json['received'] == 0
+
+    def test_requires_checksum(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = self.create(session, b'hello tharrrr', checksum=None)
+        assert result.status_int == 400
+
+    def test_chunks_need_to_add_up_to_the_size(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = self.create(session, b'hello tharrrr', size=20)
+        assert result.status_int == 400
+
+    def test_invalid_chunks(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = self.create(session, b'hello tharrrr', chunks=[['abc', 13]])
+        assert result.status_int == 400
@@ -1,4 +1,8 @@
+import os
+from sqlalchemy import inspect
 from chacra.models import Binary, Project, Repo
+from chacra.models.binaries import name_trigram_index, trigrams_available
+from chacra import storage
 
 
 class TestBinaryModification(object):
@@ -180,3 +184,107 @@ class TestGenericBinaries(object):
             arch='amd64',
             )
         assert binary.repo.is_generic is False
+
+
+class TestChecksums(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def make_binary(self, tmpdir, contents=b'hello tharrrr'):
+        path = os.path.join(str(tmpdir), 'ceph-1.0.rpm')
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return Binary(
+            'ceph-1.0.rpm',
+            self.p,
+            ref='hammer',
+            distro='centos',
+            distro_version='7',
+            arch='x86_64',
+            path=path,
+            )
+
+    def test_checksum_is_computed_from_path(self, session, tmpdir):
+        binary = self.make_binary(tmpdir)
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('318b')
+        assert binary.file_identity == storage.file_identity(binary.path)
+
+    def test_digests_can_not_be_passed_in(self, session, tmpdir):
+        binary = self.make_binary(tmpdir)
+        binary.update_from_json({'checksum': 'f' * 128, 'md5': 'f' * 32})
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('318b')
+        assert binary.md5 != 'f' * 32
+
+    def test_file_identity_can_not_be_passed_in(self, session, tmpdir):
+        binary = self.make_binary(tmpdir)
+        session.commit()
+        binary = Binary.get(1)
+        with open(binary.path, 'wb') as f:
+            f.write(b'something changed')
+        binary.update_from_json({'file_identity': storage.file_identity(binary.path)})
+        binary.signed = True
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('a5725e467')
+
+    def test_computed_digests_are_not_read_again(self, session, tmpdir, monkeypatch):
+        binary = self.make_binary(tmpdir)
+        digests = storage.checksums(binary.path)
+
+        def fail(path):
+            raise AssertionError('%s should not be read again' % path)
+
+        monkeypatch.setattr(storage, 'checksums', fail)
+        binary.set_digests(digests)
+        session.commit()
+        assert Binary.get(1).checksum.startswith('318b')
+
+    def test_metadata_updates_do_not_read_the_file(self, session, tmpdir, monkeypatch):
+        self.make_binary(tmpdir)
+        session.commit()
+
+        def fail(path):
+            raise AssertionError('%s should not be read again' % path)
+
+        monkeypatch.setattr(storage, 'checksums', fail)
+        binary = Binary.get(1)
+        binary.signed = True
+        binary.built_by = 'alfredodeza'
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.signed is True
+        assert binary.checksum.startswith('318b')
+
+    def test_changed_file_gets_checksum_recomputed(self, session, tmpdir):
+        binary = self.make_binary(tmpdir)
+        session.commit()
+        binary = Binary.get(1)
+        with open(binary.path, 'wb') as f:
+            f.write(b'something changed')
+        binary.signed = True
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.checksum.startswith('a5725e467')
+
+    def test_missing_identity_gets_checksum_recomputed(self, session, tmpdir):
+        self.make_binary(tmpdir)
+        session.commit()
+        binary = Binary.get(1)
+        binary.file_identity = None
+        session.commit()
+        binary = Binary.get(1)
+        assert binary.file_identity == storage.file_identity(binary.path)
+
+
+class TestNameTrigramIndex(object):
+
+    def test_created_only_where_trigrams_are_available(self, session):
+        connection = session.Session.connection()
+        indexes = [index['name'] for index in inspect(connection).get_indexes('binaries')]
+        available = trigrams_available(None, Binary.__table__, connection)
+        assert (name_trigram_index in indexes) == available
@@ -0,0 +1,166 @@
+import threading
+import pecan
+import pytest
+from chacra.models import catalog
+from chacra.models import Binary, Catalog, Project
+
+
+def binary(project, name='ceph.rpm', **kw):
+    kw.setdefault('ref', 'main')
+    kw.setdefault('distro', 'centos')
+    kw.setdefault('distro_version', '8')
+    kw.setdefault('arch', 'x86_64')
+    return Binary(name, project, **kw)
+
+
+def rows():
+    return [
+        (c.ref, c.sha1, c.distro, c.distro_version, c.arch, c.flavor, c.binaries, c.size)
+        for c in Catalog.query.order_by(Catalog.id).all()
+    ]
+
+
+def concurrently(function, *args):
+    """
+    Call ``function`` in a thread, which is expected to block (waiting on a
+    row locked by another transaction). Returns a callable that waits for it
+    and returns the errors it raised.
+    """
+    errors = []
+
+    def target():
+        try:
+            function(*args)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join(0.5)
+
+    def wait():
+        thread.join()
+        return errors
+    return wait
+
+
+class TestCatalog(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def test_binaries_are_counted(self, session):
+        binary(self.p, 'ceph.rpm', size=10)
+        binary(self.p, 'ceph-common.rpm', size=5)
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 2, 15)]
+
+    def test_every_location_has_a_row(self, session):
+        binary(self.p, arch='x86_64')
+        binary(self.p, arch='aarch64')
+        binary(self.p, flavor='crimson')
+        session.commit()
+        assert len(rows()) == 3
+
+    def test_removing_a_binary(self, session):
+        binary(self.p, 'ceph.rpm', size=10)
+        binary(self.p, 'ceph-common.rpm', size=5)
+        session.commit()
+        Binary.filter_by(name='ceph.rpm').one().delete()
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 1, 5)]
+
+    def test_removing_the_last_binary_removes_the_row(self, session):
+        binary(self.p)
+        session.commit()
+        Binary.filter_by(name='ceph.rpm').one().delete()
+        session.commit()
+        assert rows() == []
+
+    def test_size_changes(self, session):
+        binary(self.p, size=10)
+        session.commit()
+        Binary.filter_by(name='ceph.rpm').one().size = 30
+        session.commit()
+        assert rows()[0][-2:] == (1, 30)
+
+    def test_moving_a_binary(self, session):
+        binary(self.p, size=10)
+        session.commit()
+        Binary.filter_by(name='ceph.rpm').one().ref = 'quincy'
+        session.commit()
+        assert rows() == [('quincy', 'head', 'centos', '8', 'x86_64', 'default', 1, 10)]
+
+    def test_removing_the_project(self, session):
+        binary(self.p)
+        session.commit()
+        Binary.filter_by(name='ceph.rpm').one().delete()
+        Project.filter_by(name='ceph').one().delete()
+        session.commit()
+        assert rows() == []
+
+
+class TestAdjust(object):
+
+    def key(self, project):
+        return dict(
+            project_id=project.id, ref='main', sha1='head', distro='centos',
+            distro_version='8', arch='x86_64', flavor='default',
+        )
+
+    def test_new_locations_are_inserted(self, session):
+        p = Project('ceph')
+        session.commit()
+        catalog.adjust(session.Session.connection(), self.key(p), 2, 10)
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 2, 10)]
+
+    def test_concurrent_uploads_to_a_new_location(self, session):
+        if session.Session.connection().dialect.name != 'postgresql':
+            pytest.skip('needs a database that other connections can share')
+        p = Project('ceph')
+        session.commit()
+        key = self.key(p)
+        engine = pecan.conf.sqlalchemy.engine
+        # another request inserts the row and commits after this one tried
+        other = engine.connect()
+        transaction = other.begin()
+        catalog.adjust(other, key, 1, 10)
+        errors = concurrently(catalog.adjust, session.Session.connection(), key, 1, 5)
+        transaction.commit()
+        other.close()
+        assert errors() == []
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 2, 15)]
+
+
+class TestRecount(object):
+
+    def test_existing_rows_are_replaced(self, session):
+        p = Project('ceph')
+        binary(p, size=10)
+        session.commit()
+        key = TestAdjust().key(p)
+        catalog.adjust(session.Session.connection(), key, 3, 100)
+        catalog.recount(session.Session.connection(), [key])
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 1, 10)]
+
+    def test_concurrent_recounts_of_a_new_location(self, session):
+        if session.Session.connection().dialect.name != 'postgresql':
+            pytest.skip('needs a database that other connections can share')
+        p = Project('ceph')
+        binary(p, size=10)
+        session.commit()
+        key = TestAdjust().key(p)
+        session.Session.connection().execute(catalog.Catalog.__table__.delete())
+        session.commit()
+        other = pecan.conf.sqlalchemy.engine.connect()
+        transaction = other.begin()
+        catalog.recount(other, [key])
+        errors = concurrently(catalog.recount, session.Session.connection(), [key])
+        transaction.commit()
+        other.close()
+        assert errors() == []
+        session.commit()
+        assert rows() == [('main', 'head', 'centos', '8', 'x86_64', 'default', 1, 10)]
@@ -0,0 +1,100 @@
+import pytest
+from chacra import models
+from chacra.models import Binary, Project, projects
+
+
+@pytest.fixture
+def project(session):
+    project = Project('ceph')
+    other = Project('ceph-deploy')
+    for ref, sha1 in [('main', 'aaaa'), ('main', 'bbbb'), ('quincy', 'cccc')]:
+        for distro, distro_version in [('centos', '8'), ('ubuntu', 'jammy')]:
+            for arch in ['x86_64', 'aarch64']:
+                for name in ['ceph.rpm', 'ceph-common.rpm', 'librados.rpm']:
+                    Binary(
+                        name, project, ref=ref, sha1=sha1, distro=distro,
+                        distro_version=distro_version, arch=arch,
+                    )
+    Binary(
+        'ceph-deploy.rpm', other, ref='other', sha1='dddd', distro='fedora',
+        distro_version='40', arch='noarch', flavor='crimson',
+    )
+    session.commit()
+    return Project.filter_by(name='ceph').one()
+
+
+class TestDistinctValues(object):
+
+    @pytest.mark.parametrize('attribute, expected', [
+        ('refs', ['main', 'quincy']),
+        ('sha1s', ['aaaa', 'bbbb', 'cccc']),
+        ('distros', ['centos', 'ubuntu']),
+        ('distro_versions', ['8', 'jammy']),
+        ('archs', ['aarch64', 'x86_64']),
+        ('flavors', ['default']),
+        ('repo_refs', ['main', 'quincy']),
+        ('repo_sha1s', ['aaaa', 'bbbb', 'cccc']),
+        ('repo_distros', ['centos', 'ubuntu']),
+        ('repo_distro_versions', ['8', 'jammy']),
+    ])
+    def test_single_query_with_distinct_rows(self, project, queries, attribute, expected):
+        assert sorted(getattr(project, attribute)) == expected
+        assert len(queries) == 1
+        assert queries.rows == len(expected)
+        assert 'DISTINCT' in queries[0][0]
+
+    def test_json_is_a_single_query(self, project, queries):
+        result = project.__json__()
+        assert sorted(result['main']) == ['aaaa', 'bbbb']
+        assert result['quincy'] == ['cccc']
+        assert len(queries) == 1
+        assert queries.rows == 3
+
+
+class TestMembership(object):
+
+    @pytest.mark.parametrize('method, value, expected', [
+        ('has_ref', 'main', True),
+        ('has_ref', 'other', False),
+        ('has_sha1', 'cccc', True),
+        ('has_sha1', 'dddd', False),
+        ('has_distro_version', 'jammy', True),
+        ('has_distro_version', '40', False),
+        ('has_flavor', 'default', True),
+        ('has_flavor', 'crimson', False),
+        ('has_repo_ref', 'quincy', True),
+        ('has_repo_ref', 'other', False),
+        ('has_repo_sha1', 'aaaa', True),
+        ('has_repo_sha1', 'dddd', False),
+        ('has_repo_distro', 'centos', True),
+        ('has_repo_distro', 'fedora', False),
+    ])
+    def test_single_row_exists_query(self, project, queries, method, value, expected):
+        assert getattr(project, method)(value) is expected
+        assert len(queries) == 1
+        assert queries.rows == 1
+        assert 'EXISTS' in queries[0][0]
+
+
+class TestGetOrCreate(object):
+
+    def test_creates_the_project(self, session):
+        project = projects.get_or_create('ceph')
+        assert project.id is not None
+        assert Project.query.count() == 1
+
+    def test_returns_the_existing_project(self, session):
+        project = Project('ceph')
+        session.commit()
+        assert projects.get_or_create('ceph') is project
+
+    def test_does_not_commit(self, session):
+        projects.get_or_create('ceph')
+        session.rollback()
+        assert Project.query.count() == 0
+
+    def test_an_existing_row_is_not_inserted_again(self, session):
+        Project('ceph')
+        session.commit()
+        assert models.insert_or_ignore(Project.__table__, dict(name='ceph')) == []
+        assert Project.query.count() == 1
@@ -0,0 +1,151 @@
+import pecan
+import pytest
+from sqlalchemy import event
+from chacra.models import Binary, Catalog, Project, Repo
+from chacra.models import registration
+from chacra.models.registration import register_binaries
+
+
+def entry(name='ceph.rpm', **kw):
+    values = dict(
+        name=name, path='/srv/%s' % name, size=10, checksum='a' * 128,
+        sha256='b' * 64, md5='c' * 32, ref='main', sha1='aaaa',
+        distro='centos', distro_version='8', arch='x86_64',
+    )
+    values.update(kw)
+    return values
+
+
+def build(count, sha1='aaaa'):
+    """
+    The binaries of a build: for two distro versions and two archs each
+    """
+    return [
+        entry('ceph-%d.rpm' % i, sha1=sha1, distro_version=version, arch=arch)
+        for version in ['8', '9']
+        for arch in ['x86_64', 'aarch64']
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def statements(session):
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    engine = pecan.conf.sqlalchemy.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield recorded
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+class TestRegisterBinaries(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def test_creates_binaries(self, session):
+        ids = register_binaries(self.p, build(3))
+        session.commit()
+        assert len(ids) == 12
+        assert Binary.query.count() == 12
+        binary = Binary.get(ids[('main', 'aaaa', 'centos', '9', 'aarch64', 'default', 'ceph-0.rpm')])
+        assert binary.checksum == 'a' * 128
+        assert binary.path == '/srv/ceph-0.rpm'
+        assert binary.project.name == 'ceph'
+        assert binary.repo.distro_version == '9'
+
+    def test_statements_do_not_depend_on_the_number_of_binaries(self, session, statements):
+        session.flush()
+        del statements[:]
+        register_binaries(self.p, build(2))
+        few = len(statements)
+        del statements[:]
+        register_binaries(self.p, build(50, sha1='bbbb'))
+        assert len(statements) == few
+
+    def test_one_repo_per_location(self, session):
+        register_binaries(self.p, build(3))
+        session.commit()
+        repos = Repo.query.order_by(Repo.distro_version).all()
+        assert [r.distro_version for r in repos] == ['8', '9']
+        assert [r.type for r in repos] == ['rpm', 'rpm']
+        assert [sorted(r.archs) for r in repos] == [['aarch64', 'x86_64']] * 2
+        assert [r.binary_count for r in repos] == [6, 6]
+        assert [r.needs_update for r in repos] == [True, True]
+
+    def test_existing_repos_are_used(self, session):
+        Binary(
+            'ceph-0.rpm', self.p, ref='main', sha1='aaaa', distro='centos',
+            distro_version='8', arch='x86_64',
+        )
+        session.commit()
+        register_binaries(self.p, build(1))
+        session.commit()
+        assert Repo.query.count() == 2
+        assert Repo.filter_by(distro_version='8').one().binary_count == 2
+
+    def test_catalog_is_updated(self, session):
+        register_binaries(self.p, build(3))
+        session.commit()
+        rows = Catalog.query.all()
+        assert len(rows) == 4
+        assert set((r.binaries, r.size) for r in rows) == set([(3, 30)])
+
+    def test_existing_binaries_are_updated(self, session):
+        register_binaries(self.p, [entry(size=10, built_by='jenkins')])
+        session.commit()
+        binary = Binary.filter_by(name='ceph.rpm').one()
+        created = binary.created
+        register_binaries(self.p, [entry(size=25, checksum='d' * 128)])
+        session.commit()
+        assert Binary.query.count() == 1
+        # the loaded binary is not stale
+        assert binary.checksum == 'd' * 128
+        assert binary.size == 25
+        assert binary.created == created
+        assert binary.built_by == 'jenkins'
+        row = Catalog.query.one()
+        assert (row.binaries, row.size) == (1, 25)
+
+    def test_generic_binaries_do_not_mark_repos(self, session):
+        register_binaries(self.p, [entry(distro_version='generic')])
+        session.commit()
+        repo = Repo.query.one()
+        assert repo.needs_update is False
+        assert repo.has_generic is True
+
+    def test_repos_with_generic_binaries_are_not_marked(self, session):
+        repo = Repo(self.p, 'main', 'centos', '8', sha1='aaaa')
+        repo.has_generic = True
+        repo.needs_update = False
+        session.commit()
+        register_binaries(self.p, [entry()])
+        session.commit()
+        repo = Repo.query.one()
+        assert repo.needs_update is False
+
+    def test_many_binaries(self, session, monkeypatch):
+        monkeypatch.setattr(registration, 'match_batch_size', 5)
+        ids = register_binaries(self.p, build(3))
+        register_binaries(self.p, build(3))
+        session.commit()
+        assert Binary.query.count() == 12
+        assert len(set(ids.values())) == 12
+
+    def test_more_binaries_than_sqlite_can_match_at_once(self, session):
+        ids = register_binaries(self.p, build(300))
+        session.commit()
+        assert len(ids) == 1200
+        assert Binary.query.count() == 1200
+
+    def test_digests_are_required(self, session):
+        with pytest.raises(ValueError) as exc:
+            register_binaries(self.p, [entry(checksum=None)])
+        assert 'checksum' in str(exc.value)
+
+    def test_binaries_can_only_be_included_once(self, session):
+        with pytest.raises(ValueError):
+            register_binaries(self.p, [entry(), entry()])
@@ -1,4 +1,4 @@
-from chacra.models import Project, Repo, Binary
+from chacra.models import Project, Repo, Binary, repos
 
 
 class TestRepoModification(object):
@@ -123,3 +123,102 @@ class TestRepoMetricNames(object):
         session.commit()
         result = Repo.get(1).metric_name
         assert result == "repos.ceph.ubuntu.trusty"
+
+
+class TestRepoSummary(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def binary(self, name, arch='x86_64', distro_version='7'):
+        return Binary(
+            name,
+            self.p,
+            ref='main',
+            distro='centos',
+            distro_version=distro_version,
+            arch=arch,
+        )
+
+    def test_counts_binaries(self, session):
+        self.binary('ceph-1.0.rpm')
+        self.binary('ceph-common-1.0.rpm')
+        session.commit()
+        assert Repo.get(1).binary_count == 2
+
+    def test_removing_the_last_binary_of_an_arch(self, session):
+        self.binary('ceph-1.0.x86_64.rpm', arch='x86_64')
+        self.binary('ceph-1.0.aarch64.rpm', arch='aarch64')
+        session.commit()
+        Binary.filter_by(arch='aarch64').one().delete()
+        session.commit()
+        repo = Repo.get(1)
+        assert repo.archs == ['x86_64']
+        assert repo.binary_count == 1
+
+    def test_has_generic(self, session):
+        self.binary('ceph-1.0.rpm', distro_version='generic')
+        session.commit()
+        assert Repo.get(1).has_generic is True
+
+    def test_has_no_generic_after_removing_it(self, session):
+        self.binary('ceph-1.0.rpm', distro_version='generic')
+        session.commit()
+        Binary.get(1).delete()
+        session.commit()
+        repo = Repo.get(1)
+        assert repo.has_generic is False
+        assert repo.binary_count == 0
+
+    def test_loaded_repo_is_current(self, session):
+        binary = self.binary('ceph-1.0.rpm')
+        session.flush()
+        assert binary.repo.archs == ['x86_64']
+        assert binary.repo.binary_count == 1
+
+    def test_binaries_are_not_loaded(self, session, queries):
+        for i in range(20):
+            self.binary('ceph-%s.rpm' % i)
+        session.commit()
+        queries.reset()
+        binary = self.binary('ceph-last.rpm', arch='aarch64')
+        session.commit()
+        assert binary.repo.archs == ['aarch64', 'x86_64']
+        assert binary.repo.binary_count == 21
+        # no query should go through the binaries of the repo
+        assert max(rows for _, rows in queries) < 20
+
+    def test_json(self, session):
+        self.binary('ceph-1.0.rpm')
+        session.commit()
+        result = Repo.get(1).__json__()
+        assert result['archs'] == ['x86_64']
+        assert result['binary_count'] == 1
+
+
+class TestGetOrCreate(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def test_creates_the_repo(self, session):
+        repo = repos.get_or_create(self.p, 'main', 'centos', '8', sha1='aaaa', type='rpm')
+        assert repo.id is not None
+        assert (repo.sha1, repo.flavor, repo.type) == ('aaaa', 'default', 'rpm')
+        assert repo.modified is not None
+
+    def test_returns_the_existing_repo(self, session):
+        repo = Repo(self.p, 'main', 'centos', '8', sha1='aaaa')
+        session.commit()
+        assert repos.get_or_create(self.p, 'main', 'centos', '8', sha1='aaaa') is repo
+        assert Repo.query.count() == 1
+
+    def test_binaries_share_the_repo(self, session):
+        for arch in ['x86_64', 'aarch64']:
+            Binary(
+                'ceph.rpm', self.p, ref='main', distro='centos',
+                distro_version='8', arch=arch,
+            )
+        session.commit()
+        assert Repo.query.count() == 1
+        assert Repo.query.one().binary_count == 2
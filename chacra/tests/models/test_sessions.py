@@ -0,0 +1,69 @@
+import pecan
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+from chacra import models
+from chacra.compat import b_
+from chacra.models import Project
+
+
+class ReadConfig(object):
+
+    def __init__(self, engine):
+        self.engine = engine
+
+
+@pytest.fixture
+def replica(session):
+    """
+    A second engine, for the same database, configured as ``sqlalchemy_read``
+    that records the statements it runs
+    """
+    engine = create_engine(pecan.conf.sqlalchemy.engine.url, poolclass=NullPool)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    pecan.conf.sqlalchemy_read = ReadConfig(engine)
+    yield statements
+    pecan.conf.__values__.pop('sqlalchemy_read', None)
+    event.remove(engine, 'before_cursor_execute', record)
+    engine.dispose()
+
+
+class TestReadOnlySession(object):
+
+    def test_read_only_session_does_not_autoflush(self, session):
+        models.start_read_only()
+        assert models.Session().info.get('read_only') is True
+        assert models.Session().autoflush is False
+
+    def test_read_engine_defaults_to_the_primary(self, session):
+        assert models.read_engine() is pecan.conf.sqlalchemy.engine
+
+    def test_pending_changes_are_kept(self, session):
+        Project('ceph')
+        models.start_read_only()
+        assert 'read_only' not in models.Session().info
+        assert Project.filter_by(name='ceph').count() == 1
+
+
+class TestReplica(object):
+
+    def test_reads_go_to_the_replica(self, session, replica):
+        Project('ceph')
+        session.commit()
+        result = session.app.get('/binaries/')
+        assert result.json == {'ceph': []}
+        assert any('projects' in statement for statement in replica)
+
+    def test_writes_go_to_the_primary(self, session, replica, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/main/head/centos/8/x86_64/',
+            upload_files=[('file', 'ceph-1.0.0.rpm', b_('hello tharrrr'))]
+        )
+        assert replica == []
+        assert Project.filter_by(name='ceph').count() == 1
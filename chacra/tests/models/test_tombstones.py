@@ -0,0 +1,126 @@
+import os
+import pytest
+from chacra.models import Binary, Catalog, Project, Repo, Tombstone, tombstones
+
+
+class TestBuryBinaries(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    @pytest.fixture(autouse=True)
+    def root(self, tmpdir):
+        self.root = str(tmpdir)
+
+    def binary(self, name, sha1='aaaa', arch='x86_64'):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write('hello tharrrr')
+        return Binary(
+            name, self.p, ref='main', sha1=sha1, distro='centos',
+            distro_version='8', arch=arch, path=path, size=10,
+        )
+
+    def test_binaries_are_deleted(self, session):
+        self.binary('ceph-1.rpm')
+        self.binary('ceph-2.rpm')
+        self.binary('ceph-3.rpm', sha1='bbbb')
+        session.commit()
+        assert tombstones.bury_binaries(self.p, Binary.sha1 == 'aaaa') == 2
+        session.commit()
+        assert [b.name for b in Binary.query.all()] == ['ceph-3.rpm']
+
+    def test_tombstones_are_left(self, session):
+        self.binary('ceph-1.rpm')
+        session.commit()
+        tombstones.bury_binaries(self.p)
+        session.commit()
+        tombstone = Tombstone.query.one()
+        assert tombstone.path == os.path.join(self.root, 'ceph-1.rpm')
+        assert tombstone.project == 'ceph'
+        assert tombstone.size == 10
+        assert tombstone.is_tree is False
+
+    def test_files_are_left_alone(self, session):
+        path = self.binary('ceph-1.rpm').path
+        session.commit()
+        tombstones.bury_binaries(self.p)
+        session.commit()
+        assert os.path.exists(path)
+
+    def test_catalog_is_updated(self, session):
+        self.binary('ceph-1.rpm')
+        self.binary('ceph-2.rpm', arch='aarch64')
+        session.commit()
+        tombstones.bury_binaries(self.p, Binary.arch == 'aarch64')
+        session.commit()
+        row = Catalog.query.one()
+        assert (row.arch, row.binaries, row.size) == ('x86_64', 1, 10)
+
+    def test_repos_are_summarized(self, session):
+        self.binary('ceph-1.rpm')
+        self.binary('ceph-2.rpm', arch='aarch64')
+        session.commit()
+        tombstones.bury_binaries(self.p, Binary.arch == 'aarch64')
+        session.commit()
+        repo = Repo.query.one()
+        assert repo.archs == ['x86_64']
+        assert repo.binary_count == 1
+
+    def test_loaded_binaries_are_removed_from_the_session(self, session):
+        binary = self.binary('ceph-1.rpm')
+        session.commit()
+        tombstones.bury_binaries(self.p)
+        session.commit()
+        assert binary not in session.Session()
+
+
+class TestBuryRepos(object):
+
+    def setup_method(self):
+        self.p = Project('ceph')
+
+    def test_trees_are_moved_away(self, session, tmpdir):
+        path = os.path.join(str(tmpdir), 'repo')
+        os.makedirs(path)
+        Repo(self.p, 'main', 'centos', '8', sha1='aaaa').path = path
+        session.commit()
+        assert tombstones.bury_repos(self.p, Repo.sha1 == 'aaaa') == 1
+        session.commit()
+        assert not os.path.exists(path)
+        tombstone = Tombstone.query.one()
+        assert tombstone.is_tree is True
+        assert os.path.isdir(tombstone.path)
+        assert Repo.query.count() == 0
+
+    def test_repos_without_a_tree(self, session):
+        Repo(self.p, 'main', 'centos', '8')
+        session.commit()
+        assert tombstones.bury_repos(self.p) == 1
+        session.commit()
+        assert Tombstone.query.count() == 0
+
+
+class TestPending(object):
+
+    def test_nothing_pending(self, session):
+        assert tombstones.pending() == {}
+
+    def test_summary_per_project(self, session):
+        Tombstone('/srv/ceph-1.rpm', project='ceph', size=10)
+        Tombstone('/srv/ceph-2.rpm', project='ceph', size=5)
+        Tombstone('/srv/.repo.deleted-1', project='ceph', is_tree=True)
+        Tombstone('/srv/rgw.rpm', project='rgw', size=1)
+        session.commit()
+        assert tombstones.pending() == {
+            'ceph': dict(files=2, trees=1, size=15, failed=0),
+            'rgw': dict(files=1, trees=0, size=1, failed=0),
+        }
+
+    def test_failures_are_counted(self, session):
+        Tombstone('/srv/ceph-1.rpm', project='ceph', size=10).attempts = 2
+        Tombstone('/srv/ceph-2.rpm', project='ceph', size=5)
+        session.commit()
+        assert tombstones.pending() == {
+            'ceph': dict(files=2, trees=0, size=15, failed=1),
+        }
@@ -0,0 +1,47 @@
+import io
+import random
+from chacra import chunking
+
+
+def data(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def chunks(contents):
+    return list(chunking.chunks(io.BytesIO(contents)))
+
+
+class TestChunks(object):
+
+    def test_empty_file(self):
+        assert chunks(b'') == []
+
+    def test_small_file_is_a_single_chunk(self):
+        result = chunks(b'hello tharrrr')
+        assert len(result) == 1
+        assert result[0][:2] == (0, 13)
+
+    def test_chunks_cover_the_file(self):
+        contents = data(5 * 1024 * 1024)
+        offset = 0
+        for chunk_offset, size, _ in chunks(contents):
+            assert chunk_offset == offset
+            offset += size
+        assert offset == len(contents)
+
+    def test_chunk_sizes_are_bounded(self):
+        sizes = [c[1] for c in chunks(data(10 * 1024 * 1024))]
+        assert all(s >= chunking.MIN_SIZE for s in sizes[:-1])
+        assert all(s <= chunking.MAX_SIZE for s in sizes)
+
+    def test_no_anchors(self):
+        sizes = [c[1] for c in chunks(b'\0' * (9 * 1024 * 1024))]
+        assert sizes == [chunking.MAX_SIZE, chunking.MAX_SIZE, 1024 * 1024]
+
+    def test_chunks_are_stable_after_an_insertion(self):
+        contents = data(10 * 1024 * 1024)
+        changed = contents[:3000000] + b'inserted' + contents[3000000:]
+        before = set(c[2] for c in chunks(contents))
+        after = [c[2] for c in chunks(changed)]
+        # only the chunk with the insertion (and maybe the next one) differ
+        assert len([d for d in after if d not in before]) <= 2
@@ -0,0 +1,187 @@
+import os
+import pecan
+import pytest
+
+from chacra.models import Binary
+from chacra.tests import util, conftest
+
+
+class TestSpooledBodyHook(object):
+
+    url = '/binaries/ceph/giant/head/ceph/el6/x86_64/?name=ceph-9.0.0-0.el6.x86_64.rpm'
+
+    @pytest.fixture
+    def spool(self, tmpdir):
+        pecan.conf.binary_root = str(tmpdir.mkdir('binaries'))
+        spool_dir = tmpdir.mkdir('spool')
+        pecan.conf.upload_spool_dir = str(spool_dir)
+        yield spool_dir
+        conftest.reload_config()
+
+    def spooled(self, spool, contents=b'hello tharrrr'):
+        path = spool.join('0000000001')
+        path.write_binary(contents)
+        return str(path)
+
+    def post(self, session, path, url=None, **kw):
+        return session.app.post(
+            url or self.url,
+            headers={
+                'Authorization': util.make_credentials(),
+                'Content-Type': 'application/octet-stream',
+                'X-Request-Body-File': path,
+            },
+            **kw
+        )
+
+    def test_links_spooled_body(self, session, spool):
+        path = self.spooled(spool)
+        result = self.post(session, path)
+        assert result.status_int == 201
+        binary = Binary.query.first()
+        assert os.stat(binary.path).st_ino == os.stat(path).st_ino
+        assert binary.size == 13
+
+    def test_spooled_file_can_be_removed(self, session, spool):
+        path = self.spooled(spool)
+        self.post(session, path)
+        os.remove(path)
+        with open(Binary.query.first().path, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_spooled_multipart_body(self, session, spool):
+        boundary = 'xxxxxxxxxx'
+        body = (
+            '--%s\r\n'
+            'Content-Disposition: form-data; name="file"; filename="ceph.rpm"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            'hello tharrrr\r\n'
+            '--%s--\r\n' % (boundary, boundary)
+        ).encode('utf-8')
+        path = self.spooled(spool, body)
+        result = session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            headers={
+                'Authorization': util.make_credentials(),
+                'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
+                'X-Request-Body-File': path,
+            },
+        )
+        assert result.status_int == 201
+        assert Binary.query.first().size == 13
+
+    def test_paths_outside_the_spool_are_rejected(self, session, spool, tmpdir):
+        path = tmpdir.join('secret')
+        path.write_binary(b'secret')
+        result = self.post(session, str(path), expect_errors=True)
+        assert result.status_int == 400
+        assert Binary.query.count() == 0
+
+    def test_relative_escapes_are_rejected(self, session, spool, tmpdir):
+        tmpdir.join('secret').write_binary(b'secret')
+        path = os.path.join(str(spool), '..', 'secret')
+        result = self.post(session, path, expect_errors=True)
+        assert result.status_int == 400
+
+    def test_header_is_ignored_without_spool_dir(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        path = tmpdir.join('secret')
+        path.write_binary(b'secret')
+        result = self.post(session, str(path), params=b'hello tharrrr')
+        assert result.status_int == 201
+        assert Binary.query.first().size == 13
+
+    def test_header_is_ignored_outside_of_uploads(self, session, spool):
+        path = self.spooled(spool, b'{"name": "ceph-9.0.0-0.el6.x86_64.rpm"}')
+        result = session.app.put(
+            '/repos/ceph/giant/head/ceph/el6/',
+            headers={
+                'Authorization': util.make_credentials(),
+                'Content-Type': 'application/json',
+                'X-Request-Body-File': path,
+            },
+            params=b'{}', expect_errors=True,
+        )
+        assert 'chacra.spooled_body' not in result.request.environ
+
+    def test_header_is_ignored_for_reads(self, session, spool):
+        path = self.spooled(spool)
+        result = session.app.get(
+            '/binaries/', headers={'X-Request-Body-File': path})
+        assert result.status_int == 200
+        assert 'chacra.spooled_body' not in result.request.environ
+
+
+class TestRawUploads(object):
+
+    def test_requires_name(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            params=b'hello tharrrr',
+            headers={
+                'Authorization': util.make_credentials(),
+                'Content-Type': 'application/octet-stream',
+            },
+            expect_errors=True
+        )
+        assert result.status_int == 400
+
+    def test_existing_binary_requires_force(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        url = '/binaries/ceph/giant/head/ceph/el6/x86_64/?name=ceph.rpm'
+        headers = {
+            'Authorization': util.make_credentials(),
+            'Content-Type': 'application/octet-stream',
+        }
+        session.app.post(url, params=b'hello tharrrr', headers=headers)
+        result = session.app.post(
+            url, params=b'changed', headers=headers, expect_errors=True)
+        assert result.status_int == 400
+        result = session.app.post(url + '&force=1', params=b'changed', headers=headers)
+        assert result.status_int == 200
+
+    def test_query_string_is_not_part_of_the_path(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/?name=ceph.rpm',
+            params=b'hello tharrrr',
+            headers={
+                'Authorization': util.make_credentials(),
+                'Content-Type': 'application/octet-stream',
+            },
+        )
+        assert Binary.query.first().path == os.path.join(
+            str(tmpdir), 'ceph/giant/head/ceph/el6/x86_64/ceph.rpm')
+
+
+class TestJSONETagHook(object):
+
+    def test_json_responses_have_a_weak_etag(self, session):
+        result = session.app.get('/binaries/')
+        assert result.headers['ETag'].startswith('W/"')
+
+    def test_if_none_match_is_not_modified(self, session):
+        etag = session.app.get('/binaries/').headers['ETag']
+        result = session.app.get('/binaries/', headers={'If-None-Match': etag})
+        assert result.status_int == 304
+        assert result.body == b''
+
+    def upload(self, session):
+        return session.app.post(
+            '/binaries/ceph/giant/head/ceph/el6/x86_64/',
+            upload_files=[('file', 'ceph.rpm', b'hello tharrrr')]
+        )
+
+    def test_etag_changes_with_the_contents(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        etag = session.app.get('/binaries/').headers['ETag']
+        self.upload(session)
+        result = session.app.get('/binaries/', headers={'If-None-Match': etag})
+        assert result.status_int == 200
+        assert result.headers['ETag'] != etag
+
+    def test_writes_are_not_tagged(self, session, tmpdir):
+        pecan.conf.binary_root = str(tmpdir)
+        result = self.upload(session)
+        assert 'ETag' not in result.headers
@@ -0,0 +1,76 @@
+import datetime
+import json
+import pytest
+from pecan import jsonify
+from chacra.models import Binary, Project
+from chacra.serializers import BinaryRecord
+
+
+@pytest.fixture
+def binaries(session):
+    project = Project('ceph')
+    for i in range(3):
+        Binary(
+            'ceph-%s.rpm' % i, project, ref='main', sha1='head', distro='centos',
+            distro_version='8', arch='x86_64', size=i, built_by='builder',
+        )
+    session.commit()
+
+
+def records(fields=BinaryRecord.fields, extra=(), now=None):
+    query = BinaryRecord.query(Binary.query.order_by(Binary.id), fields, extra)
+    return list(BinaryRecord.records(query.all(), fields, now))
+
+
+class TestBinaryRecord(object):
+
+    def test_renders_like_the_model(self, session, binaries):
+        def rendered(obj):
+            # last_changed depends on when it is rendered
+            return dict(json.loads(jsonify.encode(obj)), last_changed=None)
+        expected = [rendered(b) for b in Binary.query.order_by(Binary.id)]
+        assert [rendered(r) for r in records()] == expected
+
+    def test_single_query_without_loading_binaries(self, session, binaries, queries):
+        result = records()
+        assert len(queries) == 1
+        assert len(result) == 3
+        assert session.Session.identity_map.values() == []
+
+    def test_only_selects_needed_columns(self, session, binaries, queries):
+        result = records(fields=('name', 'size'))
+        assert [r.__json__() for r in result] == [
+            {'name': 'ceph-%s.rpm' % i, 'size': i} for i in range(3)
+        ]
+        statement = queries[0][0]
+        assert 'binaries.checksum' not in statement
+        assert 'projects' not in statement
+
+    def test_extra_columns_are_not_rendered(self, session, binaries):
+        record = records(fields=('size',), extra=['created'])[0]
+        assert record.created is not None
+        assert record.__json__() == {'size': 0}
+
+    def test_last_changed_uses_shared_now(self, session, binaries):
+        binary = Binary.query.order_by(Binary.id).first()
+        last = max(binary.created, binary.modified)
+        now = last.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=2)
+        result = records(fields=('last_changed',), now=now)
+        assert result[0].__json__() == {'last_changed': '2 minutes ago'}
+
+    def test_has_no_instance_dict(self, session, binaries):
+        assert not hasattr(records()[0], '__dict__')
+
+
+class TestParseFields(object):
+
+    def test_defaults_to_every_field(self):
+        assert BinaryRecord.parse_fields(None) == BinaryRecord.fields
+
+    def test_keeps_rendering_order(self):
+        assert BinaryRecord.parse_fields('size, name,checksum') == ('name', 'size', 'checksum')
+
+    @pytest.mark.parametrize('value', ['name,secret', ['name', 'size']])
+    def test_invalid(self, value):
+        with pytest.raises(ValueError):
+            BinaryRecord.parse_fields(value)
@@ -0,0 +1,428 @@
+import errno
+import hashlib
+import io
+import os
+import tempfile
+import pytest
+import pecan
+from chacra import storage
+
+
+@pytest.fixture(autouse=True)
+def binary_root(tmpdir):
+    # the object store lives in binary_root
+    pecan.conf.binary_root = str(tmpdir)
+
+
+class TestDigests(object):
+
+    def test_computes_all_checksums(self):
+        digests = storage.Digests()
+        digests.update(b'hello ')
+        digests.update(b'tharrrr')
+        result = digests.as_dict()
+        assert result['checksum'] == hashlib.sha512(b'hello tharrrr').hexdigest()
+        assert result['sha256'] == hashlib.sha256(b'hello tharrrr').hexdigest()
+        assert result['md5'] == hashlib.md5(b'hello tharrrr').hexdigest()
+
+    def test_computes_size(self):
+        digests = storage.Digests()
+        digests.update(b'hello ')
+        digests.update(b'tharrrr')
+        assert digests.as_dict()['size'] == 13
+
+
+class TestChecksums(object):
+
+    def test_reads_file_from_path(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'ceph.rpm')
+        with open(path, 'wb') as f:
+            f.write(b'hello tharrrr')
+        result = storage.checksums(path)
+        assert result['checksum'] == hashlib.sha512(b'hello tharrrr').hexdigest()
+        assert result['size'] == 13
+
+
+class TestSaveFile(object):
+
+    def test_writes_contents(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_returns_digests_of_contents(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        result = storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        assert result == storage.checksums(destination)
+
+    def test_overwrites_existing_file(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        storage.save_file(io.BytesIO(b'something changed'), destination)
+        with open(destination, 'rb') as f:
+            assert f.read() == b'something changed'
+
+    def test_leaves_no_partial_files_behind(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        assert sorted(os.listdir(str(tmpdir))) == ['.objects', 'ceph.rpm']
+
+    def test_preallocates_known_sizes(self, tmpdir, monkeypatch):
+        calls = []
+        monkeypatch.setattr(os, 'posix_fallocate', lambda fd, offset, size: calls.append(size))
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        assert calls == [13]
+
+    def test_unsupported_preallocation_is_ignored(self, tmpdir, monkeypatch):
+        def fallocate(fd, offset, size):
+            raise OSError(errno.EOPNOTSUPP, 'not supported')
+
+        monkeypatch.setattr(os, 'posix_fallocate', fallocate)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+
+class TestIngest(object):
+
+    def spooled(self, tmpdir, contents=b'hello tharrrr'):
+        spool = tempfile.NamedTemporaryFile(dir=str(tmpdir))
+        spool.write(contents)
+        spool.flush()
+        spool.seek(0)
+        return spool
+
+    def test_links_named_spools(self, tmpdir):
+        spool = self.spooled(tmpdir)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.ingest(spool, destination)
+        assert os.stat(destination).st_ino == os.stat(spool.name).st_ino
+
+    def test_linked_file_survives_the_spool(self, tmpdir):
+        spool = self.spooled(tmpdir)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.ingest(spool, destination)
+        spool.close()
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_linking_returns_digests(self, tmpdir):
+        spool = self.spooled(tmpdir)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        result = storage.ingest(spool, destination)
+        assert result['checksum'] == hashlib.sha512(b'hello tharrrr').hexdigest()
+        assert result['size'] == 13
+
+    def test_moves_paths_it_owns(self, tmpdir):
+        spool = os.path.join(str(tmpdir), 'spooled')
+        with open(spool, 'wb') as f:
+            f.write(b'hello tharrrr')
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.ingest(spool, destination, move=True)
+        assert not os.path.exists(spool)
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_copies_across_filesystems(self, tmpdir, monkeypatch):
+        def link(source, destination):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        monkeypatch.setattr(os, 'link', link)
+        spool = self.spooled(tmpdir)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.ingest(spool, destination)
+        assert os.stat(destination).st_ino != os.stat(spool.name).st_ino
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_copies_anonymous_spools(self, tmpdir):
+        spool = tempfile.TemporaryFile()
+        spool.write(b'hello tharrrr')
+        spool.seek(0)
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        result = storage.ingest(spool, destination)
+        assert result['size'] == 13
+        with open(destination, 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+
+class TestStagedUpload(object):
+
+    def test_create_and_load(self, tmpdir):
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm', size=13)
+        loaded = storage.StagedUpload.load(str(tmpdir), upload.id)
+        assert loaded.metadata['name'] == 'ceph.rpm'
+        assert loaded.size == 13
+
+    def test_load_rejects_invalid_ids(self, tmpdir):
+        assert storage.StagedUpload.load(str(tmpdir), '../../etc') is None
+
+    def test_load_missing_upload(self, tmpdir):
+        assert storage.StagedUpload.load(str(tmpdir), 'a' * 32) is None
+
+    def test_merges_ranges(self, tmpdir):
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm', size=13)
+        upload.write(6, io.BytesIO(b'tharrrr'))
+        upload.write(0, io.BytesIO(b'hel'))
+        assert upload.ranges() == [[0, 3], [6, 13]]
+        assert upload.offset == 3
+        upload.write(3, io.BytesIO(b'lo '))
+        assert upload.ranges() == [[0, 13]]
+        assert upload.is_complete()
+
+    def test_records_partial_writes(self, tmpdir):
+        class Dropped(object):
+            def __init__(self):
+                self.reads = 0
+
+            def read(self, size):
+                self.reads += 1
+                if self.reads > 1:
+                    raise IOError('connection dropped')
+                return b'hello '
+
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm', size=13)
+        with pytest.raises(IOError):
+            upload.write(0, Dropped())
+        assert upload.offset == 6
+
+    def test_finalize_trims_to_received_bytes(self, tmpdir):
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm')
+        upload.write(0, io.BytesIO(b'hello tharrrr'))
+        with open(upload.finalize(), 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+
+class TestStageFile(object):
+
+    def test_copies_streams_next_to_destination(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        tmp_path, digests = storage.stage_file(io.BytesIO(b'hello tharrrr'), destination)
+        assert os.path.dirname(tmp_path) == str(tmpdir)
+        assert not os.path.exists(destination)
+        assert digests['size'] == 13
+
+    def test_links_named_files(self, tmpdir):
+        source = os.path.join(str(tmpdir), 'spooled')
+        with open(source, 'wb') as f:
+            f.write(b'hello tharrrr')
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        tmp_path, digests = storage.stage_file(source, destination)
+        assert os.stat(tmp_path).st_ino == os.stat(source).st_ino
+        assert 'file_identity' not in digests
+
+    def test_commit(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        tmp_path, _ = storage.stage_file(io.BytesIO(b'hello tharrrr'), destination)
+        identity = storage.commit_staged(tmp_path, destination)
+        assert identity == storage.file_identity(destination)
+        assert os.listdir(str(tmpdir)) == ['ceph.rpm']
+
+    def test_discard(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        tmp_path, _ = storage.stage_file(io.BytesIO(b'hello tharrrr'), destination)
+        storage.discard_staged(tmp_path)
+        assert os.listdir(str(tmpdir)) == []
+
+
+class TestDeduplicate(object):
+
+    def write(self, path, contents=b'hello tharrrr'):
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return storage.checksums(path)
+
+    def test_first_copy_is_stored(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'ceph.rpm')
+        digests = self.write(path)
+        assert storage.deduplicate(path, digests['checksum']) == path
+        stored = storage.object_path(digests['checksum'])
+        assert os.stat(stored).st_ino == os.stat(path).st_ino
+
+    def test_copies_share_the_stored_object(self, tmpdir):
+        first = os.path.join(str(tmpdir), 'first.rpm')
+        second = os.path.join(str(tmpdir), 'second.rpm')
+        digests = self.write(first)
+        storage.deduplicate(first, digests['checksum'])
+        self.write(second)
+        linked = storage.deduplicate(second, digests['checksum'])
+        assert not os.path.exists(second)
+        assert os.stat(linked).st_ino == os.stat(first).st_ino
+
+    def test_size_mismatch_is_not_linked(self, tmpdir):
+        first = os.path.join(str(tmpdir), 'first.rpm')
+        second = os.path.join(str(tmpdir), 'second.rpm')
+        digests = self.write(first)
+        storage.deduplicate(first, digests['checksum'])
+        self.write(second)
+        assert storage.deduplicate(second, digests['checksum'], size=1) == second
+
+    def test_can_be_disabled(self, tmpdir):
+        pecan.conf.deduplicate_binaries = False
+        try:
+            path = os.path.join(str(tmpdir), 'ceph.rpm')
+            digests = self.write(path)
+            storage.deduplicate(path, digests['checksum'])
+            assert not os.path.exists(storage.object_path(digests['checksum']))
+        finally:
+            pecan.conf.deduplicate_binaries = True
+
+    def test_saved_files_are_deduplicated(self, tmpdir):
+        first = os.path.join(str(tmpdir), 'first.rpm')
+        second = os.path.join(str(tmpdir), 'second.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), first)
+        result = storage.save_file(io.BytesIO(b'hello tharrrr'), second)
+        assert os.stat(first).st_ino == os.stat(second).st_ino
+        assert result['file_identity'] == storage.file_identity(second)
+        assert sorted(os.listdir(str(tmpdir))) == ['.objects', 'first.rpm', 'second.rpm']
+
+    def test_same_contents_saved_again(self, tmpdir):
+        destination = os.path.join(str(tmpdir), 'ceph.rpm')
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        storage.save_file(io.BytesIO(b'hello tharrrr'), destination)
+        assert sorted(os.listdir(str(tmpdir))) == ['.objects', 'ceph.rpm']
+
+    def test_in_place(self, tmpdir):
+        pecan.conf.deduplicate_binaries = False
+        try:
+            first = os.path.join(str(tmpdir), 'first.rpm')
+            second = os.path.join(str(tmpdir), 'second.rpm')
+            digests = storage.save_file(io.BytesIO(b'hello tharrrr'), first)
+            storage.save_file(io.BytesIO(b'hello tharrrr'), second)
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        checksum = digests['checksum']
+        assert storage.deduplicate_in_place(first, checksum, storage.file_identity(first)) is False
+        assert storage.deduplicate_in_place(second, checksum, storage.file_identity(second)) is True
+        assert os.stat(first).st_ino == os.stat(second).st_ino
+        assert sorted(os.listdir(str(tmpdir))) == ['.objects', 'first.rpm', 'second.rpm']
+
+    def test_in_place_skips_changed_files(self, tmpdir):
+        first = os.path.join(str(tmpdir), 'first.rpm')
+        second = os.path.join(str(tmpdir), 'second.rpm')
+        digests = storage.save_file(io.BytesIO(b'hello tharrrr'), first)
+        pecan.conf.deduplicate_binaries = False
+        try:
+            second_digests = storage.save_file(io.BytesIO(b'hello tharrrr'), second)
+        finally:
+            pecan.conf.deduplicate_binaries = True
+        with open(second, 'wb') as f:
+            f.write(b'something changed')
+        assert storage.deduplicate_in_place(
+            second, digests['checksum'], second_digests['file_identity']) is False
+        assert os.stat(first).st_ino != os.stat(second).st_ino
+        with open(storage.object_path(digests['checksum']), 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_changed_objects_are_not_shared(self, tmpdir):
+        first = os.path.join(str(tmpdir), 'first.rpm')
+        second = os.path.join(str(tmpdir), 'second.rpm')
+        digests = self.write(first)
+        storage.deduplicate(first, digests['checksum'])
+        # same size, different contents
+        with open(first, 'wb') as f:
+            f.write(b'hello THARRRR')
+        self.write(second)
+        assert storage.deduplicate(second, digests['checksum'], digests['size']) == second
+        stored = storage.object_path(digests['checksum'])
+        assert os.stat(stored).st_ino == os.stat(second).st_ino
+        with open(first, 'rb') as f:
+            assert f.read() == b'hello THARRRR'
+
+    def test_objects_are_hashed_once(self, tmpdir, monkeypatch):
+        first, second, third = [
+            os.path.join(str(tmpdir), name) for name in ('first.rpm', 'second.rpm', 'third.rpm')
+        ]
+        digests = self.write(first)
+        self.write(second)
+        self.write(third)
+        storage.deduplicate(first, digests['checksum'])
+        storage.deduplicate(second, digests['checksum'])
+
+        def fail(path):
+            raise AssertionError('%s should not be read again' % path)
+
+        monkeypatch.setattr(storage, 'checksums', fail)
+        linked = storage.deduplicate(third, digests['checksum'])
+        assert os.stat(linked).st_ino == os.stat(first).st_ino
+
+
+class TestRelease(object):
+
+    def save(self, tmpdir, name):
+        path = os.path.join(str(tmpdir), name)
+        return path, storage.save_file(io.BytesIO(b'hello tharrrr'), path)
+
+    def test_keeps_objects_still_in_use(self, tmpdir):
+        first, digests = self.save(tmpdir, 'first.rpm')
+        second, _ = self.save(tmpdir, 'second.rpm')
+        storage.release(first, digests['checksum'])
+        assert not os.path.exists(first)
+        assert os.path.exists(storage.object_path(digests['checksum']))
+
+    def test_removes_the_last_reference(self, tmpdir):
+        first, digests = self.save(tmpdir, 'first.rpm')
+        second, _ = self.save(tmpdir, 'second.rpm')
+        storage.release(first, digests['checksum'])
+        storage.release(second, digests['checksum'])
+        assert not os.path.exists(storage.object_path(digests['checksum']))
+
+    def test_missing_files_raise(self, tmpdir):
+        with pytest.raises(OSError):
+            storage.release(os.path.join(str(tmpdir), 'missing.rpm'), 'f' * 128)
+
+
+
+class TestCopyRange(object):
+
+    def files(self, tmpdir, contents=b'hello tharrrr'):
+        source = os.path.join(str(tmpdir), 'source')
+        with open(source, 'wb') as f:
+            f.write(contents)
+        return open(source, 'rb'), open(os.path.join(str(tmpdir), 'dest'), 'w+b')
+
+    def test_copies_at_offsets(self, tmpdir):
+        src, dst = self.files(tmpdir)
+        with src, dst:
+            storage.copy_range(src.fileno(), 6, dst.fileno(), 2, 7)
+            dst.seek(0)
+            assert dst.read() == b'\0\0tharrrr'
+
+    def test_without_copy_file_range(self, tmpdir, monkeypatch):
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+        src, dst = self.files(tmpdir)
+        with src, dst:
+            storage.copy_range(src.fileno(), 0, dst.fileno(), 0, 13)
+            dst.seek(0)
+            assert dst.read() == b'hello tharrrr'
+
+    def test_short_source(self, tmpdir):
+        src, dst = self.files(tmpdir)
+        with src, dst:
+            with pytest.raises(ValueError):
+                storage.copy_range(src.fileno(), 10, dst.fileno(), 0, 13)
+
+
+class TestStagedUploadCopy(object):
+
+    def test_copies_and_records_pieces(self, tmpdir):
+        source = os.path.join(str(tmpdir), 'source')
+        with open(source, 'wb') as f:
+            f.write(b'hello tharrrr')
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm', size=13)
+        assert upload.copy([(0, source, 0, 6), (6, source, 6, 3)]) == 9
+        assert upload.ranges() == [[0, 9]]
+        upload.write(9, io.BytesIO(b'rrrr'))
+        with open(upload.finalize(), 'rb') as f:
+            assert f.read() == b'hello tharrrr'
+
+    def test_pieces_past_the_size(self, tmpdir):
+        source = os.path.join(str(tmpdir), 'source')
+        with open(source, 'wb') as f:
+            f.write(b'hello tharrrr')
+        upload = storage.StagedUpload.create(str(tmpdir), name='ceph.rpm', size=5)
+        with pytest.raises(ValueError):
+            upload.copy([(0, source, 0, 13)])
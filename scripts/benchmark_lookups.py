@@ -0,0 +1,194 @@
+"""
+Time the queries chacra uses to resolve binary and repo URLs, with and without
+the composite lookup indexes (``ix_binaries_lookup`` and ``ix_repos_lookup``).
+
+The database is filled with synthetic binaries and repos, so it must be an
+empty, scratch database (it is not cleaned up afterwards)::
+
+    createdb chacrabench
+    python scripts/benchmark_lookups.py postgresql:///chacrabench --binaries 500000
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+from chacra import models
+
+
+PROJECTS = ['ceph', 'ceph-deploy', 'ceph-ansible', 'nfs-ganesha', 'samba', 'radosgw-agent']
+DISTROS = {
+    'centos': ['7', '8', '9'],
+    'ubuntu': ['focal', 'jammy', 'noble'],
+    'debian': ['bullseye', 'bookworm'],
+    'fedora': ['39', '40'],
+}
+ARCHS = ['x86_64', 'aarch64', 'noarch', 'source']
+FLAVORS = ['default', 'notcmalloc', 'crimson']
+NAMES = 40
+
+
+def lookups(binary, repo):
+    """
+    The queries to time, as (description, SQL, parameters). The parameters
+    come from an existing binary and repo so that every lookup finds a row.
+    """
+    return [
+        (
+            'single binary (BinaryController)',
+            'SELECT * FROM binaries WHERE project_id = :project_id AND ref = :ref '
+            'AND sha1 = :sha1 AND distro = :distro AND distro_version = :distro_version '
+            'AND arch = :arch AND flavor = :flavor AND name = :name',
+            binary,
+        ),
+        (
+            'arch listing (ArchController)',
+            'SELECT * FROM binaries WHERE project_id = :project_id AND ref = :ref '
+            'AND sha1 = :sha1 AND distro = :distro AND distro_version = :distro_version '
+            'AND arch = :arch',
+            binary,
+        ),
+        (
+            'flavor listing (FlavorController)',
+            'SELECT * FROM binaries WHERE project_id = :project_id AND ref = :ref '
+            'AND sha1 = :sha1 AND distro = :distro AND distro_version = :distro_version '
+            'AND arch = :arch AND flavor = :flavor',
+            binary,
+        ),
+        (
+            'single repo (RepoController)',
+            'SELECT * FROM repos WHERE project_id = :project_id AND ref = :ref '
+            'AND sha1 = :sha1 AND distro = :distro AND distro_version = :distro_version '
+            'AND flavor = :flavor',
+            repo,
+        ),
+        (
+            'distro repos (repos DistroController)',
+            'SELECT * FROM repos WHERE project_id = :project_id AND ref = :ref '
+            'AND sha1 = :sha1 AND distro = :distro',
+            repo,
+        ),
+    ]
+
+
+def populate(engine, count, seed=0):
+    rng = random.Random(seed)
+    project_ids = []
+    with engine.begin() as conn:
+        for name in PROJECTS:
+            result = conn.execute(models.Project.__table__.insert(), name=name)
+            project_ids.append(result.inserted_primary_key[0])
+
+    repos = {}
+    binaries = []
+    versions = [(d, v) for d, vs in DISTROS.items() for v in vs]
+
+    def builds():
+        # like real builds: every (project, ref, sha1) produces binaries for
+        # many distros, archs and flavors at once
+        for build in itertools.count():
+            project_id = rng.choice(project_ids)
+            ref = 'ref-%s' % rng.randint(0, 300)
+            sha1 = '%040x' % rng.getrandbits(160)
+            for (distro, version), arch, flavor in itertools.product(versions, ARCHS, FLAVORS):
+                for n in range(rng.randint(1, NAMES)):
+                    yield project_id, ref, sha1, distro, version, arch, flavor, 'pkg-%s.%s' % (n, arch)
+
+    keys = ['project_id', 'ref', 'sha1', 'distro', 'distro_version', 'arch', 'flavor', 'name']
+    for row in itertools.islice(builds(), count):
+        repo_key = row[:5] + (row[6],)
+        if repo_key not in repos:
+            repos[repo_key] = len(repos) + 1
+        binary = dict(zip(keys, row))
+        binary['repo_id'] = repos[repo_key]
+        binaries.append(binary)
+
+    repo_keys = ['project_id', 'ref', 'sha1', 'distro', 'distro_version', 'flavor']
+    repo_rows = [dict(zip(repo_keys, key), id=id) for key, id in repos.items()]
+    with engine.begin() as conn:
+        for table, rows in ((models.Repo.__table__, repo_rows), (models.Binary.__table__, binaries)):
+            for i in range(0, len(rows), 10000):
+                conn.execute(table.insert(), rows[i:i+10000])
+        conn.execute('ANALYZE binaries')
+        conn.execute('ANALYZE repos')
+
+
+def samples(engine, count, seed=1):
+    rng = random.Random(seed)
+    with engine.connect() as conn:
+        total = conn.execute('SELECT max(id) FROM binaries').scalar()
+        result = []
+        for _ in range(count):
+            binary = dict(conn.execute(
+                'SELECT project_id, ref, sha1, distro, distro_version, arch, flavor, name, repo_id '
+                'FROM binaries WHERE id = %s', rng.randint(1, total)).first())
+            repo = dict(conn.execute(
+                'SELECT project_id, ref, sha1, distro, distro_version, flavor '
+                'FROM repos WHERE id = %s', binary.pop('repo_id')).first())
+            result.append((binary, repo))
+        return result
+
+
+def run(engine, params, repeat):
+    timings = {}
+    plans = {}
+    with engine.connect() as conn:
+        for binary, repo in params:
+            for description, sql, values in lookups(binary, repo):
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    conn.execute(text(sql), values).fetchall()
+                    timings.setdefault(description, []).append(time.perf_counter() - start)
+                if description not in plans:
+                    plan = conn.execute(text('EXPLAIN ' + sql), values).fetchall()
+                    plans[description] = plan[0][0].split('  (cost')[0].strip()
+    return timings, plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url', help='SQLAlchemy URL of an empty scratch database')
+    parser.add_argument('--binaries', type=int, default=200000, help='binaries to create')
+    parser.add_argument('--lookups', type=int, default=200, help='different binaries to look up')
+    parser.add_argument('--repeat', type=int, default=5, help='times each lookup is repeated')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if inspect(engine).get_table_names():
+        parser.error('the database needs to be empty')
+    models.Base.metadata.create_all(engine)
+    print('creating %s binaries...' % args.binaries)
+    populate(engine, args.binaries)
+    params = samples(engine, args.lookups)
+
+    with engine.begin() as conn:
+        conn.execute('DROP INDEX ix_binaries_lookup')
+        conn.execute('DROP INDEX ix_repos_lookup')
+        conn.execute('ANALYZE binaries')
+        conn.execute('ANALYZE repos')
+    before, before_plans = run(engine, params, args.repeat)
+
+    with engine.begin() as conn:
+        for index in models.Binary.__table__.indexes | models.Repo.__table__.indexes:
+            if index.name in ('ix_binaries_lookup', 'ix_repos_lookup'):
+                index.create(conn)
+        conn.execute('ANALYZE binaries')
+        conn.execute('ANALYZE repos')
+    after, after_plans = run(engine, params, args.repeat)
+
+    print('%-40s %12s %12s %8s' % ('lookup', 'before (ms)', 'after (ms)', 'speedup'))
+    for description in before:
+        old = statistics.median(before[description]) * 1000
+        new = statistics.median(after[description]) * 1000
+        print('%-40s %12.3f %12.3f %7.1fx' % (description, old, new, old / new))
+    print('')
+    for description in before:
+        print('%s\n  before: %s\n  after:  %s' % (
+            description, before_plans[description], after_plans[description]))
+
+
+if __name__ == '__main__':
+    main()
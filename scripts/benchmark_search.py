@@ -0,0 +1,166 @@
+"""
+Time substring searches on binary names (``/search/?name-has=...``), with and
+without the trigram index (``ix_binaries_name_trgm``). It needs PostgreSQL with
+the ``pg_trgm`` extension available (it comes with ``postgresql-contrib``).
+
+The database is filled with synthetic binaries, so it must be an empty,
+scratch database (it is not cleaned up afterwards)::
+
+    createdb chacrabench
+    python scripts/benchmark_search.py postgresql:///chacrabench --binaries 1000000
+
+With a million binaries on PostgreSQL 18.6 (one CPU, median of 9 runs, in
+milliseconds) selective searches go from a parallel sequential scan to a
+bitmap scan of the trigram index. Common ones keep walking the index on
+``created`` until the page is full, with or without it::
+
+    search               name-has             rows   before    after
+    rare package         nfs-ganesha-ceph     1001   21.179   23.330
+    package and version  librbd1-18.2         1001  354.246   60.134
+    exact build          18.2.1-194              7  327.103   30.415
+    debug packages       -debuginfo           1001    6.210    7.018
+    very common          ceph                 1001    6.646    9.263
+    no matches           kraken-0.1              0  203.063    0.483
+"""
+import argparse
+import datetime
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+from chacra import models
+from chacra.controllers.search import escape_like, max_limit
+from chacra.models.binaries import name_trigram_index
+
+
+PROJECTS = ['ceph', 'ceph-deploy', 'ceph-ansible', 'nfs-ganesha', 'samba', 'radosgw-agent']
+PACKAGES = [
+    'ceph', 'ceph-base', 'ceph-common', 'ceph-fuse', 'ceph-mds', 'ceph-mgr',
+    'ceph-mgr-dashboard', 'ceph-mgr-cephadm', 'ceph-mon', 'ceph-osd', 'ceph-radosgw',
+    'ceph-selinux', 'ceph-test', 'ceph-volume', 'cephadm', 'cephfs-top', 'libcephfs2',
+    'libcephfs-devel', 'librados2', 'librados-devel', 'libradosstriper1', 'librbd1',
+    'librbd-devel', 'librgw2', 'python3-ceph-argparse', 'python3-ceph-common',
+    'python3-cephfs', 'python3-rados', 'python3-rbd', 'python3-rgw', 'rbd-fuse',
+    'rbd-mirror', 'rbd-nbd', 'nfs-ganesha', 'nfs-ganesha-ceph', 'samba-vfs-ceph',
+]
+DISTROS = [('el8', 'x86_64'), ('el9', 'x86_64'), ('el9', 'aarch64'), ('noarch', 'noarch')]
+
+# (description, substring) as a client would pass it to ``name-has``
+SEARCHES = [
+    ('rare package', 'nfs-ganesha-ceph'),
+    ('package and version', 'librbd1-18.2'),
+    ('exact build', '18.2.1-194'),
+    ('debug packages', '-debuginfo'),
+    ('very common', 'ceph'),
+    ('no matches', 'kraken-0.1'),
+]
+
+# the query of SearchController for ``name-has``, a single page
+SEARCH_SQL = (
+    "SELECT * FROM binaries WHERE name LIKE :pattern ESCAPE '\\' "
+    'ORDER BY created, id LIMIT :limit'
+)
+
+
+def populate(engine, count, seed=0):
+    rng = random.Random(seed)
+    project_ids = []
+    with engine.begin() as conn:
+        for name in PROJECTS:
+            result = conn.execute(models.Project.__table__.insert(), name=name)
+            project_ids.append(result.inserted_primary_key[0])
+
+    start = datetime.datetime(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        package = rng.choice(PACKAGES)
+        if rng.random() < 0.3:
+            package += '-debuginfo'
+        version = '%s.2.%s-%s' % (rng.randint(12, 19), rng.randint(0, 9), rng.randint(0, 999))
+        release, arch = rng.choice(DISTROS)
+        rows.append(dict(
+            name='%s-%s.%s.%s.rpm' % (package, version, release, arch),
+            project_id=rng.choice(project_ids),
+            ref='ref-%s' % rng.randint(0, 300),
+            sha1='%040x' % rng.getrandbits(160),
+            distro='centos',
+            distro_version=release,
+            arch=arch,
+            flavor='default',
+            created=start + datetime.timedelta(seconds=i * 60),
+            modified=start + datetime.timedelta(seconds=i * 60),
+            size=rng.randint(1024, 1024 ** 3),
+        ))
+        if len(rows) == 10000:
+            with engine.begin() as conn:
+                conn.execute(models.Binary.__table__.insert(), rows)
+            rows = []
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(models.Binary.__table__.insert(), rows)
+        conn.execute('ANALYZE binaries')
+
+
+def run(engine, repeat):
+    timings = {}
+    plans = {}
+    with engine.connect() as conn:
+        for description, value in SEARCHES:
+            values = dict(pattern='%%%s%%' % escape_like(value), limit=max_limit + 1)
+            # once without timing it, so that every search starts with a warm cache
+            conn.execute(text(SEARCH_SQL), values).fetchall()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = conn.execute(text(SEARCH_SQL), values).fetchall()
+                timings.setdefault(description, []).append(time.perf_counter() - start)
+            plan = conn.execute(text('EXPLAIN ' + SEARCH_SQL), values).fetchall()
+            plans[description] = (len(rows), ' -> '.join(
+                line[0].split('  (cost')[0].strip(' ->') for line in plan
+                if '(cost' in line[0]
+            ))
+    return timings, plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url', help='SQLAlchemy URL of an empty scratch database')
+    parser.add_argument('--binaries', type=int, default=1000000, help='binaries to create')
+    parser.add_argument('--repeat', type=int, default=5, help='times each search is repeated')
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if inspect(engine).get_table_names():
+        parser.error('the database needs to be empty')
+    models.Base.metadata.create_all(engine)
+    if name_trigram_index not in [i['name'] for i in inspect(engine).get_indexes('binaries')]:
+        parser.error('the pg_trgm extension is not available, install postgresql-contrib')
+    print('creating %s binaries...' % args.binaries)
+    populate(engine, args.binaries)
+
+    with engine.begin() as conn:
+        conn.execute('DROP INDEX %s' % name_trigram_index)
+        conn.execute('ANALYZE binaries')
+    before, before_plans = run(engine, args.repeat)
+
+    with engine.begin() as conn:
+        conn.execute('CREATE INDEX %s ON binaries USING gin (name gin_trgm_ops)' % name_trigram_index)
+        conn.execute('ANALYZE binaries')
+    after, after_plans = run(engine, args.repeat)
+
+    print('%-24s %-20s %6s %12s %12s %8s' % (
+        'search', 'name-has', 'rows', 'before (ms)', 'after (ms)', 'speedup'))
+    for description, value in SEARCHES:
+        old = statistics.median(before[description]) * 1000
+        new = statistics.median(after[description]) * 1000
+        print('%-24s %-20s %6s %12.3f %12.3f %7.1fx' % (
+            description, value, after_plans[description][0], old, new, old / new))
+    print('')
+    for description, _ in SEARCHES:
+        print('%s\n  before: %s\n  after:  %s' % (
+            description, before_plans[description][1], after_plans[description][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -50,5 +50,6 @@ setup(
     entry_points="""
         [pecan.command]
         populate=chacra.commands.populate:PopulateCommand
+        deduplicate=chacra.commands.deduplicate:DeduplicateCommand
         """
 )